@@ -1,21 +1,79 @@
+import asyncio  # For awaiting password work running in the worker pool
 import datetime  # For handling token expiry times
+import functools  # For building the password context once, on first use
+import hashlib  # For keying the token cache by token hash
+import math  # For deriving the auto-tuned bcrypt cost
+import time  # For computing how long a verified token may stay cached
+from concurrent.futures import ThreadPoolExecutor  # Dedicated pool for bcrypt work
 
-from fastapi import Security, HTTPException  # FastAPI components for security and error handling
+from fastapi import Security, HTTPException, Depends  # FastAPI components for security and error handling
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials  # For bearer token extraction
 from passlib.context import CryptContext  # For password hashing and verification
 import jwt  # For encoding and decoding JWT tokens
+from sqlalchemy import event, inspect  # ORM events used to invalidate cached users
 from starlette import status  # For HTTP status codes
 
-from repos.user_repos import find_user  # Custom repository function to retrieve a user from storage
+from auth.keys import load_key_set  # JWKS signing key set
+from cache.cache import TTLCache  # Bounded in-process TTL/LRU cache
+from config.config import TOKEN_CACHE_SIZE, TOKEN_CACHE_TTL, USER_CACHE_SIZE, USER_CACHE_TTL, \
+    PASSWORD_POOL_SIZE, PASSWORD_QUEUE_DEPTH, PASSWORD_RETRY_AFTER, BCRYPT_ROUNDS, BCRYPT_TARGET_MS, \
+    JWT_KEYS_FILE, JWT_ACTIVE_KID, JWT_SECRET
+from db.db import get_async_read_session  # Per-request async session on the read pool
+from metrics.metrics import PASSWORD_DURATION  # bcrypt timing metric
+from models.user_models import User  # User model, watched for updates and deletes
+from repos.user_repos import find_user_async  # Custom repository function to retrieve a user from storage
+
+
+def bcrypt_rounds(setting=BCRYPT_ROUNDS, target_ms=BCRYPT_TARGET_MS):
+    """
+    Resolve the bcrypt cost factor.
+    'auto' times one hash at cost 10 and scales it (each extra round doubles the work)
+    so that a hash takes roughly target_ms; otherwise the setting is used as-is.
+    """
+    if setting != 'auto':
+        return int(setting)
+    start = time.perf_counter()
+    CryptContext(schemes=['bcrypt'], bcrypt__rounds=10).hash('calibration')
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    return min(max(10 + round(math.log2(target_ms / elapsed_ms)), 10), 16)
+
+
+@functools.lru_cache(maxsize=None)
+def password_context():
+    """
+    bcrypt password context; hashes made with a different cost are flagged for rehashing on the next login.
+    Built on first use rather than at import, since BCRYPT_ROUNDS=auto times a hash to pick the cost.
+    """
+    return CryptContext(schemes=['bcrypt'], bcrypt__rounds=bcrypt_rounds())
+
+
+def warm_up_passwords():
+    """Build the password context and load the bcrypt backend now instead of on the first login."""
+    password_context().handler().get_backend()
+
 
 # AuthHandler encapsulates all authentication related functions
 class AuthHandler:
     # Initialize HTTPBearer for extracting token from request headers
     security = HTTPBearer()
-    # Create a password context with bcrypt scheme for secure password hashing
-    pwd_context = CryptContext(schemes=['bcrypt'])
-    # Secret key used for JWT encoding/decoding; 🔹 CUSTOMIZE THIS in production (store securely)
-    secret = 'supersecret'
+    # Dedicated pool for password work; bcrypt releases the GIL so threads hash in parallel
+    password_executor = ThreadPoolExecutor(max_workers=PASSWORD_POOL_SIZE, thread_name_prefix='bcrypt')
+    # Maximum number of password jobs running or queued before new ones are rejected with 503
+    password_queue_limit = PASSWORD_POOL_SIZE + PASSWORD_QUEUE_DEPTH
+    password_jobs = 0
+    # Secret key used for HS256 JWT encoding/decoding when no signing key set is configured
+    secret = JWT_SECRET
+    # Asymmetric signing keys, parsed once at import; None means HS256 with `secret`
+    key_set = load_key_set(JWT_KEYS_FILE, JWT_ACTIVE_KID) if JWT_KEYS_FILE else None
+    # Verified tokens (sha256 of token -> subject); entries never outlive the token's 'exp'
+    token_cache = TTLCache(maxsize=TOKEN_CACHE_SIZE, ttl=TOKEN_CACHE_TTL, name='token')
+    # Resolved users (username -> detached User); invalidated when a user row is updated or deleted
+    user_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL, name='user')
+
+    @property
+    def pwd_context(self):
+        """The shared bcrypt password context (see password_context)."""
+        return password_context()
 
     def get_password_hash(self, password):
         """Hash the plain text password using bcrypt."""
@@ -25,6 +83,42 @@ class AuthHandler:
         """Verify a plain text password against the hashed version."""
         return self.pwd_context.verify(pwd, hashed_pwd)
 
+    def verify_and_update_password(self, pwd, hashed_pwd):
+        """
+        Verify a password and return (verified, new_hash).
+        new_hash is set when the stored hash uses an outdated cost and should be replaced.
+        """
+        return self.pwd_context.verify_and_update(pwd, hashed_pwd)
+
+    async def run_password_job(self, func, *args):
+        """
+        Run a password function in the dedicated pool.
+        Raises a 503 with Retry-After when too many jobs are already running or queued,
+        so login bursts are shed instead of starving the rest of the API.
+        """
+        if AuthHandler.password_jobs >= self.password_queue_limit:
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                                detail='Too many authentication requests, try again later',
+                                headers={'Retry-After': str(PASSWORD_RETRY_AFTER)})
+        def timed_job():
+            # Timed inside the worker thread so queueing time is not counted as bcrypt time
+            with PASSWORD_DURATION.labels(func.__name__).time():
+                return func(*args)
+
+        AuthHandler.password_jobs += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.password_executor, timed_job)
+        finally:
+            AuthHandler.password_jobs -= 1
+
+    async def get_password_hash_async(self, password):
+        """Hash a password in the password pool."""
+        return await self.run_password_job(self.get_password_hash, password)
+
+    async def verify_and_update_password_async(self, pwd, hashed_pwd):
+        """Verify (and possibly rehash) a password in the password pool."""
+        return await self.run_password_job(self.verify_and_update_password, pwd, hashed_pwd)
+
     def encode_token(self, user_id):
         """
         Encode a JWT token with an expiration time.
@@ -37,20 +131,62 @@ class AuthHandler:
             'iat': datetime.datetime.utcnow(),
             'sub': user_id
         }
-        return jwt.encode(payload, self.secret, algorithm='HS256')
+        if self.key_set is None:
+            return jwt.encode(payload, self.secret, algorithm='HS256')
+        key = self.key_set.active
+        return jwt.encode(payload, key.key, algorithm=key.algorithm_name, headers={'kid': key.key_id})
+
+    def verify_token(self, token):
+        """
+        Verify a JWT's signature and expiry and return its payload.
+        With a key set, the key is picked by the token's kid and only that key's algorithm is accepted.
+        """
+        if self.key_set is None:
+            return jwt.decode(token, self.secret, algorithms=['HS256'])
+        verifier = self.key_set.verifier(jwt.get_unverified_header(token).get('kid'))
+        if verifier is None:
+            raise jwt.InvalidTokenError('Unknown signing key')
+        public_key, algorithm = verifier
+        return jwt.decode(token, public_key, algorithms=[algorithm])
 
     def decode_token(self, token):
         """
         Decode a JWT token.
+        Tokens that were already verified are served from the token cache.
         Raises an HTTPException if the token is expired or invalid.
         """
+        key = hashlib.sha256(token.encode()).hexdigest()
+        subject = self.token_cache.get(key)
+        if subject is not None:
+            return subject
         try:
-            payload = jwt.decode(token, self.secret, algorithms=['HS256'])
-            return payload['sub']
+            payload = self.verify_token(token)
         except jwt.ExpiredSignatureError:
             raise HTTPException(status_code=401, detail='Expired signature')
         except jwt.InvalidTokenError:
             raise HTTPException(status_code=401, detail='Invalid token')
+        # Cache the subject until the token expires (or the cache TTL, whichever is sooner)
+        self.token_cache.set(key, payload['sub'], ttl=min(payload['exp'] - time.time(), self.token_cache.ttl))
+        return payload['sub']
+
+    def invalidate_token(self, token):
+        """Drop a token from the verified-token cache (e.g. on logout or revocation)."""
+        self.token_cache.delete(hashlib.sha256(token.encode()).hexdigest())
+
+    @classmethod
+    def invalidate_user(cls, username):
+        """Drop a user from the current-user cache so the next request reloads it."""
+        cls.user_cache.delete(username)
+
+    @classmethod
+    def jwks(cls):
+        """Public keys that verify this API's tokens, as a JWKS document (empty with HS256)."""
+        return cls.key_set.public_jwks if cls.key_set is not None else {'keys': []}
+
+    @classmethod
+    def cache_stats(cls):
+        """Hit/miss counters for the token and user caches."""
+        return {'token': cls.token_cache.stats(), 'user': cls.user_cache.stats()}
 
     def auth_wrapper(self, auth: HTTPAuthorizationCredentials = Security(security)):
         """
@@ -59,9 +195,11 @@ class AuthHandler:
         """
         return self.decode_token(auth.credentials)
 
-    def get_current_user(self, auth: HTTPAuthorizationCredentials = Security(security)):
+    async def get_current_user(self, auth: HTTPAuthorizationCredentials = Security(security),
+                               session=Depends(get_async_read_session)):
         """
         Retrieve the current user by decoding the token and then using the username to fetch user data.
+        Users are served from the user cache when possible, skipping the database lookup.
         Raises an exception if credentials cannot be validated or the user is not found.
         """
         credentials_exception = HTTPException(
@@ -71,7 +209,22 @@ class AuthHandler:
         username = self.decode_token(auth.credentials)
         if username is None:
             raise credentials_exception
-        user = find_user(username)  # 🔹 CUSTOMIZE: Replace this with your actual DB query if needed
+        user = self.user_cache.get(username)
+        if user is not None:
+            return user
+        user = await find_user_async(session, username)  # 🔹 CUSTOMIZE: Replace this with your actual DB query if needed
         if user is None:
             raise credentials_exception
+        # Detach the user so the cached object is not tied to this request's session
+        session.expunge(user)
+        self.user_cache.set(username, user)
         return user
+
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def invalidate_cached_user(mapper, connection, target):
+    """Invalidate the cached user whenever its row is updated or deleted (old username included)."""
+    AuthHandler.invalidate_user(target.username)
+    for old_username in inspect(target).attrs.username.history.deleted:
+        AuthHandler.invalidate_user(old_username)
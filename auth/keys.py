@@ -0,0 +1,94 @@
+import argparse  # For the key generation command line
+import json  # For reading and writing key set files
+import os  # For creating the key file with restrictive permissions
+
+from jwt import PyJWK  # Parses a JWK into a ready-to-use key object
+from jwt.algorithms import ECAlgorithm, OKPAlgorithm  # JWK export for Ed25519 and P-256 keys
+
+# Asymmetric algorithms accepted for signing keys
+ALGORITHMS = ('EdDSA', 'ES256')
+
+
+class KeySet:
+    """
+    JWKS-style signing key set. Keys are parsed once, when the set is loaded, and looked up by kid;
+    the active key signs new tokens and every key in the set verifies.
+
+    To rotate: add a new key to the file, make it active (JWT_ACTIVE_KID, or last in the file),
+    restart the workers, and remove the old key once the tokens it signed have expired.
+    """
+
+    def __init__(self, jwks, active_kid=None):
+        self.keys = {}
+        # kid -> (public key object, algorithm); verifying with the private key would derive this on every call
+        self.verifiers = {}
+        public = []
+        for jwk in jwks['keys']:
+            key = PyJWK(jwk)
+            if key.key_id is None or key.algorithm_name not in ALGORITHMS:
+                raise ValueError(f'Signing keys need a kid and one of the algorithms {ALGORITHMS}')
+            self.keys[key.key_id] = key
+            self.verifiers[key.key_id] = (key.key.public_key(), key.algorithm_name)
+            public.append(public_jwk(key))
+        if not self.keys:
+            raise ValueError('The key set is empty')
+        self.active_kid = active_kid or list(self.keys)[-1]
+        if self.active_kid not in self.keys:
+            raise ValueError(f'Unknown active kid {self.active_kid!r}')
+        # Published at /.well-known/jwks.json; never contains private key material
+        self.public_jwks = {'keys': public}
+
+    @property
+    def active(self):
+        """The key used to sign new tokens."""
+        return self.keys[self.active_kid]
+
+    def verifier(self, kid):
+        """(public key, algorithm) for the given kid, or None if the kid is not in the set."""
+        return self.verifiers.get(kid)
+
+
+def public_jwk(key):
+    """Public JWK (with kid, alg and use) of a parsed private key."""
+    algorithm = OKPAlgorithm if key.algorithm_name == 'EdDSA' else ECAlgorithm
+    jwk = algorithm.to_jwk(key.key.public_key(), as_dict=True)
+    return {**jwk, 'kid': key.key_id, 'alg': key.algorithm_name, 'use': 'sig'}
+
+
+def load_key_set(path, active_kid=None):
+    """Load a private key set from a JWKS JSON file."""
+    with open(path) as f:
+        return KeySet(json.load(f), active_kid)
+
+
+def generate_jwk(alg, kid):
+    """Generate a private JWK for the given algorithm."""
+    from cryptography.hazmat.primitives.asymmetric import ec, ed25519
+
+    if alg == 'EdDSA':
+        jwk = OKPAlgorithm.to_jwk(ed25519.Ed25519PrivateKey.generate(), as_dict=True)
+    elif alg == 'ES256':
+        jwk = ECAlgorithm.to_jwk(ec.generate_private_key(ec.SECP256R1()), as_dict=True)
+    else:
+        raise ValueError(f'Unsupported algorithm {alg!r}')
+    return {**jwk, 'kid': kid, 'alg': alg, 'use': 'sig'}
+
+
+if __name__ == '__main__':
+    # Usage: python -m auth.keys --file jwks.json --kid 2026-10 [--alg EdDSA]
+    parser = argparse.ArgumentParser(description='Add a new signing key to a JWKS key set file.')
+    parser.add_argument('--file', required=True, help='private key set file (created if missing)')
+    parser.add_argument('--kid', required=True, help='key id of the new key')
+    parser.add_argument('--alg', choices=ALGORITHMS, default='EdDSA', help='signing algorithm')
+    args = parser.parse_args()
+    jwks = {'keys': []}
+    if os.path.exists(args.file):
+        with open(args.file) as f:
+            jwks = json.load(f)
+    if any(jwk.get('kid') == args.kid for jwk in jwks['keys']):
+        parser.error(f'kid {args.kid!r} is already in {args.file}')
+    jwks['keys'].append(generate_jwk(args.alg, args.kid))
+    # Private keys: readable by the owner only
+    with open(os.open(args.file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as f:
+        json.dump(jwks, f, indent=2)
+    print(f'added {args.alg} key {args.kid} to {args.file}; it becomes the active key unless JWT_ACTIVE_KID is set')
@@ -0,0 +1,159 @@
+"""
+Change feed check and benchmark.
+
+Launches uvicorn against a scratch database, opens several event streams on
+/gems/changes/stream, then updates, bulk-creates and deletes gems through the
+API. Checks that every stream, a stream resumed with Last-Event-ID and paging
+through /gems/changes all see the same changes, in order and without gaps, and
+reports the delay between a write's response and its event reaching the
+streams. Any failed check makes the script exit with status 1.
+
+    python benchmarks/change_feed.py --streams 50 --writes 200
+"""
+import argparse  # For command line options
+import asyncio  # For the concurrent streams
+import os  # For the uvicorn environment
+import socket  # For picking a free port
+import subprocess  # For launching uvicorn
+import sys  # For the python executable and the exit status
+import time  # For timing
+
+from common import REPO_ROOT, percentile, seed_gems, use_scratch_database  # Helpers shared by the benchmarks
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument('--streams', type=int, default=50, help='event streams kept open during the writes')
+parser.add_argument('--writes', type=int, default=200, help='single-gem updates sent')
+parser.add_argument('--interval', type=float, default=0.01, help='seconds between updates')
+parser.add_argument('--db', help='database file to use (default: a temporary file)')
+args = parser.parse_args()
+
+url = use_scratch_database(args.db)
+os.environ.setdefault('BCRYPT_ROUNDS', '4')
+
+import httpx  # noqa: E402
+
+failures = []
+
+
+def check(condition, message):
+    print(('ok    ' if condition else 'FAIL  ') + message)
+    if not condition:
+        failures.append(message)
+
+
+def create_seller(count):
+    """Create a seller owning `count` gems; returns a bearer token and the gem ids."""
+    from sqlalchemy import update
+    from sqlmodel import Session, SQLModel, select
+
+    from auth.auth import AuthHandler
+    from db.db import engine
+    from listing.listing import rebuild_listings
+    from models.gem_models import Gem
+    from models.user_models import User
+
+    seed_gems(count + 100)
+    SQLModel.metadata.create_all(engine)
+    handler = AuthHandler()
+    with Session(engine) as session:
+        seller = User(username='change_feed_seller', email='feed@example.com', is_seller=True,
+                      password=handler.get_password_hash('bench_password'))
+        session.add(seller)
+        session.commit()
+        ids = session.exec(select(Gem.id).order_by(Gem.id).limit(count)).all()
+        session.exec(update(Gem).where(Gem.id.in_(ids)).values(seller_id=seller.id))
+        session.commit()
+    rebuild_listings(engine)  # The ownership change bypassed the write endpoints
+    return handler.encode_token('change_feed_seller'), ids
+
+
+async def collect(client, received, since=None, headers=None):
+    """Read a stream until cancelled, appending (change id, arrival time) to received."""
+    params = {'since': since} if since is not None else {}
+    async with client.stream('GET', '/gems/changes/stream', params=params, headers=headers) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if line.startswith('id: '):
+                received.append((int(line[4:]), time.perf_counter()))
+
+
+async def page_all(client, since):
+    """Change ids after since, read page by page from /gems/changes."""
+    ids = []
+    while True:
+        body = (await client.get('/gems/changes', params={'since': since, 'limit': 100})).json()
+        ids += [change['id'] for change in body['changes']]
+        since = body['next_since']
+        if not body['has_more']:
+            return ids
+
+
+async def run(port, token, gem_ids):
+    headers = {'Authorization': f'Bearer {token}'}
+    async with httpx.AsyncClient(base_url=f'http://127.0.0.1:{port}', timeout=60,
+                                 limits=httpx.Limits(max_connections=args.streams + 10)) as client:
+        for _ in range(100):
+            try:
+                await client.get('/')
+                break
+            except httpx.TransportError:
+                await asyncio.sleep(0.1)
+        start = (await client.get('/gems/changes')).json()['next_since']
+        streams = [[] for _ in range(args.streams)]
+        tasks = [asyncio.create_task(collect(client, received, start)) for received in streams]
+        await asyncio.sleep(1)  # Let the streams connect
+
+        written = {}  # change position -> time the write's response arrived
+        for i in range(args.writes):
+            gem_id = gem_ids[i % len(gem_ids)]
+            response = await client.patch(f'/gems/{gem_id}', json={'id': gem_id, 'price': 1000 + i}, headers=headers)
+            response.raise_for_status()
+            written[i] = time.perf_counter()
+            await asyncio.sleep(args.interval)
+        created = (await client.post('/gems/bulk', json=[{'size': 1.5}] * 20, headers=headers)).json()
+        response = await client.delete(f'/gems/{created[0]["id"]}', headers=headers)
+        response.raise_for_status()
+
+        expected = await page_all(client, start)
+        resumed = []
+        tasks.append(asyncio.create_task(collect(client, resumed, headers={'Last-Event-ID': str(expected[10])})))
+        deadline = time.perf_counter() + 10
+        while time.perf_counter() < deadline and not all(
+                len(received) >= len(expected) for received in streams + [resumed]):
+            await asyncio.sleep(0.05)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    check(len(expected) == args.writes + 21, f'/gems/changes has {len(expected)} changes '
+          f'({args.writes} updates, 20 creates, 1 delete)')
+    check(expected == sorted(set(expected)), 'change ids increase')
+    complete = sum(1 for received in streams if [id for id, _ in received] == expected)
+    check(complete == len(streams), f'{complete} of {len(streams)} streams got every change, in order')
+    check([id for id, _ in resumed] == expected[11:], 'a stream resumed with Last-Event-ID gets the rest')
+    delays = sorted(arrived - written[position] for received in streams
+                    for position, (_, arrived) in enumerate(received[:args.writes]))
+    if delays:
+        print(f'write response to event: p50 {percentile(delays, 50) * 1000:.1f} ms, '
+              f'p99 {percentile(delays, 99) * 1000:.1f} ms over {len(delays)} deliveries')
+
+
+def main():
+    token, gem_ids = create_seller(100)
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    server = subprocess.Popen([sys.executable, '-m', 'uvicorn', 'main:app', '--host', '127.0.0.1',
+                               '--port', str(port), '--log-level', 'warning'], cwd=REPO_ROOT,
+                              env=dict(os.environ, DATABASE_URL=url))
+    try:
+        asyncio.run(run(port, token, gem_ids))
+    finally:
+        server.terminate()
+        server.wait()
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
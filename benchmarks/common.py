@@ -0,0 +1,64 @@
+"""
+Helpers shared by the benchmark scripts.
+
+use_scratch_database() must run before any app module is imported, because the
+engines are created at import time from DATABASE_URL.
+"""
+import os  # For pointing the app at the scratch database
+import sys  # For importing the app modules from the repo root
+import tempfile  # For the scratch database file
+
+# Repository root, so the scripts can import the app modules and launch uvicorn from it
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def use_scratch_database(db=None, url=None):
+    """
+    Point the app at a scratch database: the given URL, the given SQLite file,
+    or a new temporary SQLite file. Returns the database URL.
+    """
+    if url is None:
+        url = f'sqlite:///{db or os.path.join(tempfile.mkdtemp(), "bench.db")}'
+    os.environ['DATABASE_URL'] = url
+    os.environ.setdefault('DB_ECHO', 'false')
+    # Every benchmark client comes from one address; set RATE_LIMIT_ENABLED=true to measure with the limiter on
+    os.environ.setdefault('RATE_LIMIT_ENABLED', 'false')
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+    return url
+
+
+def seed_gems(count):
+    """
+    Create the tables and bulk-load random gems until the database holds at least count gems,
+    then rebuild the stats, search index and gem listing the bulk load bypasses. Returns the number of gems added.
+    """
+    from sqlmodel import Session, SQLModel, func, select
+
+    from db.db import engine
+    from listing.listing import rebuild_listings
+    from models.gem_models import Gem
+    from models.job_models import Job  # noqa: F401 (creates the job queue table)
+    from populate import bulk_load_gems, generate_gem_chunks
+    from search.search import create_search_index, rebuild_search_index
+    from stats.stats import refresh_gem_stats
+
+    SQLModel.metadata.create_all(engine)
+    create_search_index(engine)
+    with Session(engine) as session:
+        existing = session.exec(select(func.count(Gem.id))).one()
+    if existing >= count:
+        return 0
+    added = bulk_load_gems(generate_gem_chunks(count - existing, 10000))
+    refresh_gem_stats(engine)
+    rebuild_search_index(engine)
+    rebuild_listings(engine)
+    return added
+
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile (q in 0..100) of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(q / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
@@ -0,0 +1,213 @@
+"""
+Optimistic concurrency check and benchmark for the single-gem write endpoints.
+
+Launches uvicorn (several worker processes) against a scratch database and:
+- walks the ETag / If-Match flow of GET /gem/{id}, PATCH, PUT and DELETE /gems/{id}, and checks a PUT
+  keeps the gem's seller and properties;
+- races many clients doing conditional PATCHes from the same ETag: exactly one
+  may win, the others get 409;
+- runs read-modify-write clients incrementing a gem's price, first with
+  If-Match (retrying on 409: no increment may be lost), then without it, and
+  reports the increments lost that way;
+- checks the /gems/stats summary still matches a full rebuild;
+- reports PATCH latency under contention.
+Any failed check makes the script exit with status 1.
+
+    python benchmarks/concurrent_updates.py --clients 20 --increments 10 --workers 4
+"""
+import argparse  # For command line options
+import asyncio  # For the concurrent clients
+import os  # For the uvicorn environment
+import socket  # For picking a free port
+import subprocess  # For launching uvicorn
+import sys  # For the python executable and the exit status
+import time  # For timing
+
+from common import REPO_ROOT, percentile, seed_gems, use_scratch_database  # Helpers shared by the benchmarks
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument('--clients', type=int, default=20, help='concurrent clients updating the same gem')
+parser.add_argument('--increments', type=int, default=10, help='read-modify-write increments per client')
+parser.add_argument('--workers', type=int, default=4, help='uvicorn worker processes')
+parser.add_argument('--db', help='database file to use (default: a temporary file)')
+args = parser.parse_args()
+
+url = use_scratch_database(args.db)
+os.environ.setdefault('BCRYPT_ROUNDS', '4')
+
+import httpx  # noqa: E402
+
+failures = []
+
+
+def check(condition, message):
+    print(('ok    ' if condition else 'FAIL  ') + message)
+    if not condition:
+        failures.append(message)
+
+
+def create_seller(count):
+    """Create a seller owning `count` gems; returns a bearer token and the gem ids."""
+    from sqlalchemy import update
+    from sqlmodel import Session, SQLModel, select
+
+    from auth.auth import AuthHandler
+    from db.db import engine
+    from listing.listing import rebuild_listings
+    from models.gem_models import Gem
+    from models.user_models import User
+
+    seed_gems(count + 100)
+    SQLModel.metadata.create_all(engine)
+    handler = AuthHandler()
+    with Session(engine) as session:
+        seller = User(username='concurrency_seller', email='concurrency@example.com', is_seller=True,
+                      password=handler.get_password_hash('bench_password'))
+        session.add(seller)
+        session.commit()
+        ids = session.exec(select(Gem.id).order_by(Gem.id).limit(count)).all()
+        session.exec(update(Gem).where(Gem.id.in_(ids)).values(seller_id=seller.id))
+        session.commit()
+    rebuild_listings(engine)  # The ownership change bypassed the write endpoints
+    return handler.encode_token('concurrency_seller'), ids
+
+
+def stats_rows():
+    from sqlmodel import Session, select
+
+    from db.db import engine
+    from models.gem_models import GemStats
+
+    with Session(engine) as session:
+        # Sums to the cent: adding and subtracting prices one by one leaves float noise a full SUM does not have
+        return sorted((tuple({**row.dict(), 'price_sum': round(row.price_sum, 2)}.items())
+                       for row in session.exec(select(GemStats))), key=str)
+
+
+async def check_etag_flow(client, headers, gem_id, other_id):
+    response = await client.get(f'/gem/{gem_id}')
+    etag = response.headers['etag']
+    check(response.json()['version'] == 1 and etag == f'"{gem_id}.1"', f'GET /gem/{{id}} has ETag {etag}')
+    response = await client.patch(f'/gems/{gem_id}', json={'id': gem_id, 'price': 1234},
+                                  headers={**headers, 'If-Match': etag})
+    new_etag = response.headers.get('etag')
+    check(response.status_code == 200 and response.json()['version'] == 2 and new_etag == f'"{gem_id}.2"',
+          f'PATCH with a current If-Match: {response.status_code}, ETag {new_etag}')
+    response = await client.get(f'/gem/{gem_id}', headers={'If-None-Match': etag})
+    check(response.status_code == 200 and response.headers['etag'] == new_etag,
+          'GET with the old ETag in If-None-Match returns the new version')
+    response = await client.patch(f'/gems/{gem_id}', json={'id': gem_id, 'price': 1},
+                                  headers={**headers, 'If-Match': etag})
+    check(response.status_code == 409 and response.headers.get('etag') == new_etag,
+          f'PATCH with a stale If-Match: {response.status_code}, current ETag {response.headers.get("etag")}')
+    before = (await client.get(f'/gem/{gem_id}')).json()
+    # PUT replaces the client-writable columns; the seller and the properties link stay as they are
+    body = {**before, 'price': 999, 'seller_id': None}
+    del body['gem_properties_id']
+    response = await client.put(f'/gems/{gem_id}', json=body, headers={**headers, 'If-Match': f'W/{new_etag}'})
+    check(response.status_code == 200 and response.json()['version'] == 3, f'PUT with a weak If-Match: '
+          f'{response.status_code}')
+    after = (await client.get(f'/gem/{gem_id}')).json()
+    mine = [row['gem']['id'] for row in (await client.get('/gems/seller/me', headers=headers)).json()]
+    check((after['seller_id'], after['gem_properties_id']) == (before['seller_id'], before['gem_properties_id'])
+          and gem_id in mine, f'PUT keeps the seller ({after["seller_id"]}) and the properties '
+          f'({after["gem_properties_id"]}) of the gem')
+    response = await client.delete(f'/gems/{gem_id}', headers={**headers, 'If-Match': new_etag})
+    check(response.status_code == 409, f'DELETE with a stale If-Match: {response.status_code}')
+    response = await client.patch(f'/gems/{gem_id}', json={'id': gem_id, 'price': 1},
+                                  headers={**headers, 'If-Match': f'"{other_id}.3"'})
+    check(response.status_code == 409, f'PATCH with another gem\'s ETag: {response.status_code}')
+    response = await client.delete(f'/gems/{gem_id}', headers={**headers, 'If-Match': f'"{gem_id}.3"'})
+    check(response.status_code == 204, f'DELETE with a current If-Match: {response.status_code}')
+
+
+async def race_conditional(client, headers, gem_id):
+    etag = (await client.get(f'/gem/{gem_id}')).headers['etag']
+    responses = await asyncio.gather(*(
+        client.patch(f'/gems/{gem_id}', json={'id': gem_id, 'price': 2000 + i},
+                     headers={**headers, 'If-Match': etag})
+        for i in range(args.clients)))
+    statuses = sorted(response.status_code for response in responses)
+    check(statuses.count(200) == 1 and statuses.count(409) == args.clients - 1,
+          f'{args.clients} conditional PATCHes from one ETag: {statuses.count(200)} succeeded, '
+          f'{statuses.count(409)} got 409')
+
+
+async def increment(client, headers, gem_id, conditional, latencies):
+    """Add 1 to the gem's price `increments` times by reading it and writing it back."""
+    conflicts = 0
+    for _ in range(args.increments):
+        while True:
+            response = await client.get(f'/gem/{gem_id}')
+            price, etag = response.json()['price'], response.headers['etag']
+            extra = {'If-Match': etag} if conditional else {}
+            start = time.perf_counter()
+            response = await client.patch(f'/gems/{gem_id}', json={'id': gem_id, 'price': price + 1},
+                                          headers={**headers, **extra})
+            latencies.append(time.perf_counter() - start)
+            if response.status_code != 409:
+                response.raise_for_status()
+                break
+            conflicts += 1
+    return conflicts
+
+
+async def run(port, token, gem_ids):
+    headers = {'Authorization': f'Bearer {token}'}
+    async with httpx.AsyncClient(base_url=f'http://127.0.0.1:{port}', timeout=60,
+                                 limits=httpx.Limits(max_connections=args.clients + 5)) as client:
+        for _ in range(100):
+            try:
+                await client.get('/')
+                break
+            except httpx.TransportError:
+                await asyncio.sleep(0.1)
+        await check_etag_flow(client, headers, gem_ids[0], gem_ids[1])
+        await race_conditional(client, headers, gem_ids[1])
+
+        for conditional, gem_id in ((True, gem_ids[2]), (False, gem_ids[3])):
+            start_price = (await client.get(f'/gem/{gem_id}')).json()['price']
+            latencies = []
+            start = time.perf_counter()
+            conflicts = sum(await asyncio.gather(*(increment(client, headers, gem_id, conditional, latencies)
+                                                   for _ in range(args.clients))))
+            elapsed = time.perf_counter() - start
+            gem = (await client.get(f'/gem/{gem_id}')).json()
+            expected = args.clients * args.increments
+            applied = round(gem['price'] - start_price)
+            latencies.sort()
+            label = 'with If-Match' if conditional else 'without If-Match'
+            if conditional:
+                check(applied == expected, f'{label}: {applied} of {expected} increments applied '
+                      f'({conflicts} conflicts retried)')
+            else:
+                print(f'      {label}: {applied} of {expected} increments applied, {expected - applied} lost')
+            check(gem['version'] == 1 + expected, f'{label}: version {gem["version"]} counts every update')
+            print(f'      {label}: PATCH p50 {percentile(latencies, 50) * 1000:.1f} ms, '
+                  f'p99 {percentile(latencies, 99) * 1000:.1f} ms, {len(latencies) / elapsed:.0f} PATCH/s')
+
+
+def main():
+    from stats.stats import refresh_gem_stats
+
+    token, gem_ids = create_seller(10)
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    server = subprocess.Popen([sys.executable, '-m', 'uvicorn', 'main:app', '--host', '127.0.0.1',
+                               '--port', str(port), '--workers', str(args.workers), '--log-level', 'warning'],
+                              cwd=REPO_ROOT, env=dict(os.environ, DATABASE_URL=url))
+    try:
+        asyncio.run(run(port, token, gem_ids))
+    finally:
+        server.terminate()
+        server.wait()
+    incremental = stats_rows()
+    refresh_gem_stats()
+    check(incremental == stats_rows(), 'the /gems/stats summary matches a full rebuild')
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
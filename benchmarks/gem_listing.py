@@ -0,0 +1,224 @@
+"""
+Check and benchmark for the denormalized gem_listing read model (GEM_LISTING_READS).
+
+Launches two uvicorn servers on the same scratch database, one reading the catalogue through the
+gem/gemproperties/user joins and one reading the gem_listing table, with the response cache off, and:
+- checks that both return the same bodies and ETags for the catalogue reads;
+- runs every kind of gem write (single, bulk, If-Match, repricing), checks a created RUBY keeps its type and
+  price, and checks the listing still equals the joined tables, and the two servers still agree;
+- compares the read latency of the two servers per route.
+Any failed check makes the script exit with status 1.
+
+    python benchmarks/gem_listing.py --gems 20000 --requests 200
+"""
+import argparse  # For command line options
+import asyncio  # For the HTTP clients
+import os  # For the uvicorn environment
+import socket  # For picking free ports
+import subprocess  # For launching uvicorn
+import sys  # For the python executable and the exit status
+import time  # For timing
+
+from common import REPO_ROOT, percentile, seed_gems, use_scratch_database  # Helpers shared by the benchmarks
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument('--gems', type=int, default=20000, help='number of gems to seed')
+parser.add_argument('--requests', type=int, default=200, help='sequential requests per route and server')
+parser.add_argument('--db', help='database file to use (default: a temporary file)')
+args = parser.parse_args()
+
+url = use_scratch_database(args.db)
+os.environ.setdefault('BCRYPT_ROUNDS', '4')
+
+import httpx  # noqa: E402
+import orjson  # noqa: E402
+
+SELLER = 'listing_seller'
+# Catalogue reads compared between the servers and timed; {id} is one of the seller's gems
+READS = [
+    '/gems',
+    '/gems?include=seller',
+    '/gems?lte=3000&gte=1000&type=RUBY&type=EMERALD',
+    '/gems?limit=100',
+    '/gems?limit=100&type=DIAMOND&include=seller',
+    '/gems?stream=true&gte=5000',
+    '/gems/search?q=ruby&sort=-price&limit=50',
+    '/gems/search?color=D&color=E&size_min=1&sort=size&limit=100&include=seller',
+    f'/gems/search?q={SELLER}&sort=id&limit=100',
+    '/gem/{id}',
+    '/gem/{id}?include=properties',
+    '/gem/{id}?include=properties&include=seller',
+    '/gems/seller/me',
+    '/gems/seller/me?include=seller',
+]
+
+failures = []
+
+
+def check(condition, message):
+    print(('ok    ' if condition else 'FAIL  ') + message)
+    if not condition:
+        failures.append(message)
+
+
+def create_seller():
+    """Create the seller and hand it 500 gems; returns a bearer token and the gem ids."""
+    from sqlalchemy import update
+    from sqlmodel import Session, select
+
+    from auth.auth import AuthHandler
+    from db.db import engine
+    from listing.listing import rebuild_listings
+    from models.gem_models import Gem
+    from models.user_models import User
+
+    seed_gems(args.gems)
+    handler = AuthHandler()
+    with Session(engine) as session:
+        session.add(User(username=SELLER, email='listing@example.com', is_seller=True,
+                         password=handler.get_password_hash('bench_password')))
+        session.commit()
+        seller_id = session.exec(select(User.id).where(User.username == SELLER)).one()
+        ids = session.exec(select(Gem.id).order_by(Gem.id).limit(500)).all()
+        session.exec(update(Gem).where(Gem.id.in_(ids)).values(seller_id=seller_id))
+        session.commit()
+    rebuild_listings(engine)  # The ownership change bypassed the write endpoints
+    return handler.encode_token(SELLER), ids
+
+
+def listing_matches_source():
+    """Whether gem_listing holds exactly the rows listing.listing builds from the joined tables."""
+    from sqlmodel import Session, select
+
+    from db.db import engine
+    from listing.listing import _listing_rows, listing_table
+    from models.gem_models import Gem
+
+    with Session(engine) as session:
+        listing = session.execute(select(listing_table).order_by(listing_table.c.id)).all()
+        source = session.execute(_listing_rows().order_by(Gem.id)).all()
+    return [tuple(row) for row in listing] == [tuple(row) for row in source], len(listing)
+
+
+def start_server(listing_reads):
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    env = dict(os.environ, DATABASE_URL=url, RESPONSE_CACHE_TTL='0', GEM_LISTING_READS=str(listing_reads).lower())
+    server = subprocess.Popen([sys.executable, '-m', 'uvicorn', 'main:app', '--host', '127.0.0.1',
+                               '--port', str(port), '--log-level', 'warning'], cwd=REPO_ROOT, env=env)
+    return server, httpx.AsyncClient(base_url=f'http://127.0.0.1:{port}', timeout=60)
+
+
+async def wait_ready(client):
+    for _ in range(100):
+        try:
+            await client.get('/')
+            return
+        except httpx.TransportError:
+            await asyncio.sleep(0.1)
+
+
+def content(response):
+    """Parsed body (a list for NDJSON), so that key order does not matter: ORM dicts follow the load order."""
+    if 'ndjson' in response.headers['content-type']:
+        return [orjson.loads(line) for line in response.content.splitlines()]
+    return response.json()
+
+
+async def compare_reads(joined, listing, headers, gem_id, stage):
+    """Check that both servers answer every read identically."""
+    mismatches = []
+    for path in READS:
+        path = path.format(id=gem_id)
+        a, b = await joined.get(path, headers=headers), await listing.get(path, headers=headers)
+        if a.status_code != 200 or (a.status_code, content(a), a.headers.get('etag')) != \
+                (b.status_code, content(b), b.headers.get('etag')):
+            mismatches.append(path)
+    check(not mismatches, f'{stage}: both read models return the same {len(READS)} responses '
+          f'{"" if not mismatches else mismatches}')
+
+
+async def write_workload(client, headers, ids):
+    """Every kind of gem write, through the listing server."""
+    from pricing.pricing import price_gems
+
+    statuses = []
+    response = await client.post('/gems', headers=headers, json={
+        'gem_pr': {'size': 2.5, 'clarity': 3, 'color': 'E'},
+        'gem': {'price': 0, 'available': True, 'gem_type': 'RUBY'}})
+    statuses.append(response.status_code)
+    created = response.json()
+    stored = (await client.get(f'/gem/{created["id"]}')).json()
+    expected = float(price_gems(['RUBY'], [3], ['E'], [2.5])[0])
+    check((created['gem_type'], created['price']) == (stored['gem_type'], stored['price']) == ('RUBY', expected),
+          f'POST /gems stores a RUBY as {stored["gem_type"]} at {stored["price"]} (priced {expected})')
+    body = {**(await client.get(f'/gem/{ids[0]}')).json(), 'available': False, 'gem_type': 'RUBY'}
+    statuses.append((await client.put(f'/gems/{ids[0]}', headers=headers, json=body)).status_code)
+    etag = (await client.get(f'/gem/{ids[1]}')).headers['etag']
+    statuses.append((await client.patch(f'/gems/{ids[1]}', headers={**headers, 'If-Match': etag},
+                                        json={'id': ids[1], 'price': 4321})).status_code)
+    statuses.append((await client.delete(f'/gems/{ids[2]}', headers=headers)).status_code)
+    bulk = [{'gem_type': 'EMERALD', 'size': 1.2, 'clarity': 2, 'color': 'D'} for _ in range(20)]
+    statuses.append((await client.post('/gems/bulk', headers=headers, json=bulk)).status_code)
+    bulk = [{'id': id, 'price': 777, 'available': False} for id in ids[3:23]]
+    statuses.append((await client.request('PATCH', '/gems/bulk', headers=headers, json=bulk)).status_code)
+    statuses.append((await client.request('DELETE', '/gems/bulk', headers=headers, json=ids[23:33])).status_code)
+    check(statuses == [200, 200, 200, 204, 200, 200, 200], f'writes through the endpoints: {statuses}')
+
+
+async def time_reads(clients, headers, gem_id):
+    """p50 latency per read route and client, in ms; the clients take turns so both see the same conditions."""
+    results = {}
+    for path in READS:
+        path = path.format(id=gem_id)
+        latencies = [[] for _ in clients]
+        for _ in range(args.requests):
+            for client, timings in zip(clients, latencies):
+                start = time.perf_counter()
+                response = await client.get(path, headers=headers)
+                response.raise_for_status()
+                timings.append(time.perf_counter() - start)
+        results[path] = [percentile(sorted(timings), 50) * 1000 for timings in latencies]
+    return results
+
+
+async def run(token, ids):
+    from pricing.pricing import reprice_gems
+
+    headers = {'Authorization': f'Bearer {token}'}
+    joined_server, joined = start_server(False)
+    listing_server, listing = start_server(True)
+    try:
+        await wait_ready(joined)
+        await wait_ready(listing)
+        matches, rows = listing_matches_source()
+        check(matches, f'after seeding: gem_listing matches the joined tables ({rows} gems)')
+        await compare_reads(joined, listing, headers, ids[0], 'after seeding')
+
+        await write_workload(listing, headers, ids)
+        reprice_gems(chunk_size=5000)
+        matches, rows = listing_matches_source()
+        check(matches, f'after writes and repricing: gem_listing matches the joined tables ({rows} gems)')
+        await compare_reads(joined, listing, headers, ids[0], 'after writes and repricing')
+
+        timings = await time_reads((joined, listing), headers, ids[0])
+        print(f'\n{"p50 ms, response cache off":<78} {"joined":>8} {"listing":>8}')
+        for path, (before, after) in timings.items():
+            print(f'{path:<78} {before:8.2f} {after:8.2f}  {before / after:4.2f}x')
+    finally:
+        for server, client in ((joined_server, joined), (listing_server, listing)):
+            await client.aclose()
+            server.terminate()
+            server.wait()
+
+
+def main():
+    token, ids = create_seller()
+    asyncio.run(run(token, ids))
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,233 @@
+"""
+Background job queue check and benchmark.
+
+Runs against a scratch database, without any broker:
+- retries: a job failing twice succeeds on its third attempt after backing off,
+  and a job that always fails ends up 'failed' after max_attempts;
+- leases: a job claimed by a runner that died is taken over once its lease runs out;
+- concurrency: a per-job cap and the runner's slot count are never exceeded;
+- throughput: how fast one runner drains a backlog of no-op jobs;
+- through the API: registrations queue welcome emails and gem writes queue search
+  reindexing; reports the request latency and how long until the jobs are done
+  and a new gem shows up in /gems/search.
+Any failed check makes the script exit with status 1.
+
+    python benchmarks/job_queue.py --jobs 2000
+"""
+import argparse  # For command line options
+import asyncio  # For running the job runner
+import os  # For the job settings
+import sys  # For the exit status
+import threading  # For counting concurrently running jobs
+import time  # For timing
+
+from common import percentile, seed_gems, use_scratch_database  # Helpers shared by the benchmarks
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument('--jobs', type=int, default=2000, help='no-op jobs drained for the throughput measurement')
+parser.add_argument('--requests', type=int, default=50, help='registrations and gem creations sent through the API')
+parser.add_argument('--db', help='database file to use (default: a temporary file)')
+args = parser.parse_args()
+
+use_scratch_database(args.db)
+os.environ.setdefault('BCRYPT_ROUNDS', '4')
+os.environ.setdefault('JOB_BACKOFF_BASE', '0.05')  # Retries within a fraction of a second
+os.environ.setdefault('JOB_POLL_INTERVAL', '0.05')
+
+from sqlalchemy import delete, func, update  # noqa: E402
+from sqlmodel import Session, select  # noqa: E402
+
+from db.db import engine  # noqa: E402
+from jobs.jobs import FAILED, JobRunner, claim_jobs, enqueue, job, job_table, run_pending  # noqa: E402
+from models.job_models import Job  # noqa: E402
+
+failures = []
+
+
+def check(condition, message):
+    print(('ok    ' if condition else 'FAIL  ') + message)
+    if not condition:
+        failures.append(message)
+
+
+class Gauge:
+    """Counts the jobs running right now and remembers the peak."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.current = self.peak = 0
+
+    def __enter__(self):
+        with self.lock:
+            self.current += 1
+            self.peak = max(self.peak, self.current)
+
+    def __exit__(self, *exc):
+        with self.lock:
+            self.current -= 1
+
+
+flaky_calls = []
+capped, uncapped = Gauge(), Gauge()
+
+
+@job('bench.flaky', max_attempts=5)
+def flaky(session, fail_times):
+    flaky_calls.append(time.perf_counter())
+    if len(flaky_calls) <= fail_times:
+        raise RuntimeError(f'failure {len(flaky_calls)}')
+
+
+@job('bench.broken', max_attempts=3)
+def broken(session):
+    raise RuntimeError('always fails')
+
+
+@job('bench.capped', concurrency=2)
+def sleep_capped(session):
+    with capped:
+        time.sleep(0.05)
+
+
+@job('bench.sleep')
+def sleep_uncapped(session):
+    with uncapped:
+        time.sleep(0.05)
+
+
+@job('bench.noop')
+def noop(session):
+    pass
+
+
+def add_jobs(name, count=1, **payload):
+    with Session(engine) as session:
+        for _ in range(count):
+            enqueue(session, name, **payload)
+        session.commit()
+
+
+def pending():
+    with Session(engine) as session:
+        return session.exec(select(func.count(Job.id)).where(Job.status != FAILED)).one()
+
+
+async def drain(runner, timeout=60):
+    """Run the runner until no job is left to do."""
+    await runner.start()
+    deadline = time.perf_counter() + timeout
+    while pending() and time.perf_counter() < deadline:
+        await asyncio.sleep(0.01)
+    await runner.stop()
+
+
+def check_retries():
+    add_jobs('bench.flaky', fail_times=2)
+    add_jobs('bench.broken')
+    asyncio.run(drain(JobRunner(concurrency=2, poll_interval=0.01)))
+    check(len(flaky_calls) == 3, f'a job failing twice ran {len(flaky_calls)} times (3 expected)')
+    gaps = [later - earlier for earlier, later in zip(flaky_calls, flaky_calls[1:])]
+    check(len(gaps) == 2 and gaps[0] >= 0.025 and gaps[1] >= 0.05,
+          'retries back off: ' + ', '.join(f'{gap * 1000:.0f} ms' for gap in gaps))
+    with Session(engine) as session:
+        failed = session.exec(select(Job).where(Job.name == 'bench.broken')).one()
+        check(failed.status == FAILED and failed.attempts == 3 and 'always fails' in failed.last_error,
+              f'a job that always fails is {failed.status} after {failed.attempts} attempts')
+        session.exec(delete(Job))
+        session.commit()
+
+
+def check_lease():
+    add_jobs('bench.noop')
+    claimed = claim_jobs(1, lease=60)  # ... and its runner dies
+    check(len(claimed) == 1 and not claim_jobs(1), 'a claimed job is not claimed twice while its lease lasts')
+    with engine.begin() as conn:  # Let the lease run out
+        conn.execute(update(job_table).values(run_at=func.datetime('now', '-1 second')))
+    outcomes = run_pending()
+    check(outcomes == {'done': 1} and not pending(), f'the job is taken over after its lease: {dict(outcomes)}')
+
+
+def check_concurrency():
+    add_jobs('bench.capped', 10)
+    add_jobs('bench.sleep', 20)
+    asyncio.run(drain(JobRunner(concurrency=4, poll_interval=0.01)))
+    check(capped.peak == 2, f'capped job ran at most {capped.peak} at once (cap 2)')
+    check(uncapped.peak == 4, f'other jobs ran at most {uncapped.peak} at once (4 slots)')
+
+
+def measure_throughput():
+    add_jobs('bench.noop', args.jobs)
+    runner = JobRunner(concurrency=4, poll_interval=0.01)
+    start = time.perf_counter()
+    asyncio.run(drain(runner, timeout=300))
+    elapsed = time.perf_counter() - start
+    check(not pending(), f'{args.jobs} no-op jobs drained in {elapsed:.2f}s ({args.jobs / elapsed:.0f} jobs/s)')
+
+
+def check_api():
+    from fastapi.testclient import TestClient
+
+    import main
+    from jobs.jobs import SEARCH_REINDEX, WELCOME_EMAIL
+
+    seed_gems(1000)
+    latencies = []
+    with TestClient(main.app) as client:
+        for i in range(args.requests):
+            start = time.perf_counter()
+            client.post('/registration', json={'username': f'job_user_{i}', 'password': 'bench_password',
+                                               'password2': 'bench_password', 'email': f'job{i}@example.com',
+                                               'is_seller': True}).raise_for_status()
+            latencies.append(time.perf_counter() - start)
+        token = client.post('/login', json={'username': 'job_user_0', 'password': 'bench_password'}).json()['token']
+        headers = {'Authorization': f'Bearer {token}'}
+        latencies.sort()
+        print(f'POST /registration: p50 {percentile(latencies, 50) * 1000:.1f} ms, '
+              f'p99 {percentile(latencies, 99) * 1000:.1f} ms')
+
+        latencies, lags = [], []
+        for _ in range(args.requests):
+            start = time.perf_counter()
+            client.post('/gems/bulk', json=[{'size': 1.5}], headers=headers).raise_for_status()
+            latencies.append(time.perf_counter() - start)
+        with Session(engine) as session:
+            queued = dict(session.exec(select(Job.name, func.count(Job.id)).group_by(Job.name)).all())
+        deadline = time.perf_counter() + 10
+        while pending() and time.perf_counter() < deadline:
+            time.sleep(0.01)
+        check(not pending(), f'welcome email and reindex jobs done ({queued.get(WELCOME_EMAIL, 0)} emails, '
+              f'{queued.get(SEARCH_REINDEX, 0)} reindexes still queued right after the requests)')
+
+        for i in range(1, min(args.requests, 11)):
+            seller = f'job_user_{i}'
+            token = client.post('/login', json={'username': seller, 'password': 'bench_password'}).json()['token']
+            start = time.perf_counter()
+            client.post('/gems/bulk', json=[{'size': 2.5}],
+                        headers={'Authorization': f'Bearer {token}'}).raise_for_status()
+            found = 0
+            while not found and time.perf_counter() - start < 5:
+                found = len(client.get('/gems/search', params={'q': seller, 'limit': 100}).json()['gems'])
+            lags.append(time.perf_counter() - start)
+        check(len([lag for lag in lags if lag < 5]) == len(lags), 'new gems show up in /gems/search')
+    latencies.sort()
+    lags.sort()
+    print(f'POST /gems/bulk (1 gem): p50 {percentile(latencies, 50) * 1000:.1f} ms, '
+          f'p99 {percentile(latencies, 99) * 1000:.1f} ms')
+    print(f'write to search hit: p50 {percentile(lags, 50) * 1000:.1f} ms, max {lags[-1] * 1000:.1f} ms')
+
+
+def main():
+    from sqlmodel import SQLModel
+
+    SQLModel.metadata.create_all(engine)
+    check_retries()
+    check_lease()
+    check_concurrency()
+    measure_throughput()
+    check_api()
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
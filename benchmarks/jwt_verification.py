@@ -0,0 +1,61 @@
+"""
+JWT verification benchmark.
+
+Times token verification for HS256 (the default decode_token path) against
+EdDSA and ES256 key sets, with the key objects parsed once (as AuthHandler
+does) and, for comparison, with the JWK parsed on every call. Also times the
+verified-token cache hit that decode_token serves repeated tokens from.
+
+    python benchmarks/jwt_verification.py --iterations 20000
+"""
+import argparse  # For command line options
+import time  # For timing
+
+from common import use_scratch_database  # Repo imports and a scratch database for the app modules
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument('--iterations', type=int, default=10000, help='verifications per case')
+args = parser.parse_args()
+
+use_scratch_database()
+
+import jwt  # noqa: E402
+
+from auth.auth import AuthHandler  # noqa: E402
+from auth.keys import KeySet, generate_jwk  # noqa: E402
+
+
+def handler_for(key_set):
+    """An AuthHandler signing with the given key set (None for HS256), with an empty token cache."""
+    handler = AuthHandler()
+    handler.key_set = key_set
+    handler.token_cache.clear()
+    return handler
+
+
+def timed(label, func, n=None):
+    n = n or args.iterations
+    start = time.perf_counter()
+    for _ in range(n):
+        func()
+    elapsed = time.perf_counter() - start
+    print(f'{label:<38} {elapsed / n * 1e6:>9.1f} us/op {n / elapsed:>11.0f} ops/s')
+
+
+def main():
+    cases = [('HS256', None)] + [(alg, KeySet({'keys': [generate_jwk(alg, f'{alg}-1')]})) for alg in ('EdDSA', 'ES256')]
+    for name, key_set in cases:
+        handler = handler_for(key_set)
+        token = handler.encode_token('bench_user')
+        print(f'{name} ({len(token)} byte token)')
+        timed('  sign', lambda: handler.encode_token('bench_user'))
+        timed('  verify, parsed key', lambda: handler.verify_token(token))
+        if key_set is not None:
+            jwk = {k: v for k, v in key_set.public_jwks['keys'][0].items()}
+            timed('  verify, JWK parsed per call',
+                  lambda: jwt.decode(token, jwt.PyJWK(jwk).key, algorithms=[name]))
+        timed('  decode_token, cache hit', lambda: handler.decode_token(token))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,286 @@
+"""
+Load test for every gem and user endpoint.
+
+Seeds a scratch database (SQLite by default, or any --db-url such as a local
+PostgreSQL), then drives each route with concurrent requests, either in-process
+through an ASGI client or against a locally launched uvicorn, and reports
+throughput, p50/p95/p99 latency and (in-process) memory allocated per request.
+
+    python benchmarks/load_test.py --gems 100000 --requests 500 --concurrency 20 --output run.json
+    python benchmarks/load_test.py --mode uvicorn --workers 4
+    python benchmarks/load_test.py --compare before.json after.json
+
+bcrypt dominates the /registration and /login numbers; set BCRYPT_ROUNDS to
+benchmark a different cost.
+"""
+import argparse  # For command line options
+import asyncio  # For issuing requests concurrently
+import datetime  # For timestamping results
+import itertools  # For unique usernames and gem ids
+import json  # For the results file
+import os  # For the uvicorn environment
+import platform  # For recording the machine in the results
+import socket  # For picking a free port
+import subprocess  # For launching uvicorn and reading the git revision
+import sys  # For the python executable
+import time  # For timing requests
+import tracemalloc  # For per-request allocations
+
+import httpx  # ASGI and HTTP client
+
+from common import REPO_ROOT, percentile, seed_gems, use_scratch_database  # Helpers shared by the benchmarks
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument('--gems', type=int, default=10000, help='number of gems to seed')
+parser.add_argument('--requests', type=int, default=200, help='requests per route')
+parser.add_argument('--concurrency', type=int, default=10, help='requests in flight at once')
+parser.add_argument('--mode', choices=['asgi', 'uvicorn', 'both'], default='asgi', help='how to drive the app')
+parser.add_argument('--workers', type=int, default=1, help='uvicorn worker processes')
+parser.add_argument('--routes', nargs='+', help='only run these scenarios (see --list)')
+parser.add_argument('--alloc-samples', type=int, default=20, help='sequential requests traced for allocations')
+parser.add_argument('--db', help='SQLite database file to use (default: a temporary file)')
+parser.add_argument('--db-url', help='database URL to use instead, e.g. postgresql://localhost/gems_bench')
+parser.add_argument('--output', help='write the results as JSON to this file')
+parser.add_argument('--list', action='store_true', help='list the scenarios and exit')
+parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help='compare two result files and exit')
+args = parser.parse_args()
+
+SELLER = {'username': 'bench_seller', 'password': 'bench_password', 'password2': 'bench_password',
+          'email': 'seller@example.com', 'is_seller': True}
+
+
+class Scenario:
+    """One route under test; request() returns the (method, url, json body) of the next request."""
+
+    def __init__(self, name, request):
+        self.name = name
+        self.request = request
+
+
+def make_scenarios(state):
+    """Build the scenarios; state holds the seller token and the gem ids the seller owns."""
+    run = os.urandom(4).hex()  # keeps usernames unique across modes and repeated runs
+    usernames = (f'bench_{run}_{i}' for i in itertools.count())
+    edit_ids = itertools.cycle(state['edit_ids'])
+    delete_ids = iter(state['delete_ids'])
+    seller_id = state['seller_id']
+    user = lambda name: {'username': name, 'password': 'bench_password', 'password2': 'bench_password',  # noqa: E731
+                         'email': f'{name}@example.com'}
+    quote = [{'gem_type': t, 'size': 1.5, 'clarity': 2, 'color': 'E'} for t in ('DIAMOND', 'RUBY', 'EMERALD')] * 33
+    scenarios = [
+        Scenario('GET /', lambda: ('GET', '/', None)),
+        Scenario('GET /gems', lambda: ('GET', '/gems', None)),
+        Scenario('GET /gems page', lambda: ('GET', '/gems?limit=100', None)),
+        Scenario('GET /gems filtered', lambda: ('GET', '/gems?type=RUBY&type=EMERALD&gte=1000&lte=20000', None)),
+        Scenario('GET /gems stream', lambda: ('GET', '/gems?stream=true&limit=1000', None)),
+        Scenario('GET /gems/search', lambda: ('GET', '/gems/search?q=ruby&color=D&size_min=1&sort=-price', None)),
+        Scenario('GET /gem/{id}', lambda: ('GET', f'/gem/{next(edit_ids)}', None)),
+        Scenario('POST /gems/price-quote', lambda: ('POST', '/gems/price-quote', quote)),
+        Scenario('POST /registration', lambda: ('POST', '/registration', user(next(usernames)))),
+        Scenario('POST /registration/bulk',
+                 lambda: ('POST', '/registration/bulk', [user(next(usernames)) for _ in range(10)])),
+        Scenario('POST /login', lambda: ('POST', '/login', {'username': SELLER['username'],
+                                                            'password': SELLER['password']})),
+        Scenario('GET /users/me', lambda: ('GET', '/users/me', None)),
+        Scenario('GET /gems/seller/me', lambda: ('GET', '/gems/seller/me', None)),
+        Scenario('POST /gems', lambda: ('POST', '/gems', {
+            'gem_pr': {'size': 1.2, 'clarity': 3, 'color': 'F'}, 'gem': {'price': 1, 'gem_type': 'RUBY'}})),
+        Scenario('POST /gems/bulk', lambda: ('POST', '/gems/bulk', [
+            {'gem_type': 'RUBY', 'size': 1.2, 'clarity': 3, 'color': 'F'}] * 100)),
+        Scenario('PUT /gems/{id}', lambda: (lambda gem_id: ('PUT', f'/gems/{gem_id}', {
+            'price': 1234.5, 'available': True, 'gem_type': 'DIAMOND', 'gem_properties_id': gem_id,
+            'seller_id': seller_id}))(next(edit_ids))),
+        Scenario('PATCH /gems/{id}', lambda: (lambda gem_id: ('PATCH', f'/gems/{gem_id}', {
+            'id': gem_id, 'price': 999.0}))(next(edit_ids))),
+        Scenario('DELETE /gems/{id}', lambda: ('DELETE', f'/gems/{next(delete_ids)}', None)),
+        Scenario('GET /metrics', lambda: ('GET', '/metrics', None)),
+    ]
+    if args.routes:
+        scenarios = [s for s in scenarios if s.name in args.routes]
+    return scenarios
+
+
+def prepare_database():
+    """Seed gems, register the seller and hand it the gems used by the edit and delete scenarios."""
+    from sqlalchemy import update
+    from sqlmodel import Session, select
+
+    from auth.auth import AuthHandler
+    from db.db import engine
+    from listing.listing import rebuild_listings
+    from models.gem_models import Gem
+    from models.user_models import User
+
+    seed_gems(args.gems)
+    with Session(engine) as session:
+        seller = session.exec(select(User).where(User.username == SELLER['username'])).first()
+        if seller is None:
+            seller = User(username=SELLER['username'], email=SELLER['email'], is_seller=True,
+                          password=AuthHandler().get_password_hash(SELLER['password']))
+            session.add(seller)
+            session.commit()
+        ids = session.exec(select(Gem.id).order_by(Gem.id.desc()).limit(args.requests + 100)).all()
+        session.exec(update(Gem).where(Gem.id.in_(ids)).values(seller_id=seller.id))
+        session.commit()
+        seller_id = seller.id
+    rebuild_listings(engine)  # The ownership change bypassed the write endpoints
+    return {'seller_id': seller_id, 'edit_ids': ids[:100], 'delete_ids': ids[100:]}
+
+
+async def run_scenario(client, scenario, headers):
+    """Send args.requests requests with args.concurrency in flight; return latency and error stats."""
+    latencies, errors = [], 0
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def one():
+        nonlocal errors
+        method, url, body = scenario.request()
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                response = await client.request(method, url, json=body, headers=headers)
+                await response.aread()
+            except httpx.TransportError:
+                errors += 1  # e.g. the server dropped the connection after an unhandled error
+                return
+            latencies.append(time.perf_counter() - start)
+        if response.status_code >= 400:
+            errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(args.requests)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        'requests': args.requests,
+        'errors': errors,
+        'throughput_rps': round(args.requests / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+    }
+
+
+async def measure_allocations(client, scenario, headers):
+    """Average peak memory allocated per request over a few sequential requests (in-process only)."""
+    peaks = []
+    tracemalloc.start()
+    try:
+        for _ in range(args.alloc_samples):
+            method, url, body = scenario.request()
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+            response = await client.request(method, url, json=body, headers=headers)
+            await response.aread()
+            peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+    finally:
+        tracemalloc.stop()
+    return round(sum(peaks) / len(peaks) / 1024, 1) if peaks else 0.0
+
+
+async def drive(client, state, in_process):
+    """Log the seller in, then run every scenario against the given client."""
+    response = await client.post('/login', json={'username': SELLER['username'], 'password': SELLER['password']})
+    response.raise_for_status()
+    headers = {'Authorization': f'Bearer {response.json()["token"]}'}
+    results = {}
+    for scenario in make_scenarios(state):
+        result = await run_scenario(client, scenario, headers)
+        if in_process and args.alloc_samples and scenario.name != 'DELETE /gems/{id}':
+            result['alloc_kib_per_request'] = await measure_allocations(client, scenario, headers)
+        results[scenario.name] = result
+        print(f'  {scenario.name:<26} {result["throughput_rps"]:>9} rps  p50 {result["p50_ms"]:>8} ms  '
+              f'p95 {result["p95_ms"]:>8} ms  p99 {result["p99_ms"]:>8} ms  errors {result["errors"]}'
+              + (f'  alloc {result["alloc_kib_per_request"]} KiB' if 'alloc_kib_per_request' in result else ''))
+    return results
+
+
+async def run_asgi(state):
+    """Drive the app in-process through httpx's ASGI transport."""
+    from main import app
+
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+        return await drive(client, state, in_process=True)
+
+
+async def run_uvicorn(state, url):
+    """Launch uvicorn on a free local port against the same database and drive it over HTTP."""
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    env = dict(os.environ, DATABASE_URL=url)
+    server = subprocess.Popen([sys.executable, '-m', 'uvicorn', 'main:app', '--host', '127.0.0.1',
+                               '--port', str(port), '--workers', str(args.workers), '--log-level', 'warning'],
+                              cwd=REPO_ROOT, env=env)
+    try:
+        limits = httpx.Limits(max_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=f'http://127.0.0.1:{port}', limits=limits, timeout=60) as client:
+            for _ in range(100):
+                try:
+                    await client.get('/')
+                    break
+                except httpx.TransportError:
+                    await asyncio.sleep(0.1)
+            return await drive(client, state, in_process=False)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def compare(before_path, after_path):
+    """Print the change in throughput and p95/p99 latency per route between two result files."""
+    with open(before_path) as f:
+        before = json.load(f)
+    with open(after_path) as f:
+        after = json.load(f)
+    for mode in after['results']:
+        print(f'[{mode}]')
+        for route, new in after['results'][mode].items():
+            old = before['results'].get(mode, {}).get(route)
+            if old is None:
+                continue
+            change = lambda key: (new[key] - old[key]) / old[key] * 100 if old[key] else 0.0  # noqa: E731
+            print(f'  {route:<26} rps {change("throughput_rps"):+7.1f}%  p95 {change("p95_ms"):+7.1f}%  '
+                  f'p99 {change("p99_ms"):+7.1f}%')
+
+
+def main():
+    if args.compare:
+        return compare(*args.compare)
+    if args.list:
+        state = {'seller_id': 1, 'edit_ids': [1], 'delete_ids': []}
+        for scenario in make_scenarios(state):
+            print(scenario.name)
+        return
+    url = use_scratch_database(args.db, args.db_url)
+    state = prepare_database()
+    revision = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT,
+                              capture_output=True, text=True).stdout.strip()
+    report = {
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'revision': revision,
+        'python': platform.python_version(),
+        'machine': platform.platform(),
+        'database': url.split(':', 1)[0],
+        'params': {'gems': args.gems, 'requests': args.requests, 'concurrency': args.concurrency,
+                   'workers': args.workers},
+        'results': {},
+    }
+    if args.mode in ('asgi', 'both'):
+        print('asgi (in-process)')
+        report['results']['asgi'] = asyncio.run(run_asgi(state))
+    if args.mode in ('uvicorn', 'both'):
+        # The in-process run deleted its gems; hand the seller a fresh set for the server run
+        if args.mode == 'both':
+            state = prepare_database()
+        print(f'uvicorn ({args.workers} worker(s))')
+        report['results']['uvicorn'] = asyncio.run(run_uvicorn(state, url))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'results written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""
+Query-count check for the gem and user read endpoints.
+
+Calls every scenario while the seller owns a few gems, then again after it owns
+many more, counting the SQL statements each request executes. The count must
+not depend on the number of rows returned; any difference (an N+1 lazy load)
+is reported and makes the script exit with status 1.
+
+The repository loaders are checked the same way for each eager-loading strategy,
+with lazy loading (no strategy) shown for comparison.
+
+    python benchmarks/query_counts.py --small 5 --large 500
+"""
+import argparse  # For command line options
+import asyncio  # For the ASGI client
+import os  # For a fast bcrypt cost
+import sys  # For the exit status
+
+from common import seed_gems, use_scratch_database  # Helpers shared by the benchmarks
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument('--small', type=int, default=5, help='gems owned by the seller in the first round')
+parser.add_argument('--large', type=int, default=500, help='gems owned by the seller in the second round')
+parser.add_argument('--db', help='database file to use (default: a temporary file)')
+args = parser.parse_args()
+
+use_scratch_database(args.db)
+os.environ.setdefault('BCRYPT_ROUNDS', '4')
+
+import httpx  # noqa: E402
+from sqlalchemy import event, update  # noqa: E402
+from sqlmodel import Session, select  # noqa: E402
+
+from auth.auth import AuthHandler  # noqa: E402
+from cache.cache import gem_response_cache  # noqa: E402
+from db.db import engine, read_engine, async_engine, async_read_engine, async_read_session_factory  # noqa: E402
+from listing.listing import rebuild_listings  # noqa: E402
+from models.gem_models import Gem  # noqa: E402
+from models.user_models import User  # noqa: E402
+from repos.gem_repository import LOADERS, gem_to_dict, select_gems_async  # noqa: E402
+
+SCENARIOS = [
+    '/gems?limit=100',
+    '/gems?limit=100&include=seller',
+    '/gem/{id}',
+    '/gem/{id}?include=properties',
+    '/gem/{id}?include=properties&include=seller',
+    '/gems/seller/me',
+    '/gems/seller/me?include=seller',
+    '/users/me',
+]
+
+# Statements executed on any engine since the last reset
+statements = [0]
+for counted in (engine, read_engine, async_engine.sync_engine, async_read_engine.sync_engine):
+    event.listen(counted, 'before_cursor_execute', lambda *a: statements.__setitem__(0, statements[0] + 1))
+
+
+def give_seller_gems(seller_id, count):
+    """Hand the seller `count` gems in total; returns the id of one of them."""
+    seed_gems(count + 100)
+    with Session(engine) as session:
+        ids = session.exec(select(Gem.id).order_by(Gem.id).limit(count)).all()
+        session.exec(update(Gem).where(Gem.id.in_(ids)).values(seller_id=seller_id))
+        session.commit()
+    rebuild_listings(engine)  # The ownership change bypassed the write endpoints
+    return ids[0]
+
+
+def create_seller():
+    """Create the seller the scenarios run as; returns its id and a bearer token."""
+    seed_gems(1)  # Creates the tables
+    handler = AuthHandler()
+    with Session(engine) as session:
+        seller = User(username='query_count_seller', email='seller@example.com', is_seller=True,
+                      password=handler.get_password_hash('bench_password'))
+        session.add(seller)
+        session.commit()
+        return seller.id, handler.encode_token(seller.username)
+
+
+async def count_requests(gem_id, token):
+    """Count the statements of one uncached request per scenario."""
+    from main import app
+
+    counts = {}
+    headers = {'Authorization': f'Bearer {token}'}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+        for scenario in SCENARIOS:
+            gem_response_cache.invalidate()
+            AuthHandler.user_cache.clear()
+            statements[0] = 0
+            response = await client.get(scenario.format(id=gem_id), headers=headers)
+            response.raise_for_status()
+            counts[scenario] = statements[0]
+    return counts
+
+
+async def count_loaders(seller_id):
+    """Count the statements of loading and serializing the seller's gems with each loading strategy."""
+    counts = {}
+    include = ['properties', 'seller']
+    for strategy in [None] + list(LOADERS):
+        async with async_read_session_factory() as session:
+            statement = select(Gem).where(Gem.seller_id == seller_id)
+            statements[0] = 0
+            if strategy is None:
+                gems = (await session.exec(statement)).all()
+                # Lazy loading needs the sync greenlet bridge to touch the relationships
+                await session.run_sync(lambda _: [gem_to_dict(gem, include) for gem in gems])
+            else:
+                gems = await select_gems_async(session, statement, include, strategy)
+                [gem_to_dict(gem, include) for gem in gems]
+            counts[f'loader {strategy or "lazy"}'] = statements[0]
+    return counts
+
+
+def measure(seller_id, gem_id, token):
+    counts = asyncio.run(count_requests(gem_id, token))
+    counts.update(asyncio.run(count_loaders(seller_id)))
+    return counts
+
+
+def main():
+    seller_id, token = create_seller()
+    gem_id = give_seller_gems(seller_id, args.small)
+    small = measure(seller_id, gem_id, token)
+    give_seller_gems(seller_id, args.large)
+    large = measure(seller_id, gem_id, token)
+
+    failed = []
+    print(f'{"scenario":<46} {args.small:>8} {args.large:>8}')
+    for name in small:
+        changed = small[name] != large[name]
+        print(f'{name:<46} {small[name]:>8} {large[name]:>8}' + ('  <-- grows with rows' if changed else ''))
+        if changed and name != 'loader lazy':
+            failed.append(name)
+    if failed:
+        print(f'query count depends on result size for: {", ".join(failed)}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
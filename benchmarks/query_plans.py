@@ -0,0 +1,89 @@
+"""
+Query-plan benchmark for the /gems filter paths.
+
+Seeds a scratch SQLite database with populate.create_gems_db, then prints the
+EXPLAIN QUERY PLAN output and latency of every filter combination used by
+GET /gems and GET /gems/seller/me.
+
+    python benchmarks/query_plans.py --gems 100000 --repeat 20
+    python benchmarks/query_plans.py --fail-on-scan   # exit 1 if a filter scans the gem table
+"""
+import argparse  # For command line options
+import statistics  # For latency percentiles
+import sys  # For the exit status
+import time  # For timing queries
+
+from common import use_scratch_database  # Scratch database setup shared by the benchmarks
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument('--gems', type=int, default=10000, help='number of gems to seed')
+parser.add_argument('--sellers', type=int, default=100, help='number of sellers the gems are spread over')
+parser.add_argument('--repeat', type=int, default=20, help='runs per filter combination')
+parser.add_argument('--db', help='database file to use (default: a temporary file)')
+parser.add_argument('--fail-on-scan', action='store_true', help='exit 1 if any plan does a full scan of gem')
+args = parser.parse_args()
+
+use_scratch_database(args.db)
+
+from sqlmodel import Session, SQLModel, func, select  # noqa: E402
+
+from db.db import engine  # noqa: E402
+from models.gem_models import Gem, GemTypes  # noqa: E402
+from populate import create_gems_db  # noqa: E402
+from repos.gem_repository import filter_gems_statement, keyset_page, seller_gems_statement  # noqa: E402
+
+# Filter combinations exercised by the /gems endpoints; only 'all' is expected to scan
+CASES = {
+    'all': filter_gems_statement(),
+    'lte': filter_gems_statement(lte=5000),
+    'gte': filter_gems_statement(gte=50000),
+    'lte+gte': filter_gems_statement(lte=20000, gte=10000),
+    'type': filter_gems_statement(types=[GemTypes.RUBY]),
+    'type+lte+gte': filter_gems_statement(lte=20000, gte=10000, types=[GemTypes.RUBY, GemTypes.EMERALD]),
+    'available+lte': filter_gems_statement(lte=5000).where(Gem.available == True),  # noqa: E712
+    'type page': keyset_page(filter_gems_statement(types=[GemTypes.DIAMOND]), limit=101),
+    'seller': seller_gems_statement(1),
+}
+
+
+def main():
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        existing = session.exec(select(func.count(Gem.id))).one()
+    if existing < args.gems:
+        start = time.perf_counter()
+        create_gems_db(args.gems - existing)
+        print(f'seeded {args.gems - existing} gems in {time.perf_counter() - start:.1f}s')
+    with engine.begin() as conn:
+        # create_gems_db leaves gems without a seller; spread them over a few sellers
+        conn.exec_driver_sql(f'UPDATE gem SET seller_id = id % {args.sellers} + 1 WHERE seller_id IS NULL')
+        conn.exec_driver_sql('ANALYZE')
+
+    scans = []
+    for name, statement in CASES.items():
+        sql = str(statement.compile(engine, compile_kwargs={'literal_binds': True}))
+        with engine.connect() as conn:
+            plan = [row[-1] for row in conn.exec_driver_sql('EXPLAIN QUERY PLAN ' + sql)]
+        timings = []
+        with Session(engine) as session:
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                rows = session.exec(statement).all()
+                timings.append((time.perf_counter() - start) * 1000)
+                session.expunge_all()
+        timings.sort()
+        p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+        print(f'\n== {name}: {len(rows)} rows, median {statistics.median(timings):.2f} ms, p95 {p95:.2f} ms')
+        for step in plan:
+            print(f'   {step}')
+        if name != 'all' and any(step.startswith('SCAN gem') and 'INDEX' not in step for step in plan):
+            scans.append(name)
+
+    if scans:
+        print(f'\nfull scans of gem: {", ".join(scans)}')
+        if args.fail_on_scan:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
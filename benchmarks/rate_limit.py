@@ -0,0 +1,153 @@
+"""
+Rate limiter check and benchmark.
+
+Checks the token-bucket arithmetic of the memory backend and of the Redis
+script (against fakeredis, or a real server with --redis-url), then drives the
+app in-process: an abusive client hammers POST /login while a well-behaved
+client reads /gem/{id} from another address. Reports the abusive client's 429s
+and the well-behaved client's latency with the limiter off and on, and checks a
+route's concurrency cap; any failed check makes the script exit with status 1.
+
+    python benchmarks/rate_limit.py --abusive 400 --requests 100
+"""
+import argparse  # For command line options
+import asyncio  # For the ASGI client
+import os  # For the limiter settings
+import sys  # For the exit status
+import time  # For timing
+
+from common import percentile, seed_gems, use_scratch_database  # Helpers shared by the benchmarks
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument('--abusive', type=int, default=400, help='login attempts sent by the abusive client')
+parser.add_argument('--requests', type=int, default=100, help='reads sent by the well-behaved client')
+parser.add_argument('--redis-url', help='check the Redis script against this server instead of fakeredis')
+parser.add_argument('--db', help='database file to use (default: a temporary file)')
+args = parser.parse_args()
+
+use_scratch_database(args.db)
+os.environ.setdefault('BCRYPT_ROUNDS', '4')
+os.environ['RATE_LIMIT_IP_HEADER'] = 'X-Real-IP'
+
+import httpx  # noqa: E402
+
+from ratelimit.ratelimit import MemoryRateLimitBackend, RateLimitMiddleware, RedisRateLimitBackend  # noqa: E402
+
+failures = []
+
+
+def check(condition, message):
+    print(('ok    ' if condition else 'FAIL  ') + message)
+    if not condition:
+        failures.append(message)
+
+
+def check_backend(name, backend):
+    """A burst of 10 at 5 tokens/s: 10 requests pass, the 11th waits ~0.2s, and refilling lets one more through."""
+    key = f'check:{time.time()}'
+    waits = [backend.take(key, 5, 10) for _ in range(11)]
+    check(all(wait == 0 for wait in waits[:10]), f'{name}: the burst is allowed')
+    check(0.15 < waits[10] <= 0.2, f'{name}: the next request waits {waits[10]:.3f}s for a token')
+    check(backend.take(key, 5, 10, cost=5) > 0.8, f'{name}: a request costing 5 waits for 5 tokens')
+    time.sleep(0.25)
+    check(backend.take(key, 5, 10) == 0, f'{name}: the bucket refills over time')
+
+
+def redis_client():
+    if args.redis_url:
+        import redis
+        return redis.Redis.from_url(args.redis_url)
+    try:
+        import fakeredis
+    except ImportError:
+        return None
+    return fakeredis.FakeRedis()
+
+
+def use_limiter(app, **options):
+    """Swap the limiter in front of the app's routers for one with these options, without rebuilding the app."""
+    app.middleware_stack = None
+    app.user_middleware = [m for m in app.user_middleware if m.cls is not RateLimitMiddleware]
+    app.add_middleware(RateLimitMiddleware, backend=MemoryRateLimitBackend(), ip_header='X-Real-IP', **options)
+
+
+async def drive(limited):
+    """
+    Run both clients at once; returns the abusive client's status counts and Retry-After values,
+    the reader's sorted latencies and the elapsed time.
+    """
+    from main import app
+
+    use_limiter(app, enabled=limited)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+        statuses = {}
+        retry_after = set()
+
+        async def abusive():
+            for i in range(args.abusive):
+                response = await client.post('/login', json={'username': f'nobody{i}', 'password': 'wrong_password'},
+                                             headers={'X-Real-IP': '10.0.0.66'})
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+                if response.status_code == 429:
+                    retry_after.add(response.headers.get('retry-after'))
+
+        async def reader():
+            latencies = []
+            for i in range(args.requests):
+                start = time.perf_counter()
+                response = await client.get(f'/gem/{i % 50 + 1}', headers={'X-Real-IP': '10.0.0.7'})
+                latencies.append(time.perf_counter() - start)
+                response.raise_for_status()
+                await asyncio.sleep(1 / 20)  # Within the default IP rate of 20 per second
+            return sorted(latencies)
+
+        start = time.perf_counter()
+        _, latencies = await asyncio.gather(abusive(), reader())
+    return statuses, retry_after, latencies, time.perf_counter() - start
+
+
+async def concurrent_statuses(cap, count):
+    """
+    Send count GET /gems requests at once from different addresses with the route capped at cap
+    (each with its own limit, so none is a response cache hit that finishes without yielding).
+    """
+    from main import app
+
+    use_limiter(app, enabled=True, policies={('GET', '/gems'): (1, cap)})
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+        responses = await asyncio.gather(*(client.get(f'/gems?limit={i + 1}', headers={'X-Real-IP': f'10.0.1.{i}'})
+                                           for i in range(count)))
+    return sorted(response.status_code for response in responses)
+
+
+def main():
+    check_backend('memory', MemoryRateLimitBackend())
+    client = redis_client()
+    if client is None:
+        print('skip  redis: install fakeredis or pass --redis-url')
+    else:
+        check_backend('redis', RedisRateLimitBackend(client))
+
+    seed_gems(100)
+    for limited in (False, True):
+        statuses, retry_after, latencies, elapsed = asyncio.run(drive(limited))
+        label = 'limiter on ' if limited else 'limiter off'
+        print(f'{label}: abusive client statuses {dict(sorted(statuses.items()))}, '
+              f'reader p50 {percentile(latencies, 50) * 1000:.1f} ms, p99 {percentile(latencies, 99) * 1000:.1f} ms')
+        if limited:
+            check(statuses.get(429, 0) > 0, 'the abusive client is rate limited')
+            check(retry_after and None not in retry_after, f'429s carry Retry-After ({", ".join(sorted(retry_after))})')
+            # A full bucket of 60 tokens, then 20 tokens per second, at 5 tokens per login
+            allowed = statuses.get(401, 0)
+            check(allowed <= (60 + 20 * elapsed) / 5 + 1, f'the abusive client got {allowed} logins in {elapsed:.1f}s')
+    statuses = asyncio.run(concurrent_statuses(2, 10))
+    check(statuses.count(200) >= 2 and 429 in statuses,
+          f'GET /gems capped at 2 concurrent requests: {statuses.count(200)} served, {statuses.count(429)} rejected')
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
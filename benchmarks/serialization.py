@@ -0,0 +1,68 @@
+"""
+Serialization benchmark for the gem list responses.
+
+Compares the previous path (ORM entities encoded with jsonable_encoder and json.dumps,
+as FastAPI does for returned objects) with the read-model path (plain column tuples
+serialized with orjson) at several result sizes.
+
+    python benchmarks/serialization.py --sizes 1000 10000 100000 --repeat 5
+"""
+import argparse  # For command line options
+import json  # For the previous serialization path
+import statistics  # For median timings
+import time  # For timing
+
+from common import seed_gems, use_scratch_database  # Helpers shared by the benchmarks
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000], help='result sizes to compare')
+parser.add_argument('--repeat', type=int, default=5, help='runs per size and path')
+parser.add_argument('--db', help='database file to use (default: a temporary file)')
+args = parser.parse_args()
+
+use_scratch_database(args.db)
+
+import orjson  # noqa: E402
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from sqlmodel import Session, select  # noqa: E402
+
+from db.db import engine  # noqa: E402
+from models.gem_models import Gem, GemProperties  # noqa: E402
+from repos.gem_repository import filter_gems_statement, rows_to_pairs  # noqa: E402
+
+
+def orm_path(session, n):
+    """ORM entities, encoded the way FastAPI encodes a returned {'gems': rows} dict."""
+    start = time.perf_counter()
+    rows = [tuple(row) for row in session.exec(select(Gem, GemProperties).join(GemProperties).limit(n))]
+    fetched = time.perf_counter()
+    body = json.dumps(jsonable_encoder({'gems': rows})).encode()
+    return fetched - start, time.perf_counter() - fetched, len(body)
+
+
+def read_model_path(session, n):
+    """Plain column tuples turned into dicts and serialized with orjson."""
+    start = time.perf_counter()
+    rows = rows_to_pairs(session.exec(filter_gems_statement().limit(n)))
+    fetched = time.perf_counter()
+    body = orjson.dumps({'gems': rows})
+    return fetched - start, time.perf_counter() - fetched, len(body)
+
+
+def main():
+    seed_gems(max(args.sizes))
+
+    print(f'{"rows":>8} {"path":<12} {"query ms":>10} {"serialize ms":>13} {"total ms":>10} {"bytes":>11}')
+    for n in args.sizes:
+        for name, path in (('orm', orm_path), ('read-model', read_model_path)):
+            runs = []
+            for _ in range(args.repeat):
+                with Session(engine) as session:
+                    runs.append(path(session, n))
+            query = statistics.median(r[0] for r in runs) * 1000
+            serialize = statistics.median(r[1] for r in runs) * 1000
+            print(f'{n:>8} {name:<12} {query:>10.1f} {serialize:>13.1f} {query + serialize:>10.1f} {runs[0][2]:>11}')
+
+
+if __name__ == '__main__':
+    main()
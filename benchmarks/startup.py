@@ -0,0 +1,120 @@
+"""
+Startup benchmark.
+
+Runs `python -X importtime -c "import main"` in fresh interpreters and reports
+the total import time with the slowest modules by cumulative and by self time.
+Then times a cold start (a new interpreter importing main, running the lifespan
+startup and serving GET /gems/) against a worker forked from a parent that
+already imported and warmed up the app, as gunicorn does with preload_app.
+
+    python benchmarks/startup.py --runs 5 --top 15
+"""
+import argparse  # For command line options
+import os  # For forking and the child environment
+import subprocess  # For the fresh interpreters
+import sys  # For the python executable
+import time  # For timing
+
+from common import REPO_ROOT, seed_gems, use_scratch_database  # Helpers shared by the benchmarks
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument('--runs', type=int, default=5, help='fresh interpreters per measurement (the median is reported)')
+parser.add_argument('--top', type=int, default=15, help='modules listed by cumulative and by self time')
+parser.add_argument('--db', help='database file to use (default: a temporary file)')
+args = parser.parse_args()
+
+use_scratch_database(args.db)
+os.environ.setdefault('BCRYPT_ROUNDS', '4')
+
+# A new interpreter going from nothing to its first response
+COLD_START = '''
+import time
+start = time.perf_counter()
+from fastapi.testclient import TestClient
+import main
+imported = time.perf_counter()
+with TestClient(main.app) as client:
+    started = time.perf_counter()
+    client.get('/gems/').raise_for_status()
+    print(imported - start, started - start, time.perf_counter() - start)
+'''
+
+
+def median(values):
+    return sorted(values)[len(values) // 2]
+
+
+def import_times():
+    """{module: (self us, cumulative us)} from one `-X importtime` run, and the total in us."""
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import main'], cwd=REPO_ROOT,
+                            capture_output=True, text=True, check=True).stderr
+    modules = {}
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = (field.strip() for field in line[len('import time:'):].split('|'))
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+    return modules, sum(self_us for self_us, _ in modules.values())
+
+
+def report_imports():
+    runs = [import_times() for _ in range(args.runs)]
+    modules, _ = runs[len(runs) // 2]
+    print(f'import main: {median([total for _, total in runs]) / 1000:.0f} ms (median of {args.runs}), '
+          f'{len(modules)} modules')
+    app_modules = {name: times for name, times in modules.items()
+                   if os.path.exists(os.path.join(REPO_ROOT, name.split('.')[0]))}
+    print(f'  of which app modules: {sum(s for s, _ in app_modules.values()) / 1000:.0f} ms self')
+    for title, key in (('cumulative', lambda item: item[1][1]), ('self', lambda item: item[1][0])):
+        print(f'\nslowest by {title} time:')
+        for name, (self_us, cumulative_us) in sorted(modules.items(), key=key, reverse=True)[:args.top]:
+            print(f'  {cumulative_us / 1000:8.1f} ms cumulative {self_us / 1000:8.1f} ms self  {name}')
+
+
+def report_cold_start():
+    runs = []
+    for _ in range(args.runs):
+        output = subprocess.run([sys.executable, '-c', COLD_START], cwd=REPO_ROOT, capture_output=True,
+                                text=True, check=True).stdout
+        runs.append([float(value) for value in output.split()])
+    imported, started, served = (median(column) for column in zip(*runs))
+    print(f'\ncold start: import {imported * 1000:.0f} ms, lifespan startup {(started - imported) * 1000:.0f} ms, '
+          f'first response at {served * 1000:.0f} ms')
+
+
+def report_forked_start():
+    """Import and warm up once, then fork workers and time each one's first response."""
+    from fastapi.testclient import TestClient
+
+    import main
+    from db.db import dispose_engines_after_fork
+
+    main.warm_up()
+    runs = []
+    for _ in range(args.runs):
+        read, write = os.pipe()
+        start = time.perf_counter()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read)
+            dispose_engines_after_fork()
+            with TestClient(main.app) as client:
+                client.get('/gems/').raise_for_status()
+            os.write(write, str(time.perf_counter() - start).encode())
+            os._exit(0)
+        os.close(write)
+        with os.fdopen(read) as pipe:
+            runs.append(float(pipe.read() or 'nan'))
+        os.waitpid(pid, 0)
+    print(f'forked from a preloaded parent: first response at {median(runs) * 1000:.0f} ms')
+
+
+def main():
+    seed_gems(1000)
+    report_imports()
+    report_cold_start()
+    report_forked_start()
+
+
+if __name__ == '__main__':
+    main()
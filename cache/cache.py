@@ -0,0 +1,194 @@
+import hashlib  # For response ETags
+import threading  # Lock so the cache can be shared by threadpool workers
+import time  # Monotonic clock for entry expiry
+from collections import OrderedDict  # Keeps entries in least-recently-used order
+
+from config.config import RESPONSE_CACHE_BACKEND, RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL, REDIS_URL
+from metrics.metrics import record_cache  # Hit/miss counters for the metrics endpoint
+
+
+class TTLCache:
+    """
+    Bounded in-process LRU cache whose entries expire after a time to live.
+    Counts hits and misses so the hit ratio can be reported; named caches also feed /metrics.
+    """
+
+    def __init__(self, maxsize=1024, ttl=60, name=None):
+        self.name = name
+        self.maxsize = maxsize  # Maximum number of entries before the least recently used one is evicted
+        self.ttl = ttl  # Default time to live in seconds
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Return the cached value for key, or default if it is missing or expired."""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] <= time.monotonic():
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                hit = False
+            else:
+                self._data.move_to_end(key)
+                self.hits += 1
+                hit = True
+        if self.name:
+            record_cache(self.name, hit)
+        return item[1] if hit else default
+
+    def set(self, key, value, ttl=None):
+        """Store value under key; ttl overrides the default time to live for this entry."""
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        """Remove key from the cache if present."""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """Remove every entry from the cache."""
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        """Return hit/miss counters, current size and hit ratio."""
+        total = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._data),
+                'hit_ratio': self.hits / total if total else 0.0}
+
+
+class MemoryBackend:
+    """
+    In-process cache backend built on TTLCache.
+    Each gunicorn worker has its own copy, so invalidations only reach the worker that made them;
+    keep the TTL short or use RedisBackend when running several workers.
+    """
+
+    def __init__(self, maxsize=1024, ttl=30):
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, value, ttl):
+        self.cache.set(key, value, ttl=ttl)
+
+    def incr(self, key):
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + 1
+            return self.counters[key]
+
+    def get_counter(self, key):
+        return self.counters.get(key, 0)
+
+
+class RedisBackend:
+    """
+    Shared cache backend for a Redis-compatible client (anything with get, set(ex=) and incr),
+    e.g. redis.Redis or an in-memory fake in tests.
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    def get(self, key):
+        return self.client.get(key)
+
+    def set(self, key, value, ttl):
+        self.client.set(key, value, ex=ttl)
+
+    def incr(self, key):
+        return self.client.incr(key)
+
+    def get_counter(self, key):
+        return int(self.client.get(key) or 0)
+
+
+class ResponseCache:
+    """
+    Cache of serialized JSON responses keyed on normalized request parameters.
+    Invalidation bumps a generation counter that is part of every key, so one call
+    drops all cached responses in the namespace without scanning the backend.
+    """
+
+    def __init__(self, backend, namespace='responses', ttl=30):
+        self.backend = backend
+        self.namespace = namespace
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, name, **params):
+        """Build a cache key from a route name and its parameters (None values dropped, lists sorted)."""
+        parts = []
+        for param, value in sorted(params.items()):
+            if value is None:
+                continue
+            if isinstance(value, (list, tuple, set)):
+                value = ','.join(sorted(str(v) for v in value))
+            parts.append(f'{param}={value}')
+        generation = self.backend.get_counter(f'{self.namespace}:generation')
+        return f'{self.namespace}:{generation}:{name}?{"&".join(parts)}'
+
+    def get(self, key):
+        """Return the cached (etag, body) for key, or None."""
+        value = self.backend.get(key)
+        record_cache(self.namespace, value is not None)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        etag, body = value.split(b'\n', 1)
+        return etag.decode(), body
+
+    def set(self, key, body, etag=None):
+        """Cache a serialized body under key and return its (etag, body); the ETag defaults to a hash of the body."""
+        etag = etag or make_etag(body)
+        self.backend.set(key, etag.encode() + b'\n' + body, self.ttl)
+        return etag, body
+
+    def invalidate(self):
+        """Drop every cached response in this namespace."""
+        self.backend.incr(f'{self.namespace}:generation')
+
+    def stats(self):
+        """Return hit/miss counters and the hit ratio."""
+        total = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_ratio': self.hits / total if total else 0.0}
+
+
+def make_etag(body):
+    """Strong ETag for a response body."""
+    return '"' + hashlib.sha1(body).hexdigest() + '"'
+
+
+def etag_matches(if_none_match, etag):
+    """Check an If-None-Match header value against an ETag."""
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in candidates or etag in candidates or f'W/{etag}' in candidates
+
+
+def make_backend():
+    """Create the backend selected by RESPONSE_CACHE_BACKEND."""
+    if RESPONSE_CACHE_BACKEND == 'redis':
+        import redis  # Optional dependency, only needed for the shared backend
+        return RedisBackend(redis.Redis.from_url(REDIS_URL))
+    return MemoryBackend(maxsize=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL)
+
+
+# Cache for catalogue reads (GET /gems, GET /gem/{id}); invalidated by the gem write endpoints
+gem_response_cache = ResponseCache(make_backend(), namespace='gems', ttl=RESPONSE_CACHE_TTL)
@@ -0,0 +1,223 @@
+import argparse  # For the prune command line
+import asyncio  # For the poller task and the per-stream queues
+import datetime  # For change timestamps and retention
+import enum  # For storing enum values as plain JSON
+import logging  # For reporting failed polls
+
+import orjson  # Events are serialized once per change, not once per stream
+from sqlalchemy import delete, func, insert, text
+from sqlmodel import select
+
+from config.config import CHANGE_POLL_INTERVAL, CHANGE_PAGE_SIZE, CHANGE_STREAM_QUEUE, CHANGE_STREAM_KEEPALIVE, \
+    CHANGE_RETENTION_DAYS
+from db.db import engine, async_read_session_factory  # Writer engine (pruning) and the read pool (polling)
+from models.gem_models import GemChange, GemProperties  # Change log table and the properties of a snapshot
+
+logger = logging.getLogger('changes')
+
+# Operations recorded in the change log
+CREATE, UPDATE, DELETE = 'create', 'update', 'delete'
+# Keys of a snapshot, the same as the GET /gems read model (GEM_FIELDS and PROPS_FIELDS in repos.gem_repository)
+GEM_KEYS = ('id', 'price', 'available', 'gem_type', 'gem_properties_id', 'seller_id', 'version')
+PROPS_KEYS = ('id', 'size', 'clarity', 'color')
+# Transaction-level advisory lock that serializes change log writers on PostgreSQL
+PG_LOCK_KEY = 0x67656d73
+
+change_table = GemChange.__table__
+
+
+def _plain(value):
+    return value.value if isinstance(value, enum.Enum) else value
+
+
+def change_snapshot(session, gem):
+    """The gem and its properties as plain dicts, for the change log; take it before deleting a gem."""
+    props = session.get(GemProperties, gem.gem_properties_id) if gem.gem_properties_id else None
+    return {'gem': {key: _plain(getattr(gem, key)) for key in GEM_KEYS},
+            'props': {key: _plain(getattr(props, key)) for key in PROPS_KEYS} if props else None}
+
+
+def values_snapshot(gem, props=None):
+    """Like change_snapshot, from column values (mappings with GEM_KEYS and PROPS_KEYS) for Core bulk writes."""
+    return {'gem': {key: _plain(gem[key]) for key in GEM_KEYS},
+            'props': {key: _plain(props[key]) for key in PROPS_KEYS} if props else None}
+
+
+def log_gem_changes(session, changes):
+    """
+    Append (op, snapshot) entries to the change log in the caller's transaction, with one multi-row insert.
+    Consumers read ids after the last one they saw, so ids must become visible in order: SQLite has a single
+    writer, and on PostgreSQL an advisory lock held until commit serializes the writers of the log.
+    """
+    if not changes:
+        return
+    if session.get_bind().dialect.name == 'postgresql':
+        session.execute(text('SELECT pg_advisory_xact_lock(:key)'), {'key': PG_LOCK_KEY})
+    now = datetime.datetime.utcnow()
+    session.execute(insert(change_table), [{'gem_id': snapshot['gem']['id'], 'op': op, 'changed_at': now,
+                                            'gem': snapshot} for op, snapshot in changes])
+
+
+def log_gem_change(session, op, snapshot):
+    """Append one change to the change log in the caller's transaction."""
+    log_gem_changes(session, [(op, snapshot)])
+
+
+def change_to_dict(change):
+    return {'id': change.id, 'gem_id': change.gem_id, 'op': change.op,
+            'changed_at': change.changed_at.isoformat(), 'gem': change.gem}
+
+
+async def read_changes(session, since, limit=CHANGE_PAGE_SIZE):
+    """Changes after the `since` id, oldest first, as plain dicts."""
+    statement = select(GemChange).where(GemChange.id > since).order_by(GemChange.id).limit(limit)
+    return [change_to_dict(change) for change in await session.exec(statement)]
+
+
+async def change_head(session):
+    """Id of the latest change (0 for an empty log): where a consumer that has the current catalogue starts."""
+    return (await session.exec(select(func.max(GemChange.id)))).one() or 0
+
+
+async def is_pruned(session, since):
+    """Whether changes after `since` were already pruned, so the consumer has to reload the catalogue."""
+    oldest = (await session.exec(select(func.min(GemChange.id)))).one()
+    return oldest is not None and since < oldest - 1
+
+
+def encode_event(change):
+    """A change as a server-sent event; the id lets EventSource resume with Last-Event-ID."""
+    return b'id: %d\nevent: %s\ndata: %s\n\n' % (change['id'], change['op'].encode(), orjson.dumps(change))
+
+
+class Subscription:
+    """Encoded events waiting to be sent to one stream."""
+
+    def __init__(self, size):
+        self.queue = asyncio.Queue(maxsize=size)
+        self.overflowed = False  # Set when the stream fell too far behind and stopped receiving events
+
+
+class ChangeFeed:
+    """
+    Fans the change log out to this worker's event streams.
+    A single poller task per worker reads new changes every `interval` seconds while anyone is listening,
+    encodes each once and queues it for every stream, so the database load does not grow with the
+    number of streams. Streams that fall CHANGE_STREAM_QUEUE events behind are cut off and reconnect.
+    """
+
+    def __init__(self, interval=CHANGE_POLL_INTERVAL, queue_size=CHANGE_STREAM_QUEUE,
+                 keepalive=CHANGE_STREAM_KEEPALIVE):
+        self.interval = interval
+        self.queue_size = queue_size
+        self.keepalive = keepalive
+        self.subscribers = set()
+        self.last_id = None  # Last change handed to the subscribers
+        self.task = None
+        self.started = None  # Set once the poller knows where the log ends
+
+    async def subscribe(self):
+        """Register a stream; returns once every change after self.last_id is guaranteed to be queued for it."""
+        subscription = Subscription(self.queue_size)
+        self.subscribers.add(subscription)
+        if self.task is None or self.task.done():
+            self.started = asyncio.Event()
+            self.task = asyncio.create_task(self.poll())
+        await self.started.wait()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        self.subscribers.discard(subscription)
+
+    async def close(self):
+        """Stop the poller (app shutdown)."""
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+        self.last_id = None
+
+    def publish(self, changes):
+        """Queue a batch of changes, encoded once, for every stream."""
+        events = [(change['id'], encode_event(change)) for change in changes]
+        for subscription in list(self.subscribers):
+            try:
+                for event in events:
+                    subscription.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                subscription.overflowed = True
+                self.unsubscribe(subscription)
+        self.last_id = changes[-1]['id']
+
+    async def poll(self):
+        """Poll the change log until the last stream goes away."""
+        while self.subscribers:
+            try:
+                async with async_read_session_factory() as session:
+                    if self.last_id is None:
+                        self.last_id = await change_head(session)
+                        self.started.set()
+                        changes = []
+                    else:
+                        changes = await read_changes(session, self.last_id)
+            except Exception:
+                logger.exception('polling the change log failed')
+                changes = []
+            if changes:
+                self.publish(changes)
+            if len(changes) < CHANGE_PAGE_SIZE:
+                await asyncio.sleep(self.interval)
+        # Nobody is listening: the next poller starts from the end of the log again
+        self.last_id = None
+
+    async def stream(self, since=None):
+        """
+        Yield server-sent events: the changes after `since` read from the log (none if since is None),
+        then live changes from the poller, with keep-alive comments while the log is quiet.
+        """
+        subscription = await self.subscribe()
+        try:
+            last = self.last_id if since is None else since
+            while since is not None:
+                async with async_read_session_factory() as session:
+                    changes = await read_changes(session, last)
+                for change in changes:
+                    yield encode_event(change)
+                if changes:
+                    last = changes[-1]['id']
+                if len(changes) < CHANGE_PAGE_SIZE:
+                    break
+            while True:
+                if subscription.overflowed and subscription.queue.empty():
+                    # Too far behind: the client reconnects with Last-Event-ID and catches up from the log
+                    yield b'event: overflow\ndata: {}\n\n'
+                    return
+                try:
+                    id, event = await asyncio.wait_for(subscription.queue.get(), self.keepalive)
+                except asyncio.TimeoutError:
+                    yield b': keep-alive\n\n'
+                    continue
+                if id > last:  # Already sent while catching up
+                    last = id
+                    yield event
+        finally:
+            self.unsubscribe(subscription)
+
+
+# Shared by the streams of this worker
+gem_change_feed = ChangeFeed()
+
+
+def prune_changes(days=CHANGE_RETENTION_DAYS, bind=engine):
+    """Delete changes older than `days` days; consumers further behind get 410 and reload. Returns the count."""
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=days)
+    with bind.begin() as conn:
+        return conn.execute(delete(change_table).where(change_table.c.changed_at < cutoff)).rowcount
+
+
+if __name__ == '__main__':
+    # Usage: python -m changes.changes [--days 7]
+    parser = argparse.ArgumentParser(description='Prune old entries from the gem change log.')
+    parser.add_argument('--days', type=int, default=CHANGE_RETENTION_DAYS, help='days of changes to keep')
+    args = parser.parse_args()
+    engine.echo = False
+    print(f'pruned {prune_changes(args.days)} changes older than {args.days} days')
@@ -1,14 +1,109 @@
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import sessionmaker
 from sqlmodel import create_engine
 from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
 
-# Specify the name of the SQLite database file
-eng = 'database.db'
+from metrics.metrics import instrument_engine, time_pool_checkout  # Query timing, slow-query log and pool metrics
+from config.config import DATABASE_URL, ASYNC_DATABASE_URL, DATABASE_READ_URL, ASYNC_DATABASE_READ_URL, \
+    DB_ECHO, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_PRE_PING, DB_WRITE_TIMEOUT, SQLITE_PROFILE, \
+    SQLITE_JOURNAL_MODE, SQLITE_SYNCHRONOUS, SQLITE_MMAP_SIZE, SQLITE_CACHE_SIZE, SQLITE_BUSY_TIMEOUT, \
+    SQLITE_TEMP_STORE  # Database settings (see config/config.py)
 
-# Construct the SQLite URL (for PostgreSQL, update this URL accordingly)
-sqlite_url = f'sqlite:///{eng}'
+# Database URL (for PostgreSQL, set the DATABASE_URL environment variable)
+sqlite_url = DATABASE_URL
+is_sqlite = DATABASE_URL.startswith('sqlite')
 
-# Create the database engine with echo enabled for SQL logging
-engine = create_engine(sqlite_url, echo=True)
+# SQLite allows one writer at a time, so writes share a single connection and queue for it in the pool
+# instead of fighting over the database lock; PostgreSQL gets a regular pool for writes as well
+if is_sqlite:
+    write_pool = dict(pool_size=1, max_overflow=0, pool_timeout=DB_WRITE_TIMEOUT)
+else:
+    write_pool = dict(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW)
+read_pool = dict(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW)
 
-# Create a Session object bound to the engine for database operations
-session = Session(bind=engine)
+
+def apply_sqlite_pragmas(engine, read_only=False):
+    """Apply the SQLite production profile to every new connection of a (sync) engine."""
+    pragmas = [
+        f'journal_mode={SQLITE_JOURNAL_MODE}',
+        f'synchronous={SQLITE_SYNCHRONOUS}',
+        f'mmap_size={SQLITE_MMAP_SIZE}',
+        f'cache_size={SQLITE_CACHE_SIZE}',
+        f'busy_timeout={SQLITE_BUSY_TIMEOUT}',
+        f'temp_store={SQLITE_TEMP_STORE}',
+    ]
+    if read_only:
+        pragmas.append('query_only=ON')  # Anything but a read on a reader connection is an error
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(f'PRAGMA {pragma}')
+        cursor.close()
+
+
+# Create the database engines; set DB_ECHO=true to log every statement while developing
+# `engine` is the writer; `read_engine` serves queries that never write
+engine = create_engine(sqlite_url, echo=DB_ECHO, **write_pool)
+read_engine = create_engine(DATABASE_READ_URL, echo=DB_ECHO, pool_pre_ping=DB_POOL_PRE_PING, **read_pool)
+
+# Pooled async engines used by the async endpoints and repository functions
+async_engine = create_async_engine(ASYNC_DATABASE_URL, echo=DB_ECHO, pool_pre_ping=DB_POOL_PRE_PING, **write_pool)
+async_read_engine = create_async_engine(ASYNC_DATABASE_READ_URL, echo=DB_ECHO, pool_pre_ping=DB_POOL_PRE_PING,
+                                        **read_pool)
+
+# Every engine (the sync side of the async ones) by its metrics label, and whether it only reads
+ENGINES = (('sync', engine, False), ('sync_read', read_engine, True), ('async', async_engine.sync_engine, False),
+           ('async_read', async_read_engine.sync_engine, True))
+
+for name, sync_engine, read_only in ENGINES:
+    if is_sqlite and SQLITE_PROFILE == 'production':
+        apply_sqlite_pragmas(sync_engine, read_only)
+    instrument_engine(sync_engine, name)
+
+# Factory for short-lived sync sessions; objects stay loaded after commit so they serialize without reloads
+session_factory = sessionmaker(engine, class_=Session, expire_on_commit=False)
+
+# Factories for async sessions; objects stay loaded after commit so they can be returned as-is
+async_session_factory = async_sessionmaker(async_engine, class_=AsyncSession, expire_on_commit=False)
+async_read_session_factory = async_sessionmaker(async_read_engine, class_=AsyncSession, expire_on_commit=False)
+
+
+def get_session():
+    """Yield a Session that lives for a single request."""
+    with session_factory() as session:
+        yield session
+
+
+async def get_async_session():
+    """Yield an AsyncSession that lives for a single request."""
+    async with async_session_factory() as async_session:
+        yield async_session
+
+
+async def get_async_read_session():
+    """Yield an AsyncSession on the read pool for a request that only queries."""
+    async with async_read_session_factory() as async_session:
+        yield async_session
+
+
+def dispose_engines_after_fork():
+    """
+    Give a forked worker fresh connection pools. Connections inherited from the parent are dropped without
+    being closed, so they stay usable by the parent; new ones are opened on demand (gunicorn post_fork hook).
+    The new pools get the checkout timing the old ones had.
+    """
+    for name, sync_engine, _ in ENGINES:
+        sync_engine.dispose(close=False)
+        time_pool_checkout(sync_engine, name)
+
+
+async def close_engines():
+    """Close every pooled connection (app shutdown)."""
+    engine.dispose()
+    read_engine.dispose()
+    await async_engine.dispose()
+    await async_read_engine.dispose()
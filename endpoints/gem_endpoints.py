@@ -1,121 +1,458 @@
 from typing import List, Dict, Union, Optional  # Added Optional for type hints
 
-from fastapi import APIRouter, Security, Depends, Query  # Import required FastAPI classes
-from fastapi.security import HTTPAuthorizationCredentials  # For bearer token credentials
-from sqlmodel import select  # For constructing SQL queries
-from starlette.responses import JSONResponse  # For custom JSON responses with status codes
-from starlette.status import HTTP_204_NO_CONTENT, HTTP_404_NOT_FOUND, HTTP_401_UNAUTHORIZED  # For HTTP status codes
+from fastapi import APIRouter, Depends, Query, HTTPException, Request  # Import required FastAPI classes
+from starlette.responses import JSONResponse, StreamingResponse, Response  # For custom and streamed responses
+from starlette.status import HTTP_204_NO_CONTENT, HTTP_404_NOT_FOUND, HTTP_401_UNAUTHORIZED, HTTP_410_GONE, \
+    HTTP_400_BAD_REQUEST, HTTP_413_REQUEST_ENTITY_TOO_LARGE, HTTP_304_NOT_MODIFIED, HTTP_409_CONFLICT  # HTTP statuses
 from fastapi.encoders import jsonable_encoder  # To encode ORM models to JSON
+from pydantic import ValidationError  # Raised when a bulk item does not validate
+from sqlalchemy.exc import SQLAlchemyError  # Raised when a bulk batch cannot be written
+from sqlalchemy.orm.exc import StaleDataError  # Raised when a versioned delete finds the gem changed
+import orjson  # Fast JSON serialization for read-model responses
 import repos.gem_repository  # Custom repository for gem-related data access
 from endpoints.user_endpoints import auth_handler  # Import authentication handler from user endpoints
-from populate import calculate_gem_price  # Function to calculate gem price; 🔹 CUSTOMIZE if necessary
+from cache.cache import gem_response_cache, etag_matches, make_etag  # Cache for catalogue reads
+from config.config import PRICE_QUOTE_LIMIT, BULK_GEM_LIMIT, BULK_GEM_BATCH_SIZE, CHANGE_PAGE_SIZE
+from pricing.pricing import calculate_gem_price, price_gems  # Gem pricing engine; 🔹 CUSTOMIZE if necessary
+from stats.stats import gem_snapshot, record_gem_change, gem_stats_async  # Precomputed gem statistics
+from jobs.jobs import SEARCH_REINDEX, enqueue  # Search index maintenance runs as a background job
+from listing.listing import sync_listings  # Denormalized gem_listing projection behind the catalogue reads
+from changes.changes import CREATE, DELETE, change_snapshot, log_gem_change, read_changes, change_head, \
+    is_pruned, gem_change_feed  # Gem change log and its event stream
 from models.gem_models import *  # Import all gem-related models; ensure namespace is managed properly
-from db.db import session  # Import the shared database session
+from db.db import get_session, get_async_session, get_async_read_session  # Per-request writer and read-pool sessions
 
 # Create an API router for gem-related endpoints
 gem_router = APIRouter()
 
+def etag_response(request, etag, body):
+    """Return a serialized JSON body with its ETag, or 304 if the client already has this version."""
+    if etag_matches(request.headers.get('if-none-match'), etag):
+        return Response(status_code=HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+    return Response(body, media_type='application/json', headers={'ETag': etag})
+
+def gem_etag(id, version, include=()):
+    """
+    ETag of a gem representation, built from the gem's id and version (and the included relationships):
+    it changes with every update of the gem, so If-Match can be checked without rendering the gem.
+    """
+    return '"' + '.'.join([str(id), str(version)] + [i.value for i in include]) + '"'
+
+def if_match_versions(request, id):
+    """
+    The versions of gem `id` that the request's If-Match header allows overwriting: None without the header
+    or with `*`, else the versions named by its ETags (an empty set, which never matches, if there are none).
+    Weak ETags are accepted as well, since proxies weaken ETags when they compress a response.
+    """
+    header = request.headers.get('if-match')
+    if header is None or header.strip() == '*':
+        return None
+    versions = set()
+    for tag in header.split(','):
+        parts = tag.strip().removeprefix('W/').strip('"').split('.')
+        if len(parts) >= 2 and parts[0] == str(id) and parts[1].isdigit():
+            versions.add(int(parts[1]))
+    return versions
+
+def conflict_response(gem):
+    """409 for a write based on an outdated version of a gem; the ETag lets the client retry against the current one."""
+    return JSONResponse(status_code=HTTP_409_CONFLICT, headers={'ETag': gem_etag(gem.id, gem.version)},
+                        content={'detail': 'Gem was modified by another request', 'version': gem.version})
+
+async def read_bulk_items(request):
+    """
+    Yield the raw items of a bulk request body: a JSON array, or NDJSON (one item per line)
+    parsed as it streams in. Malformed NDJSON lines are yielded as ValueError instances.
+    """
+    if 'ndjson' in request.headers.get('content-type', ''):
+        buffer = b''
+        async for chunk in request.stream():
+            *lines, buffer = (buffer + chunk).split(b'\n')
+            for line in lines:
+                if line.strip():
+                    yield _parse_line(line)
+        if buffer.strip():
+            yield _parse_line(buffer)
+        return
+    try:
+        items = orjson.loads(await request.body())
+    except orjson.JSONDecodeError:
+        raise HTTPException(status_code=HTTP_400_BAD_REQUEST, detail='Body must be a JSON array or NDJSON')
+    if not isinstance(items, list):
+        raise HTTPException(status_code=HTTP_400_BAD_REQUEST, detail='Body must be a JSON array or NDJSON')
+    if len(items) > BULK_GEM_LIMIT:
+        raise HTTPException(status_code=HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                            detail=f'At most {BULK_GEM_LIMIT} gems per request')
+    for item in items:
+        yield item
+
+def _parse_line(line):
+    try:
+        return orjson.loads(line)
+    except orjson.JSONDecodeError:
+        return ValueError('Invalid JSON')
+
+def _item_errors(e):
+    """Flatten a validation error into readable messages."""
+    if isinstance(e, ValidationError):
+        return [f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}" for error in e.errors()]
+    return [str(e)]
+
+async def run_bulk(request, session, parse, write, *args):
+    """
+    Validate the items of a bulk request one by one and write the valid ones BULK_GEM_BATCH_SIZE at a time,
+    each batch in its own transaction through write(sync_session, items, *args), which returns one
+    result dict per item. Returns one result per input item, in order, each with its index and status.
+    """
+    results, batch = [], []
+
+    async def flush():
+        try:
+            written = await session.run_sync(write, [item for _, item in batch], *args)
+            await session.commit()
+        except SQLAlchemyError:
+            await session.rollback()
+            written = [{'status': 500, 'detail': 'Batch could not be written and was rolled back'}] * len(batch)
+        for (index, _), result in zip(batch, written):
+            results[index].update(result)
+        batch.clear()
+
+    index = 0
+    async for raw in read_bulk_items(request):
+        if index >= BULK_GEM_LIMIT:
+            results.append({'index': index, 'status': 413, 'detail': f'At most {BULK_GEM_LIMIT} gems per request'})
+            break
+        try:
+            if isinstance(raw, ValueError):
+                raise raw
+            item = parse(raw)
+        except (ValidationError, TypeError, ValueError) as e:
+            results.append({'index': index, 'status': 422, 'detail': _item_errors(e)})
+        else:
+            results.append({'index': index})
+            batch.append((index, item))
+            if len(batch) >= BULK_GEM_BATCH_SIZE:
+                await flush()
+        index += 1
+    if batch:
+        await flush()
+    if any(result['status'] < 300 for result in results):
+        gem_response_cache.invalidate()  # Cached catalogue reads are now stale
+    return results
+
+def _created(sync_session, items, seller_id):
+    ids = repos.gem_repository.insert_gems(sync_session, items, seller_id)
+    return [{'status': 201, 'id': id} for id in ids]
+
+def _updated(sync_session, items, seller_id):
+    results = repos.gem_repository.update_gems(sync_session, items, seller_id)
+    return [{'status': status, 'id': item.id, 'detail': detail} for item, (status, detail) in zip(items, results)]
+
+def _deleted(sync_session, ids, seller_id):
+    results = repos.gem_repository.delete_gems(sync_session, ids, seller_id)
+    return [{'status': status, 'id': id, 'detail': detail} for id, (status, detail) in zip(ids, results)]
+
+def _gem_id(raw):
+    """A bulk delete item is a gem id or an object with an id."""
+    value = raw['id'] if isinstance(raw, dict) else raw
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise ValueError('Expected a gem id')
+    return value
+
 # Simple endpoint to test connectivity
 @gem_router.get('/')
 def greet():
     return 'Hello production'
 
 # Endpoint to retrieve gems with optional filters
+# Passing `limit` and/or `cursor` switches to keyset pagination ordered by (gem_type, price, id);
+# `stream=true` returns the rows as NDJSON read through a server-side cursor.
+# Non-streamed responses are cached per filter combination and carry an ETag.
+# Properties are always embedded; `include=seller` joins the seller into the same query.
+# With GEM_LISTING_READS (also for /gem/{id}, /gems/search and /gems/seller/me) the rows come from the
+# denormalized gem_listing table, which already holds the properties and seller columns: no joins at all.
 @gem_router.get('/gems', tags=['Gems'])
-def gems(lte: Optional[int] = None, gte: Optional[int] = None,
-         type: List[Optional[GemTypes]] = Query(None)):
-    # Construct the query to join Gem and GemProperties
-    gems = select(Gem, GemProperties).join(GemProperties)
-    if lte:
-        gems = gems.where(Gem.price <= lte)
-    if gte:
-        gems = gems.where(Gem.price >= gte)
-    if type:
-        gems = gems.where(Gem.gem_type.in_(type)).order_by(Gem.gem_type).order_by(-Gem.price).order_by(None)
-    # Execute the query and fetch all results
-    gems = session.exec(gems).all()
-    return {'gems': gems}
+async def gems(request: Request, lte: Optional[int] = None, gte: Optional[int] = None,
+               type: List[Optional[GemTypes]] = Query(None),
+               limit: Optional[int] = Query(None, ge=1, le=1000), cursor: Optional[str] = None,
+               stream: bool = False, include: List[GemInclude] = Query([]),
+               session=Depends(get_async_read_session)):
+    include_seller = GemInclude.SELLER in include
+    # Construct the query to join Gem and GemProperties with the requested filters
+    gems = repos.gem_repository.filter_gems_statement(lte, gte, type, include_seller)
+    paginated = not stream and (limit is not None or cursor is not None)
+    if paginated and limit is None:
+        limit = repos.gem_repository.DEFAULT_PAGE_SIZE
+    if paginated or stream:
+        # Fetch one extra row when paginating so we can tell whether another page exists
+        fetch = limit + 1 if paginated else limit
+        try:
+            gems = repos.gem_repository.keyset_page(gems, cursor, fetch)
+        except ValueError:
+            raise HTTPException(status_code=HTTP_400_BAD_REQUEST, detail='Invalid cursor')
+    if stream:
+        # Rows are yielded one by one instead of being collected into a list
+        return StreamingResponse(repos.gem_repository.stream_gems(gems, include_seller),
+                                 media_type='application/x-ndjson')
+    key = gem_response_cache.key('gems', lte=lte, gte=gte, type=type, limit=limit, cursor=cursor,
+                                 seller=include_seller or None)
+    cached = gem_response_cache.get(key)
+    if cached is None:
+        # Execute the query and split the plain column tuples into (gem, properties) dicts
+        gems = repos.gem_repository.rows_to_pairs(await session.exec(gems), include_seller)
+        if not paginated:
+            content = {'gems': gems}
+        else:
+            next_cursor = repos.gem_repository.encode_cursor(gems[limit - 1][0]) if len(gems) > limit else None
+            content = {'gems': gems[:limit], 'next_cursor': next_cursor}
+        # Serialize with orjson directly; the rows are plain dicts so no per-row validation is needed
+        cached = gem_response_cache.set(key, orjson.dumps(content))
+    return etag_response(request, *cached)
 
 # Endpoint to retrieve a single gem by ID
+# `include=properties` and/or `include=seller` embed the related rows, loaded in the same query
+# (or, with GEM_LISTING_READS, read from the single gem_listing row).
 @gem_router.get('/gem/{id}', response_model=Gem, tags=['Gems'])
-def gem(id: int):
-    gem_found = session.get(Gem, id)
-    if not gem_found:
-        return JSONResponse(status_code=HTTP_404_NOT_FOUND)
-    return gem_found
+async def gem(request: Request, id: int, include: List[GemInclude] = Query([]),
+              session=Depends(get_async_read_session)):
+    include = sorted(set(include))
+    key = gem_response_cache.key('gem', id=id, include=include)
+    cached = gem_response_cache.get(key)
+    if cached is None:
+        gem_found = await repos.gem_repository.gem_detail_async(session, id, include)
+        if gem_found is None:
+            return JSONResponse(status_code=HTTP_404_NOT_FOUND, content=None)
+        content = jsonable_encoder(gem_found)
+        cached = gem_response_cache.set(key, orjson.dumps(content),
+                                        gem_etag(gem_found['id'], gem_found['version'], include))
+    return etag_response(request, *cached)
+
+# Endpoint with facet counts, price ranges and size histograms per gem type, color and clarity
+# Served from the gemstats summary table (maintained by the write endpoints), so it does not scan the gems.
+@gem_router.get('/gems/stats', tags=['Gems'])
+async def gems_stats(request: Request, available: Optional[bool] = None,
+                     session=Depends(get_async_read_session)):
+    key = gem_response_cache.key('stats', available=available)
+    cached = gem_response_cache.get(key)
+    if cached is None:
+        cached = gem_response_cache.set(key, orjson.dumps(await gem_stats_async(session, available)))
+    return etag_response(request, *cached)
+
+# Endpoint to search gems by free text and structured filters, with sort and keyset pagination
+# `q` matches gem type, color, clarity and seller name through the full-text index (word prefixes, all terms);
+# writes reach the index through a background job, normally within milliseconds of their commit.
+# `sort` is price, size or id, prefixed with '-' for descending. Pass `next_cursor` back as `cursor`.
+@gem_router.get('/gems/search', tags=['Gems'])
+async def search_gems(request: Request, q: Optional[str] = None, type: List[GemTypes] = Query([]),
+                      color: List[GemColor] = Query([]), clarity: List[GemClarity] = Query([]),
+                      size_min: Optional[float] = None, size_max: Optional[float] = None,
+                      price_min: Optional[float] = None, price_max: Optional[float] = None,
+                      available: Optional[bool] = None, sort: str = 'price',
+                      limit: int = Query(repos.gem_repository.DEFAULT_PAGE_SIZE, ge=1, le=1000),
+                      cursor: Optional[str] = None, include: List[GemInclude] = Query([]),
+                      session=Depends(get_async_read_session)):
+    include_seller = GemInclude.SELLER in include
+    key = gem_response_cache.key('search', q=q, type=type, color=color, clarity=clarity, size_min=size_min,
+                                 size_max=size_max, price_min=price_min, price_max=price_max,
+                                 available=available, sort=sort, limit=limit, cursor=cursor,
+                                 seller=include_seller or None)
+    cached = gem_response_cache.get(key)
+    if cached is None:
+        statement = repos.gem_repository.search_gems_statement(
+            q, type, color, clarity, size_min, size_max, price_min, price_max, available, include_seller)
+        try:
+            # Fetch one extra row to tell whether another page exists
+            statement = repos.gem_repository.search_page(statement, sort, cursor, limit + 1)
+        except ValueError as e:
+            raise HTTPException(status_code=HTTP_400_BAD_REQUEST, detail=str(e))
+        gems = repos.gem_repository.rows_to_pairs(await session.exec(statement), include_seller)
+        next_cursor = repos.gem_repository.encode_search_cursor(gems[limit - 1], sort) if len(gems) > limit else None
+        cached = gem_response_cache.set(key, orjson.dumps({'gems': gems[:limit], 'next_cursor': next_cursor}))
+    return etag_response(request, *cached)
+
+# Endpoint for incremental catch-up from the gem change log
+# Without `since` it returns no changes, only the current position: take it, load the catalogue from /gems,
+# then poll with since=next_since and apply the changes in order. 410 means the changes were pruned; reload.
+@gem_router.get('/gems/changes', tags=['Gems'])
+async def gem_changes(since: Optional[int] = Query(None, ge=0),
+                      limit: int = Query(CHANGE_PAGE_SIZE, ge=1, le=CHANGE_PAGE_SIZE),
+                      session=Depends(get_async_read_session)):
+    if since is None:
+        content = {'changes': [], 'next_since': await change_head(session), 'has_more': False}
+        return Response(orjson.dumps(content), media_type='application/json')
+    # Fetch one extra change to tell whether there are more
+    changes = await read_changes(session, since, limit + 1)
+    if (not changes or changes[0]['id'] > since + 1) and await is_pruned(session, since):
+        raise HTTPException(status_code=HTTP_410_GONE, detail='Changes since this position were pruned')
+    changes, has_more = changes[:limit], len(changes) > limit
+    content = {'changes': changes, 'next_since': changes[-1]['id'] if changes else since, 'has_more': has_more}
+    return Response(orjson.dumps(content), media_type='application/json')
+
+# Server-sent event stream of gem changes, as they are committed
+# Each event has the change id as its id, the operation as its type and the change as its data.
+# Starts at `since` (or the Last-Event-ID header EventSource sends when it reconnects), otherwise at the present.
+@gem_router.get('/gems/changes/stream', tags=['Gems'])
+async def gem_changes_stream(request: Request, since: Optional[int] = Query(None, ge=0),
+                             session=Depends(get_async_read_session)):
+    last_event_id = request.headers.get('last-event-id')
+    if since is None and last_event_id and last_event_id.isdigit():
+        since = int(last_event_id)
+    if since is not None and await is_pruned(session, since):
+        raise HTTPException(status_code=HTTP_410_GONE, detail='Changes since this position were pruned')
+    # X-Accel-Buffering stops nginx from holding events back in its proxy buffer
+    return StreamingResponse(gem_change_feed.stream(since), media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 # Endpoint to create a new gem, requires authentication (seller)
 @gem_router.post('/gems', tags=['Gems'])
-def create_gem(gem_pr: GemProperties, gem: Gem, user=Depends(auth_handler.get_current_user)):
+def create_gem(gem_pr: GemProperties, gem: Gem, user=Depends(auth_handler.get_current_user),
+               session=Depends(get_session)):
     """Creates gem"""
     # Only allow users with seller privileges to create gems
     if not user.is_seller:
-        return JSONResponse(status_code=HTTP_401_UNAUTHORIZED)
+        return JSONResponse(status_code=HTTP_401_UNAUTHORIZED, content=None)
 
     # Create gem properties object from provided details
     gem_properties = GemProperties(size=gem_pr.size, clarity=gem_pr.clarity,
                                    color=gem_pr.color)
     session.add(gem_properties)
-    session.commit()
+    session.flush()  # Assigns the properties id; the gem is committed in the same transaction
     # Create a Gem object linking the gem properties and seller details
-    gem_ = Gem(price=gem.price, available=gem.available, gem_properties=gem_properties,
-               gem_properties_id=gem_properties.id, seller_id=user.id, seller=user)
-    # Calculate gem price using a custom function
-    price = calculate_gem_price(gem, gem_pr)
-    gem_.price = price
+    gem_ = Gem(price=gem.price, available=gem.available, gem_type=gem.gem_type, gem_properties=gem_properties,
+               gem_properties_id=gem_properties.id, seller_id=user.id)
+    # Calculate gem price using a custom function, from the stored gem and properties
+    gem_.price = calculate_gem_price(gem_, gem_properties)
     session.add(gem_)
+    session.flush()
+    record_gem_change(session, after=gem_snapshot(session, gem_))  # Same transaction as the insert
+    sync_listings(session, [gem_.id])
+    enqueue(session, SEARCH_REINDEX, ids=[gem_.id])
+    log_gem_change(session, CREATE, change_snapshot(session, gem_))
     session.commit()
-    return gem
+    gem_response_cache.invalidate()  # Cached catalogue reads are now stale
+    return gem_
+
+# Endpoint to quote prices for a batch of gems without storing them
+@gem_router.post('/gems/price-quote', tags=['Gems'])
+def price_quote(quotes: List[GemQuote]):
+    """Prices every gem in the batch in one vectorized pass"""
+    if len(quotes) > PRICE_QUOTE_LIMIT:
+        raise HTTPException(status_code=HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                            detail=f'At most {PRICE_QUOTE_LIMIT} gems per request')
+    prices = price_gems([q.gem_type for q in quotes], [q.clarity for q in quotes],
+                        [q.color for q in quotes], [q.size for q in quotes])
+    return {'prices': prices.tolist()}
+
+# Bulk endpoints for seller inventory uploads
+# The body is a JSON array or an NDJSON stream (Content-Type: application/x-ndjson). Items are validated one by
+# one and written in transactions of BULK_GEM_BATCH_SIZE; the response has a status (and detail) per item.
+# Declared before the /gems/{id} routes so that "bulk" is not taken for a gem id.
+@gem_router.post('/gems/bulk', tags=['Gems'])
+async def create_gems_bulk(request: Request, user=Depends(auth_handler.get_current_user),
+                           session=Depends(get_async_session)):
+    """Creates gems from GemBulkCreate items; prices are calculated in one vectorized pass per batch"""
+    if not user.is_seller:
+        return JSONResponse(status_code=HTTP_401_UNAUTHORIZED, content=None)
+    return await run_bulk(request, session, lambda raw: GemBulkCreate(**raw), _created, user.id)
+
+@gem_router.patch('/gems/bulk', tags=['Gems'])
+async def update_gems_bulk(request: Request, user=Depends(auth_handler.get_current_user),
+                           session=Depends(get_async_session)):
+    """Partially updates the seller's gems from GemBulkUpdate items (id plus the fields to change)"""
+    if not user.is_seller:
+        return JSONResponse(status_code=HTTP_401_UNAUTHORIZED, content=None)
+    return await run_bulk(request, session, lambda raw: GemBulkUpdate(**raw), _updated, user.id)
+
+@gem_router.delete('/gems/bulk', tags=['Gems'])
+async def delete_gems_bulk(request: Request, user=Depends(auth_handler.get_current_user),
+                           session=Depends(get_async_session)):
+    """Deletes the seller's gems; items are gem ids or {"id": ...} objects"""
+    if not user.is_seller:
+        return JSONResponse(status_code=HTTP_401_UNAUTHORIZED, content=None)
+    return await run_bulk(request, session, _gem_id, _deleted, user.id)
 
 # Endpoint to update an existing gem fully
+# With `If-Match: <ETag of GET /gem/{id}>` the update only applies if nobody changed the gem since; 409 otherwise.
 @gem_router.put('/gems/{id}', response_model=Gem, tags=['Gems'])
-def update_gem(id: int, gem: Gem, user=Depends(auth_handler.get_current_user)):
-    gem_found = session.get(Gem, id)
-    # Only allow the seller who owns the gem to update it
-    if not user.is_seller or gem_found.seller_id != user.id:
-        return JSONResponse(status_code=HTTP_401_UNAUTHORIZED)
-    update_item_encoded = jsonable_encoder(gem)
-    update_item_encoded.pop('id', None)  # Remove id to prevent overriding primary key
-    # Update each field in the found gem
-    for key, val in update_item_encoded.items():
-        gem_found.__setattr__(key, val)
-    session.commit()
-    return gem_found
+def update_gem(id: int, gem: Gem, request: Request, response: Response,
+               user=Depends(auth_handler.get_current_user), session=Depends(get_session)):
+    # Only sellers can update gems, and only their own (checked by update_gem_values)
+    if not user.is_seller:
+        return JSONResponse(status_code=HTTP_401_UNAUTHORIZED, content=None)
+    # The primary key, the version, the seller and the properties link are set by the server, not the client
+    values = gem.dict(exclude={'id', 'version', 'seller_id', 'gem_properties_id'})
+    return write_gem_values(request, response, session, id, user.id, values)
 
-# Endpoint to partially update a gem
+# Endpoint to partially update a gem (If-Match as for PUT)
 @gem_router.patch('/gems/{id}', response_model=Gem, tags=['Gems'])
-def patch_gem(id: int, gem: GemPatch, user=Depends(auth_handler.get_current_user)):
-    gem_found = session.get(Gem, id)
-    # Only allow update if the current user is the seller of the gem
-    if not user.is_seller or gem_found.seller_id != user.id:
-        return JSONResponse(status_code=HTTP_401_UNAUTHORIZED)
-    update_data = gem.dict(exclude_unset=True)
-    update_data.pop('id', None)  # Remove id to avoid conflicts
-    # Update each provided field in the gem object
-    for key, val in update_data.items():
-        gem_found.__setattr__(key, val)
+def patch_gem(id: int, gem: GemPatch, request: Request, response: Response,
+              user=Depends(auth_handler.get_current_user), session=Depends(get_session)):
+    # Only allow update if the current user is a seller (and, checked by update_gem_values, owns the gem)
+    if not user.is_seller:
+        return JSONResponse(status_code=HTTP_401_UNAUTHORIZED, content=None)
+    values = gem.dict(exclude_unset=True, exclude={'id'})  # Only the provided fields; never the primary key
+    return write_gem_values(request, response, session, id, user.id, values)
+
+def write_gem_values(request, response, session, id, seller_id, values):
+    """Apply column values to a gem with one conditional UPDATE and commit; the response carries the new ETag."""
+    status, gem_found = repos.gem_repository.update_gem_values(session, id, seller_id, values,
+                                                               if_match_versions(request, id))
+    if status == HTTP_409_CONFLICT:
+        return conflict_response(gem_found)
+    if status != 200:
+        return JSONResponse(status_code=status, content=None)
     session.commit()
+    gem_response_cache.invalidate()  # Cached catalogue reads are now stale
+    response.headers['ETag'] = gem_etag(gem_found.id, gem_found.version)
     return gem_found
 
-# Endpoint to delete a gem by its ID
+# Endpoint to delete a gem by its ID (If-Match as for PUT)
 @gem_router.delete('/gems/{id}', status_code=HTTP_204_NO_CONTENT, tags=['Gems'])
-def delete_gem(id: int, user=Depends(auth_handler.get_current_user)):
-    gem_found = session.get(Gem, id)
-    # Only allow deletion if the current user is the seller of the gem
-    if not user.is_seller or gem_found.seller_id != user.id:
-        return JSONResponse(status_code=HTTP_401_UNAUTHORIZED)
-    session.delete(gem_found)
-    session.commit()
+def delete_gem(id: int, request: Request, user=Depends(auth_handler.get_current_user),
+               session=Depends(get_session)):
+    versions = if_match_versions(request, id)
+    for _ in range(repos.gem_repository.UPDATE_ATTEMPTS):
+        gem_found = session.get(Gem, id)
+        if not gem_found:
+            return JSONResponse(status_code=HTTP_404_NOT_FOUND, content=None)
+        # Only allow deletion if the current user is the seller of the gem
+        if not user.is_seller or gem_found.seller_id != user.id:
+            return JSONResponse(status_code=HTTP_401_UNAUTHORIZED, content=None)
+        if versions is not None and gem_found.version not in versions:
+            return conflict_response(gem_found)
+        before = gem_snapshot(session, gem_found)
+        snapshot = change_snapshot(session, gem_found)
+        session.delete(gem_found)
+        try:
+            session.flush()  # DELETE ... WHERE id = ? AND version = ?: matches nothing if the gem changed meanwhile
+        except StaleDataError:
+            session.rollback()  # Read the gem again, as update_gem_values does
+            continue
+        record_gem_change(session, before=before)
+        sync_listings(session, [id])
+        enqueue(session, SEARCH_REINDEX, ids=[id])
+        log_gem_change(session, DELETE, snapshot)
+        session.commit()
+        gem_response_cache.invalidate()  # Cached catalogue reads are now stale
+        return
+    # Still changing under us: answer with the current version, unless the gem is gone by now
+    gem_found = session.get(Gem, id, populate_existing=True)
+    if not gem_found:
+        return JSONResponse(status_code=HTTP_404_NOT_FOUND, content=None)
+    return conflict_response(gem_found)
 
 # Endpoint to get gems associated with the current seller
 @gem_router.get('/gems/seller/me', tags=['seller'],
                 response_model=List[Dict[str, Union[Gem, GemProperties]]])
-def gems_seller(user=Depends(auth_handler.get_current_user)):
+async def gems_seller(request: Request, include: List[GemInclude] = Query([]),
+                      user=Depends(auth_handler.get_current_user), session=Depends(get_async_read_session)):
     if not user.is_seller:
-        return JSONResponse(status_code=HTTP_401_UNAUTHORIZED)
-    # Select gems and their properties for the current seller
-    statement = select(Gem, GemProperties).where(Gem.seller_id == user.id).join(GemProperties)
-    gems = session.exec(statement).all()
-    # Format the result as a list of dictionaries
+        return JSONResponse(status_code=HTTP_401_UNAUTHORIZED, content=None)
+    include_seller = GemInclude.SELLER in include
+    # Select gems and their properties (and optionally the seller) for the current seller in one query
+    statement = repos.gem_repository.seller_gems_statement(user.id, include_seller)
+    gems = repos.gem_repository.rows_to_pairs(await session.exec(statement), include_seller)
+    # Format the result as a list of dictionaries and serialize it without per-row validation
     res = [{'gem': gem, 'props': props} for gem, props in gems]
-    return res
+    body = orjson.dumps(res)
+    return etag_response(request, make_etag(body), body)
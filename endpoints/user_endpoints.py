@@ -1,12 +1,17 @@
-from fastapi import APIRouter, HTTPException, Security, Depends
-from fastapi.security import HTTPAuthorizationCredentials
+import asyncio
+from typing import List
+
+from fastapi import APIRouter, HTTPException, Depends
+from sqlalchemy.exc import IntegrityError
 from starlette.responses import JSONResponse
-from starlette.status import HTTP_201_CREATED, HTTP_404_NOT_FOUND
+from starlette.status import HTTP_201_CREATED, HTTP_413_REQUEST_ENTITY_TOO_LARGE
 
 from auth.auth import AuthHandler  # Import the authentication handler
-from db.db import session  # Import the shared database session
+from config.config import BULK_REGISTRATION_LIMIT, PASSWORD_POOL_SIZE
+from db.db import get_async_session, get_async_read_session  # Per-request writer and read-pool sessions
+from jobs.jobs import WELCOME_EMAIL, enqueue  # Welcome emails are sent by a background job
 from models.user_models import UserInput, User, UserLogin  # Import user models and schemas
-from repos.user_repos import select_all_users, find_user  # Import repository functions for user operations
+from repos.user_repos import find_user_async, find_taken_usernames_async  # Import repository functions for user operations
 
 # Create an instance of APIRouter for user endpoints
 user_router = APIRouter()
@@ -15,37 +20,105 @@ auth_handler = AuthHandler()
 
 @user_router.post('/registration', status_code=HTTP_201_CREATED, tags=['users'],
                   description='Register new user')
-def register(user: UserInput):
+async def register(user: UserInput, session=Depends(get_async_session),
+                   read_session=Depends(get_async_read_session)):
     """
     Register a new user.
-    - Checks if the username is already taken.
+    - Checks if the username is already taken (indexed lookup, so no password is hashed for it).
     - Hashes the provided password.
-    - Saves the new user to the database.
+    - Saves the new user to the database; the unique index on username rejects concurrent duplicates.
+    - Queues the welcome email in the same transaction; it is sent after the response.
+    The lookup goes through the read pool so the writer connection is only taken for the insert.
     """
-    users = select_all_users()  # Retrieve all existing users
-    if any(x.username == user.username for x in users):
+    if await find_user_async(read_session, user.username):
         raise HTTPException(status_code=400, detail='Username is taken')
-    hashed_pwd = auth_handler.get_password_hash(user.password)  # Hash the password
+    hashed_pwd = await auth_handler.get_password_hash_async(user.password)  # Hash the password in the password pool
     # Create a new User object; 🔹 CUSTOMIZE fields as necessary
     u = User(username=user.username, password=hashed_pwd, email=user.email,
              is_seller=user.is_seller)
     session.add(u)
-    session.commit()
-    return JSONResponse(status_code=HTTP_201_CREATED)
+    enqueue(session, WELCOME_EMAIL, username=u.username, email=u.email)
+    try:
+        await session.commit()
+    except IntegrityError:
+        # Another request registered the same username in the meantime
+        await session.rollback()
+        raise HTTPException(status_code=400, detail='Username is taken')
+    return JSONResponse(status_code=HTTP_201_CREATED, content=None)
+
+@user_router.post('/registration/bulk', tags=['users'],
+                  description='Register a batch of users (e.g. when onboarding sellers)')
+async def register_bulk(users: List[UserInput], session=Depends(get_async_session),
+                        read_session=Depends(get_async_read_session)):
+    """
+    Register many users in one request.
+    - Looks up all requested usernames with a single query.
+    - Hashes the passwords in the password pool, a pool-sized chunk at a time.
+    - Inserts the new users, and queues their welcome emails, in one transaction.
+    Returns one result per input user, in order.
+    """
+    if len(users) > BULK_REGISTRATION_LIMIT:
+        raise HTTPException(status_code=HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                            detail=f'At most {BULK_REGISTRATION_LIMIT} users per request')
+    taken = await find_taken_usernames_async(read_session, [u.username for u in users])
+    results, accepted = [], []
+    for user in users:
+        if user.username in taken:
+            results.append({'username': user.username, 'status': 400, 'detail': 'Username is taken'})
+            continue
+        taken.add(user.username)  # Also rejects duplicates within the batch
+        results.append({'username': user.username, 'status': 201})
+        accepted.append(user)
+    hashes = []
+    for i in range(0, len(accepted), PASSWORD_POOL_SIZE):
+        chunk = accepted[i:i + PASSWORD_POOL_SIZE]
+        hashes += await asyncio.gather(*(auth_handler.get_password_hash_async(u.password) for u in chunk))
+    new_users = [User(username=u.username, password=h, email=u.email, is_seller=u.is_seller)
+                 for u, h in zip(accepted, hashes)]
+    session.add_all(new_users)
+    for new_user in new_users:
+        enqueue(session, WELCOME_EMAIL, username=new_user.username, email=new_user.email)
+    try:
+        await session.commit()
+    except IntegrityError:
+        # A concurrent registration took one of the names; insert one by one to find out which
+        await session.rollback()
+        failed = set()
+        for new_user in new_users:
+            session.add(User(username=new_user.username, password=new_user.password,
+                             email=new_user.email, is_seller=new_user.is_seller))
+            enqueue(session, WELCOME_EMAIL, username=new_user.username, email=new_user.email)
+            try:
+                await session.commit()
+            except IntegrityError:
+                await session.rollback()
+                failed.add(new_user.username)
+        for result in results:
+            if result['status'] == 201 and result['username'] in failed:
+                result.update(status=400, detail='Username is taken')
+    return results
 
 @user_router.post('/login', tags=['users'])
-def login(user: UserLogin):
+async def login(user: UserLogin, session=Depends(get_async_session),
+                read_session=Depends(get_async_read_session)):
     """
     Authenticate a user.
     - Verifies username and password.
+    - Rehashes the password if it was stored with an outdated bcrypt cost.
     - Returns a JWT token if authentication is successful.
+    Only the rehash touches the writer connection; the lookup goes through the read pool.
     """
-    user_found = find_user(user.username)
+    user_found = await find_user_async(read_session, user.username)
     if not user_found:
         raise HTTPException(status_code=401, detail='Invalid username and/or password')
-    verified = auth_handler.verify_password(user.password, user_found.password)
+    # bcrypt is CPU-bound, so it runs in the password pool
+    verified, new_hash = await auth_handler.verify_and_update_password_async(user.password, user_found.password)
     if not verified:
         raise HTTPException(status_code=401, detail='Invalid username and/or password')
+    if new_hash:
+        stored = await session.get(User, user_found.id)
+        stored.password = new_hash
+        await session.commit()
     token = auth_handler.encode_token(user_found.username)
     return {'token': token}
 
@@ -55,3 +128,11 @@ def get_current_user(user: User = Depends(auth_handler.get_current_user)):
     Retrieve the currently authenticated user.
     """
     return user
+
+@user_router.get('/.well-known/jwks.json', tags=['users'])
+def jwks():
+    """
+    Public keys that verify this API's tokens, so other services can validate them locally.
+    Clients should cache the key set and refetch it when they see an unknown kid.
+    """
+    return JSONResponse(auth_handler.jwks(), headers={'Cache-Control': 'public, max-age=300'})
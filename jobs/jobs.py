@@ -0,0 +1,353 @@
+import argparse  # For the queue command line
+import asyncio  # For the runner task
+import collections  # For the registry entries and outcome counts
+import contextlib  # For jobs without a concurrency cap
+import datetime  # For due times and retry backoff
+import json  # For payloads given on the command line
+import logging  # For reporting failed jobs
+import random  # For jittering retry delays
+import smtplib  # For sending welcome emails
+import time  # For timing jobs
+from concurrent.futures import ThreadPoolExecutor  # Job handlers are synchronous and run in a pool
+from email.message import EmailMessage  # For building welcome emails
+
+from sqlalchemy import delete, event, func, update
+from sqlalchemy.orm import Session as OrmSession  # Commit events of every session, sync or async
+from sqlmodel import Session, select
+
+from cache.cache import gem_response_cache  # Cached reads are stale once gems are reindexed or repriced
+from config.config import JOB_CONCURRENCY, JOB_POLL_INTERVAL, JOB_LEASE, JOB_MAX_ATTEMPTS, JOB_BACKOFF_BASE, \
+    JOB_BACKOFF_MAX, JOB_SHUTDOWN_TIMEOUT, SMTP_HOST, SMTP_PORT, MAIL_FROM
+from db.db import engine  # Jobs are claimed, run and completed on the writer
+from metrics.metrics import JOBS, JOB_DURATION, JOB_DELAY  # Job outcome, run time and start delay metrics
+from models.job_models import Job  # Job queue table
+from pricing.pricing import reprice_gems  # Repricing job
+from search.search import index_gems  # Search index maintenance job
+from stats.stats import refresh_gem_stats  # Price ranges are refreshed after repricing
+
+logger = logging.getLogger('jobs')
+
+# Job states; a job that succeeded is deleted in the transaction of its handler
+QUEUED, RUNNING, FAILED = 'queued', 'running', 'failed'
+# Jobs run by this module (see the handlers at the end)
+SEARCH_REINDEX = 'search.reindex'
+WELCOME_EMAIL = 'users.welcome_email'
+REPRICE = 'pricing.reprice'
+
+job_table = Job.__table__
+
+# A registered handler with its retry and concurrency settings
+JobType = collections.namedtuple('JobType', 'handler max_attempts concurrency')
+registry = {}
+
+
+def job(name, max_attempts=JOB_MAX_ATTEMPTS, concurrency=None):
+    """
+    Register a job handler under `name`. The handler is called as handler(session, **payload) in a worker thread
+    and its writes commit together with the job's completion. `concurrency` caps how many of these jobs
+    a process runs at once (e.g. to go easy on a mail server); by default only JOB_CONCURRENCY applies.
+    """
+    def register(handler):
+        registry[name] = JobType(handler, max_attempts, concurrency)
+        return handler
+    return register
+
+
+def enqueue(session, name, **payload):
+    """
+    Add a job to the queue in the caller's transaction (sync or async session): it exists only if the write
+    it belongs to commits, and once committed it runs even if this process dies. The payload must be JSON.
+    The runner of this process is woken on commit, so the job usually starts within milliseconds.
+    """
+    session.add(Job(name=name, payload=payload, max_attempts=registry[name].max_attempts))
+    session.info['jobs_enqueued'] = True
+
+
+@event.listens_for(OrmSession, 'after_commit')
+def wake_runner(session):
+    """Wake the runner when a transaction that enqueued jobs commits."""
+    if session.info.pop('jobs_enqueued', False):
+        job_runner.notify()
+
+
+@event.listens_for(OrmSession, 'after_rollback')
+def forget_enqueued(session):
+    session.info.pop('jobs_enqueued', None)
+
+
+def retry_delay(attempts, base=JOB_BACKOFF_BASE, cap=JOB_BACKOFF_MAX):
+    """
+    Seconds to wait before retrying a job that failed `attempts` times: exponential and capped,
+    with jitter so that jobs failing together (e.g. while the mail server is down) do not retry in lockstep.
+    """
+    delay = min(base * 2 ** (attempts - 1), cap)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def claim_jobs(limit, exclude=(), bind=engine, lease=JOB_LEASE):
+    """
+    Claim up to `limit` due jobs, oldest first: queued jobs whose run_at has passed and running jobs whose lease
+    ran out (their runner died). A single UPDATE ... RETURNING marks them running and moves run_at to the end
+    of the lease; on PostgreSQL SKIP LOCKED lets runners claim at the same time without waiting for each other.
+    Jobs with a name in `exclude` (at their concurrency cap) are left for later.
+    """
+    now = datetime.datetime.utcnow()
+    due = (select(job_table.c.id).where(job_table.c.status.in_((QUEUED, RUNNING)), job_table.c.run_at <= now)
+           .order_by(job_table.c.run_at).limit(limit))
+    if exclude:
+        due = due.where(job_table.c.name.notin_(exclude))
+    if bind.dialect.name == 'postgresql':
+        due = due.with_for_update(skip_locked=True)
+    statement = (update(job_table).where(job_table.c.id.in_(due))
+                 .values(status=RUNNING, attempts=job_table.c.attempts + 1,
+                         run_at=now + datetime.timedelta(seconds=lease))
+                 .returning(job_table.c.id, job_table.c.name, job_table.c.payload, job_table.c.attempts,
+                            job_table.c.max_attempts, job_table.c.created_at))
+    with bind.begin() as conn:
+        return conn.execute(statement).all()
+
+
+def fail_job(claimed, error, bind=engine):
+    """Schedule the retry of a failed job, or mark it failed after its last attempt. Returns the outcome."""
+    retry = claimed.attempts < claimed.max_attempts
+    if retry:
+        values = dict(status=QUEUED, run_at=datetime.datetime.utcnow() +
+                      datetime.timedelta(seconds=retry_delay(claimed.attempts)))
+    else:
+        values = dict(status=FAILED)
+    with bind.begin() as conn:
+        conn.execute(update(job_table).where(job_table.c.id == claimed.id, job_table.c.attempts == claimed.attempts)
+                     .values(last_error=repr(error)[:1000], **values))
+    logger.log(logging.WARNING if retry else logging.ERROR, 'job %d (%s) failed, attempt %d of %d',
+               claimed.id, claimed.name, claimed.attempts, claimed.max_attempts, exc_info=error)
+    return 'retry' if retry else 'failed'
+
+
+def run_job(claimed, bind=engine):
+    """
+    Run one claimed job in this thread. Returns the outcome: 'done', 'retry', 'failed', or 'superseded' when the
+    lease ran out and another runner took the job over (the handler's writes are rolled back then).
+    """
+    start = time.perf_counter()
+    job_type = registry.get(claimed.name)
+    try:
+        if job_type is None:
+            raise LookupError(f'no handler registered for job {claimed.name!r}')
+        if claimed.attempts > claimed.max_attempts:
+            raise TimeoutError('the lease of the last attempt ran out')
+        with Session(bind) as session:
+            job_type.handler(session, **claimed.payload)
+            # Completing the job commits with the handler's writes, unless the job is no longer ours
+            done = session.execute(delete(job_table).where(job_table.c.id == claimed.id,
+                                                           job_table.c.attempts == claimed.attempts)).rowcount
+            if done:
+                session.commit()
+        outcome = 'done' if done else 'superseded'
+    except Exception as e:
+        outcome = fail_job(claimed, e, bind)
+    JOBS.labels(claimed.name, outcome).inc()
+    JOB_DURATION.labels(claimed.name).observe(time.perf_counter() - start)
+    return outcome
+
+
+def run_pending(bind=engine, limit=None):
+    """
+    Run due jobs one at a time in this thread until none is left (or `limit` ran), without a runner:
+    for the command line, scripts and checks. Returns a Counter of outcomes.
+    """
+    outcomes = collections.Counter()
+    while limit is None or sum(outcomes.values()) < limit:
+        claimed = claim_jobs(1, bind=bind)
+        if not claimed:
+            break
+        outcomes[run_job(claimed[0], bind)] += 1
+    return outcomes
+
+
+class JobRunner:
+    """
+    Runs queued jobs in this process. One asyncio task claims due jobs whenever there is a free slot and runs
+    their handlers in a pool of `concurrency` threads. It sleeps until a job is enqueued in this process,
+    a job finishes or `poll_interval` passes (for jobs enqueued elsewhere and retries coming due).
+    Every worker process runs one; claims are atomic, so each job runs once.
+    """
+
+    def __init__(self, bind=engine, concurrency=JOB_CONCURRENCY, poll_interval=JOB_POLL_INTERVAL):
+        self.bind = bind
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.running = {}  # asyncio task -> job name
+        self.limits = {}  # job name -> semaphore enforcing its concurrency cap
+        self.loop = None
+        self.task = None
+        self.wakeup = None
+        self.executor = None
+        self.stopping = False
+
+    async def start(self):
+        """Start claiming and running jobs (app startup)."""
+        if self.task is not None and not self.task.done():
+            return
+        self.wakeup = asyncio.Event()
+        self.limits = {}  # Semaphores belong to the loop they were first used in
+        # One thread more than the job slots, so claiming never waits for a running job
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency + 1, thread_name_prefix='job')
+        self.stopping = False
+        self.loop = asyncio.get_running_loop()
+        self.task = asyncio.create_task(self.run())
+
+    def notify(self):
+        """Wake the runner to claim jobs now; safe to call from any thread."""
+        loop = self.loop
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self.wakeup.set)
+
+    def busy(self):
+        """Names of the jobs running at their concurrency cap in this process."""
+        counts = collections.Counter(self.running.values())
+        return [name for name, count in counts.items()
+                if name in registry and registry[name].concurrency is not None
+                and count >= registry[name].concurrency]
+
+    async def run(self):
+        while not self.stopping:
+            self.wakeup.clear()
+            free = self.concurrency - len(self.running)
+            claimed = []
+            if free > 0:
+                try:
+                    claimed = await self.loop.run_in_executor(self.executor, claim_jobs, free, self.busy(), self.bind)
+                except Exception:
+                    logger.exception('claiming jobs failed')
+            for row in claimed:
+                task = asyncio.create_task(self.execute(row))
+                self.running[task] = row.name
+                task.add_done_callback(self.finished)
+            if free <= 0 or len(claimed) < free:
+                # Nothing else is due, or every slot is taken: wait for a new job, a free slot or the next poll
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def execute(self, claimed):
+        if claimed.attempts == 1:
+            JOB_DELAY.labels(claimed.name).observe(
+                max((datetime.datetime.utcnow() - claimed.created_at).total_seconds(), 0))
+        job_type = registry.get(claimed.name)
+        if job_type is not None and job_type.concurrency is not None:
+            # A claim can take more jobs of a name than its cap allows; the extra ones wait here
+            limit = self.limits.setdefault(claimed.name, asyncio.Semaphore(job_type.concurrency))
+        else:
+            limit = contextlib.nullcontext()
+        async with limit:
+            await asyncio.get_running_loop().run_in_executor(self.executor, run_job, claimed, self.bind)
+
+    def finished(self, task):
+        self.running.pop(task, None)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error('running a job failed', exc_info=task.exception())
+        self.wakeup.set()
+
+    async def stop(self, timeout=JOB_SHUTDOWN_TIMEOUT):
+        """
+        Stop claiming jobs and give the running ones `timeout` seconds to finish (app shutdown).
+        Jobs still running after that are taken over by another runner once their lease runs out.
+        """
+        if self.task is None:
+            return
+        # Not task.cancel(): wait_for can swallow a cancellation that races with the wakeup
+        self.stopping = True
+        self.wakeup.set()
+        await self.task
+        if self.running:
+            await asyncio.wait(list(self.running), timeout=timeout)
+        for task in list(self.running):
+            task.cancel()  # Jobs still waiting for their concurrency cap are left to their lease as well
+        self.executor.shutdown(wait=False)
+        self.loop = self.task = None
+
+
+# Runner of this process, started by the app's lifespan
+job_runner = JobRunner()
+
+
+def queue_status(bind=engine):
+    """Number of jobs per (name, status)."""
+    with bind.connect() as conn:
+        return conn.execute(select(job_table.c.name, job_table.c.status, func.count())
+                            .group_by(job_table.c.name, job_table.c.status)
+                            .order_by(job_table.c.name, job_table.c.status)).all()
+
+
+def retry_failed(name=None, bind=engine):
+    """Queue failed jobs (of one name, or all) again with fresh attempts. Returns the count."""
+    statement = (update(job_table).where(job_table.c.status == FAILED)
+                 .values(status=QUEUED, attempts=0, run_at=datetime.datetime.utcnow()))
+    if name is not None:
+        statement = statement.where(job_table.c.name == name)
+    with bind.begin() as conn:
+        return conn.execute(statement).rowcount
+
+
+@job(SEARCH_REINDEX)
+def reindex_gems(session, ids):
+    """Bring the search documents of gems up to date; gems deleted in the meantime drop out of the index."""
+    index_gems(session, ids)
+    # Reindexing is idempotent, so it can commit ahead of the job's completion: cached searches must not
+    # be refilled from the old documents after the invalidation
+    session.commit()
+    gem_response_cache.invalidate()
+
+
+@job(WELCOME_EMAIL, concurrency=2)
+def send_welcome_email(session, username, email):
+    """Send a new user the welcome email; only logged when SMTP_HOST is not set."""
+    message = EmailMessage()
+    message['From'] = MAIL_FROM
+    message['To'] = email
+    message['Subject'] = 'Welcome to the gem store'
+    message.set_content(f'Hi {username},\n\nyour account is ready. Happy gem hunting!\n')
+    if SMTP_HOST is None:
+        logger.info('welcome email for %s not sent: SMTP_HOST is not set', username)
+        return
+    with smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=30) as smtp:
+        smtp.send_message(message)
+
+
+@job(REPRICE, max_attempts=1, concurrency=1)
+def reprice(session, chunk_size=10000):
+    """Reprice every gem with the current multipliers and refresh the price ranges of /gems/stats."""
+    # Each chunk commits on its own, so cached reads are dropped once all of them (and the stats) have
+    if reprice_gems(chunk_size, bind=session.get_bind()):
+        refresh_gem_stats(session.get_bind())
+        gem_response_cache.invalidate()
+
+
+if __name__ == '__main__':
+    # Usage: python -m jobs.jobs status | run [--limit N] | retry [--name NAME] | enqueue NAME ['{"key": ...}']
+    parser = argparse.ArgumentParser(description='Inspect and run the background job queue.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('status', help='count jobs by name and status')
+    run_parser = commands.add_parser('run', help='run due jobs in this process until none is left')
+    run_parser.add_argument('--limit', type=int, help='most jobs to run')
+    retry_parser = commands.add_parser('retry', help='queue failed jobs again')
+    retry_parser.add_argument('--name', help='only jobs with this name')
+    enqueue_parser = commands.add_parser('enqueue', help='add a job to the queue')
+    enqueue_parser.add_argument('name', choices=sorted(registry))
+    enqueue_parser.add_argument('payload', nargs='?', default='{}', help='handler arguments as a JSON object')
+    args = parser.parse_args()
+    engine.echo = False
+    if args.command == 'status':
+        for name, status, count in queue_status():
+            print(f'{name:24} {status:8} {count}')
+    elif args.command == 'run':
+        outcomes = run_pending(limit=args.limit)
+        print(', '.join(f'{count} {outcome}' for outcome, count in outcomes.items()) or 'no jobs due')
+    elif args.command == 'retry':
+        print(f'queued {retry_failed(args.name)} failed jobs again')
+    else:
+        with Session(engine) as session:
+            enqueue(session, args.name, **json.loads(args.payload))
+            session.commit()
+        print(f'enqueued {args.name}')
@@ -0,0 +1,58 @@
+import argparse  # For the rebuild command line
+import time  # For reporting the rebuild time
+
+from sqlalchemy import delete, func, insert
+from sqlmodel import select
+
+from db.db import engine  # Import the database engine
+from models.gem_models import Gem, GemListing, GemProperties  # Import gem models
+from models.user_models import User  # Seller columns are copied into the listing
+
+listing_table = GemListing.__table__
+
+# Source of every gem_listing column, in table order: the gem, its properties and its seller's public columns
+LISTING_SOURCE = (Gem.id, Gem.price, Gem.available, Gem.gem_type, Gem.gem_properties_id, Gem.seller_id,
+                  Gem.version, GemProperties.size, GemProperties.clarity, GemProperties.color,
+                  User.username, User.email)
+
+
+def _listing_rows(ids=None):
+    """Select the gem_listing rows of the given gems (all gems by default) from gem, gemproperties and user."""
+    statement = (select(*LISTING_SOURCE).select_from(Gem).outerjoin(GemProperties)
+                 .outerjoin(User, Gem.seller_id == User.id))
+    if ids is not None:
+        statement = statement.where(Gem.id.in_(ids))
+    return statement
+
+
+def sync_listings(session, ids):
+    """
+    Bring the listing rows of gems up to date in the caller's transaction: two statements for any number of
+    gems, whether they were created, updated or deleted. The gem changes must already be flushed.
+    """
+    if not ids:
+        return
+    ids = list(ids)
+    session.execute(delete(listing_table).where(listing_table.c.id.in_(ids)))
+    session.execute(insert(listing_table).from_select(list(listing_table.c), _listing_rows(ids)))
+
+
+def rebuild_listings(bind=engine):
+    """
+    Rebuild the whole gem_listing table from the gem, gemproperties and user tables in one transaction.
+    Use it after writes that bypass the endpoints (bulk loads) or seller renames. Returns the number of gems.
+    """
+    with bind.begin() as conn:
+        conn.execute(delete(listing_table))
+        conn.execute(insert(listing_table).from_select(list(listing_table.c), _listing_rows()))
+        return conn.execute(select(func.count()).select_from(listing_table)).scalar()
+
+
+if __name__ == '__main__':
+    # Usage: python -m listing.listing
+    parser = argparse.ArgumentParser(description='Rebuild the denormalized gem_listing table.')
+    parser.parse_args()
+    engine.echo = False
+    start = time.perf_counter()
+    count = rebuild_listings()
+    print(f'rebuilt {count} gem listings in {time.perf_counter() - start:.1f}s')
@@ -1,15 +1,67 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 import uvicorn
-from endpoints.gem_endpoints import gem_router  # Import gem-related endpoints
-from endpoints.user_endpoints import user_router  # Import user-related endpoints
-from models.gem_models import *  # Import gem models (if needed for additional processing)
 
-# Initialize the FastAPI application
-app = FastAPI()
 
-# Include the gem and user routers to add their endpoints to the app
-app.include_router(gem_router)
-app.include_router(user_router)
+def warm_up():
+    """
+    Do the one-time work that would otherwise land on the first requests: build the password context
+    (timing bcrypt when BCRYPT_ROUNDS=auto) and load the bcrypt backend. Idempotent. Under gunicorn with
+    preload_app it runs once in the master (see gunicorn.conf), and every worker inherits the result.
+    """
+    from auth.auth import warm_up_passwords
+    warm_up_passwords()
+
+
+@asynccontextmanager
+async def lifespan(app):
+    """
+    Warm up and start the job runner when a worker starts; on shutdown let running jobs finish,
+    stop the change feed poller and close the pooled connections.
+    """
+    from changes.changes import gem_change_feed
+    from config.config import JOBS_ENABLED
+    from db.db import close_engines
+    from jobs.jobs import job_runner
+
+    warm_up()
+    if JOBS_ENABLED:
+        await job_runner.start()
+    yield
+    await job_runner.stop()
+    await gem_change_feed.close()
+    await close_engines()
+
+
+def create_app():
+    """
+    Build the FastAPI application with its routers and middleware.
+    Run with `uvicorn main:app`, `uvicorn --factory main:create_app` or gunicorn (see deployment_configurations).
+    """
+    from endpoints.gem_endpoints import gem_router  # Import gem-related endpoints
+    from endpoints.user_endpoints import user_router  # Import user-related endpoints
+    from metrics.metrics import MetricsMiddleware, metrics_router  # Request metrics and the /metrics endpoint
+    from ratelimit.ratelimit import RateLimitMiddleware  # Rate limiting and per-route concurrency caps
+
+    # Initialize the FastAPI application
+    app = FastAPI(lifespan=lifespan)
+
+    # Include the gem and user routers to add their endpoints to the app
+    app.include_router(gem_router)
+    app.include_router(user_router)
+    app.include_router(metrics_router)
+
+    # Turn away clients over their rate limit, and requests over a route's concurrency cap, with 429
+    app.add_middleware(RateLimitMiddleware)
+
+    # Record per-route latency and database work for every request (added last, so it also sees the 429s)
+    app.add_middleware(MetricsMiddleware)
+    return app
+
+
+# Module-level application for `uvicorn main:app`, gunicorn and the benchmarks
+app = create_app()
 
 # Optionally, you can create database tables at startup by uncommenting the following:
 # def create_db_and_tables():
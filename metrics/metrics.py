@@ -0,0 +1,139 @@
+import contextvars  # Per-request database statistics
+import logging  # For the slow-query log
+import os  # For detecting prometheus multiprocess mode
+import random  # For sampling the slow-query log
+import time  # For measuring durations
+
+from fastapi import APIRouter
+from prometheus_client import CollectorRegistry, Counter, Histogram, CONTENT_TYPE_LATEST, REGISTRY, \
+    generate_latest, multiprocess
+from sqlalchemy import event
+from starlette.responses import Response
+
+from config.config import SLOW_QUERY_MS, SLOW_QUERY_SAMPLE_RATE
+
+# Logger for sampled slow queries (replaces engine echo logging)
+slow_query_logger = logging.getLogger('db.slow_query')
+
+# Request latency per route template
+REQUEST_LATENCY = Histogram('http_request_duration_seconds', 'Request latency', ['method', 'route', 'status'])
+# Database work per request
+DB_QUERIES = Histogram('db_queries_per_request', 'SQL statements executed per request', ['method', 'route'],
+                       buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100))
+DB_TIME = Histogram('db_time_per_request_seconds', 'Time spent executing SQL per request',
+                    ['method', 'route'])
+# Time spent waiting for a pooled connection
+POOL_CHECKOUT_WAIT = Histogram('db_pool_checkout_wait_seconds', 'Time spent waiting for a pooled connection',
+                               ['engine'], buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5))
+# Password hashing and verification time
+PASSWORD_DURATION = Histogram('password_operation_duration_seconds', 'bcrypt hashing/verification time',
+                              ['operation'], buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5))
+# Cache lookups by result; hit ratio = hit / (hit + miss)
+CACHE_REQUESTS = Counter('cache_requests_total', 'Cache lookups', ['cache', 'result'])
+# Requests turned away by the rate limiter, by route template and reason (ip, user or concurrency)
+RATE_LIMITED = Counter('rate_limited_requests_total', 'Requests rejected with 429', ['route', 'reason'])
+# Background jobs by outcome (done, retry or failed), how long they ran, and how long they waited to start
+JOBS = Counter('jobs_total', 'Background job attempts', ['job', 'outcome'])
+JOB_DURATION = Histogram('job_duration_seconds', 'Background job run time', ['job'])
+JOB_DELAY = Histogram('job_start_delay_seconds', 'Time from enqueue (or retry time) to start', ['job'],
+                      buckets=(0.01, 0.05, 0.1, 0.5, 1, 5, 10, 60, 300))
+
+# [statement count, seconds] of the request being handled; shared by reference with threadpool workers
+request_db_stats = contextvars.ContextVar('request_db_stats', default=None)
+
+
+def record_cache(name, hit):
+    """Count a cache lookup for the hit-ratio metrics."""
+    CACHE_REQUESTS.labels(name, 'hit' if hit else 'miss').inc()
+
+
+def instrument_engine(engine, name='default'):
+    """
+    Hook query timing, per-request query accounting, the sampled slow-query log
+    and pool checkout timing into a (sync) engine; pass async_engine.sync_engine for async engines.
+    """
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['query_start'].pop()
+        stats = request_db_stats.get()
+        if stats is not None:
+            stats[0] += 1
+            stats[1] += elapsed
+        if elapsed * 1000 >= SLOW_QUERY_MS and random.random() < SLOW_QUERY_SAMPLE_RATE:
+            slow_query_logger.warning('%.1f ms: %s', elapsed * 1000, statement)
+
+    time_pool_checkout(engine, name)
+
+
+def time_pool_checkout(engine, name='default'):
+    """
+    Time Pool.connect, which is where a request waits when the pool is exhausted.
+    engine.dispose() replaces the pool, so call it again for the new one after a dispose.
+    """
+    pool = engine.pool
+    connect = pool.connect
+
+    def timed_connect():
+        start = time.perf_counter()
+        try:
+            return connect()
+        finally:
+            POOL_CHECKOUT_WAIT.labels(name).observe(time.perf_counter() - start)
+
+    pool.connect = timed_connect
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording latency and database work per route template.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        status = [500]
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start':
+                status[0] = message['status']
+            await send(message)
+
+        stats = [0, 0.0]
+        token = request_db_stats.set(stats)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            request_db_stats.reset(token)
+            # The router stores the matched route in the scope; use its template to keep label cardinality low
+            route = scope.get('route')
+            route = getattr(route, 'path', 'unmatched')
+            REQUEST_LATENCY.labels(scope['method'], route, status[0]).observe(elapsed)
+            DB_QUERIES.labels(scope['method'], route).observe(stats[0])
+            DB_TIME.labels(scope['method'], route).observe(stats[1])
+
+
+# Router exposing the metrics in the Prometheus text format
+metrics_router = APIRouter()
+
+
+@metrics_router.get('/metrics', include_in_schema=False)
+def metrics():
+    """
+    Prometheus scrape endpoint.
+    Under gunicorn set PROMETHEUS_MULTIPROC_DIR so every worker's samples are aggregated.
+    """
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
@@ -5,11 +5,15 @@ from sqlalchemy import pool
 from sqlmodel import SQLModel
 from models.gem_models import *
 from models.user_models import *
+from models.job_models import *
 from alembic import context
+from config.config import DATABASE_URL  # The database the app uses (sync driver URL)
 
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
 config = context.config
+# Migrate the app's database rather than the default URL in alembic.ini ('%' is escaped for the ini interpolation)
+config.set_main_option('sqlalchemy.url', DATABASE_URL.replace('%', '%%'))
 
 # Interpret the config file for Python logging.
 # This line sets up loggers basically.
@@ -22,6 +26,11 @@ if config.config_file_name is not None:
 # target_metadata = mymodel.Base.metadata
 target_metadata = SQLModel.metadata
 
+
+def include_object(object, name, type_, reflected, compare_to):
+    # The full-text search index (and FTS5's shadow tables) is managed by hand, see search/search.py
+    return not (type_ == 'table' and name.startswith('gem_search'))
+
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
 # my_important_option = config.get_main_option("my_important_option")
@@ -45,7 +54,7 @@ def run_migrations_offline():
         url=url,
         target_metadata=target_metadata,
         literal_binds=True,
-        dialect_opts={"paramstyle": "named"}, render_as_batch=True
+        dialect_opts={"paramstyle": "named"}, render_as_batch=True, include_object=include_object
     )
 
     with context.begin_transaction():
@@ -67,7 +76,8 @@ def run_migrations_online():
 
     with connectable.connect() as connection:
         context.configure(
-            connection=connection, target_metadata=target_metadata, render_as_batch=True
+            connection=connection, target_metadata=target_metadata, render_as_batch=True,
+            include_object=include_object
         )
 
         with context.begin_transaction():
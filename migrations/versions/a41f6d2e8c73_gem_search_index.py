@@ -0,0 +1,39 @@
+"""gem search index
+
+Revision ID: a41f6d2e8c73
+Revises: 5b7e2c9d4f10
+Create Date: 2026-10-17 16:05:48.730214
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision = 'a41f6d2e8c73'
+down_revision = '5b7e2c9d4f10'
+branch_labels = None
+depends_on = None
+
+# Searchable document of a gem: type, color, clarity and seller name (kept in sync with search/search.py)
+DOCUMENT = ("COALESCE(CAST(gem.gem_type AS VARCHAR), '') || ' ' || COALESCE(CAST(gemproperties.color AS VARCHAR), '')"
+            " || ' ' || COALESCE(CAST(gemproperties.clarity AS VARCHAR), '') || ' ' || COALESCE(\"user\".username, '')")
+SOURCE = ('FROM gem LEFT OUTER JOIN gemproperties ON gemproperties.id = gem.gem_properties_id '
+          'LEFT OUTER JOIN "user" ON gem.seller_id = "user".id')
+
+
+def upgrade():
+    # Not autogenerated: FTS5 virtual table on SQLite, tsvector column with a GIN index on PostgreSQL
+    if op.get_bind().dialect.name == 'sqlite':
+        op.execute('CREATE VIRTUAL TABLE gem_search USING fts5(document)')
+        op.execute(f'INSERT INTO gem_search (rowid, document) SELECT gem.id, {DOCUMENT} {SOURCE}')
+    else:
+        op.execute("CREATE TABLE gem_search (gem_id INTEGER PRIMARY KEY, document TEXT NOT NULL, "
+                   "tsv TSVECTOR GENERATED ALWAYS AS (to_tsvector('simple', document)) STORED)")
+        op.execute('CREATE INDEX ix_gem_search_tsv ON gem_search USING GIN (tsv)')
+        op.execute(f'INSERT INTO gem_search (gem_id, document) SELECT gem.id, {DOCUMENT} {SOURCE}')
+
+
+def downgrade():
+    op.execute('DROP TABLE gem_search')
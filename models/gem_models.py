@@ -1,4 +1,7 @@
+import datetime
 from typing import Optional
+from pydantic import ConfigDict
+from sqlalchemy import Column, Index, Integer, JSON
 from sqlmodel import SQLModel, Field, Relationship
 from enum import Enum as Enum_, IntEnum
 
@@ -32,6 +35,11 @@ class GemColor(str, Enum):
     H = 'H'
     I = 'I'
 
+# Related objects that gem endpoints can embed via the `include` query parameter
+class GemInclude(str, Enum):
+    PROPERTIES = 'properties'
+    SELLER = 'seller'
+
 # SQLModel for gem properties; represents a table in the DB
 class GemProperties(SQLModel, table=True):
     id: Optional[int] = Field(primary_key=True)  # Primary key column
@@ -41,10 +49,20 @@ class GemProperties(SQLModel, table=True):
     # Relationship to Gem: one-to-one or one-to-many depending on your schema design
     gem: Optional['Gem'] = Relationship(back_populates='gem_properties')
 
+# Version of a gem row, bumped by every update; it backs the gem ETags and If-Match (optimistic concurrency)
+gem_version = Column('version', Integer, nullable=False, default=1, server_default='1')
+
 # SQLModel for Gem; represents the main gem table
 class Gem(SQLModel, table=True):
+    # Composite indexes backing the /gems filters and (gem_type, price, id) ordering
+    __table_args__ = (
+        Index('ix_gem_gem_type_price', 'gem_type', 'price'),
+        Index('ix_gem_available_price', 'available', 'price'),
+    )
+    # ORM flushes update and delete a gem only if its version is unchanged, and bump it (StaleDataError if not)
+    __mapper_args__ = {'version_id_col': gem_version}
     id: Optional[int] = Field(primary_key=True)
-    price: float  # Price of the gem
+    price: float = Field(index=True)  # Price of the gem; indexed for lte/gte range filters
     available: bool = True  # Availability status
     gem_type: GemTypes = GemTypes.DIAMOND  # Default gem type is DIAMOND
     # Foreign key referencing GemProperties table
@@ -52,9 +70,60 @@ class Gem(SQLModel, table=True):
     # Relationship to GemProperties
     gem_properties: Optional[GemProperties] = Relationship(back_populates='gem')
     # Foreign key referencing User (seller)
-    seller_id: Optional[int] = Field(default=None, foreign_key='user.id')
+    seller_id: Optional[int] = Field(default=None, foreign_key='user.id', index=True)
     # Relationship to User (seller)
     seller: Optional[User] = Relationship()
+    version: int = Field(default=1, sa_column=gem_version)  # Incremented on every update of the gem
+
+# Denormalized read model of the catalogue: one row per gem with its properties and its seller's public columns,
+# so the list and detail reads need no join (served from it when GEM_LISTING_READS is on). Kept in sync by the
+# gem write endpoints in the same transaction (listing/listing.py) and rebuilt by `python -m listing.listing`
+class GemListing(SQLModel, table=True):
+    __tablename__ = 'gem_listing'
+    # Same access paths as the gem table: /gems filters, (gem_type, price, id) ordering and seller lookups
+    __table_args__ = (
+        Index('ix_gem_listing_gem_type_price', 'gem_type', 'price'),
+        Index('ix_gem_listing_available_price', 'available', 'price'),
+    )
+    id: int = Field(primary_key=True)  # The gem id
+    price: float = Field(index=True)
+    available: bool = True
+    gem_type: GemTypes = GemTypes.DIAMOND
+    gem_properties_id: Optional[int] = None
+    seller_id: Optional[int] = Field(default=None, index=True)
+    version: int = 1
+    # Columns of the gem's properties (None without properties)
+    size: Optional[float] = None
+    clarity: Optional[GemClarity] = None
+    color: Optional[GemColor] = None
+    # Public columns of the gem's seller (None without a seller)
+    seller_username: Optional[str] = None
+    seller_email: Optional[str] = None
+
+# Precomputed statistics behind /gems/stats: one row per (type, color, clarity, size bucket, availability)
+# cell, kept up to date by the gem write endpoints and rebuilt by `python -m stats.stats`
+class GemStats(SQLModel, table=True):
+    gem_type: GemTypes = Field(primary_key=True)
+    color: str = Field(default='', primary_key=True)  # '' for gems without a color
+    clarity: int = Field(default=0, primary_key=True)  # 0 for gems without a clarity
+    size_bucket: int = Field(default=0, primary_key=True)  # Index into stats.stats.SIZE_BUCKETS
+    available: bool = Field(default=True, primary_key=True)
+    gem_count: int = 0
+    price_sum: float = 0
+    price_min: float = 0
+    price_max: float = 0
+
+# Append-only change log behind /gems/changes and its event stream: one row per gem create, update or delete,
+# written in the same transaction as the change. The id is the sequence number consumers resume from;
+# AUTOINCREMENT keeps SQLite from reusing ids once old entries are pruned
+class GemChange(SQLModel, table=True):
+    __table_args__ = {'sqlite_autoincrement': True}
+    id: Optional[int] = Field(default=None, primary_key=True)
+    gem_id: int = Field(index=True)
+    op: str = Field(max_length=6)  # 'create', 'update' or 'delete'
+    changed_at: datetime.datetime = Field(default_factory=datetime.datetime.utcnow)
+    # The gem after the change (before it, for deletes) as {'gem': {...}, 'props': {...}}, like GET /gems rows
+    gem: dict = Field(sa_column=Column(JSON, nullable=False))
 
 # SQLModel for patching a gem (partial updates)
 class GemPatch(SQLModel):
@@ -67,3 +136,23 @@ class GemPatch(SQLModel):
     gem_properties_id: Optional[int] = Field(default=None, foreign_key='gemproperties.id')
     # Relationship to GemProperties (used for partial update operations)
     gem_properties: Optional[GemProperties] = Relationship(back_populates='gem')
+
+# Model for a price quote request; describes a gem without storing it
+class GemQuote(SQLModel):
+    gem_type: GemTypes = GemTypes.DIAMOND
+    size: float = 1
+    clarity: Optional[GemClarity] = None
+    color: Optional[GemColor] = None
+
+# One item of POST /gems/bulk; the price is calculated, not taken from the client
+class GemBulkCreate(GemQuote):
+    model_config = ConfigDict(extra='forbid')  # Unknown keys (e.g. a price) fail the item with 422
+    available: bool = True
+
+# One item of PATCH /gems/bulk; only the fields that are set are updated
+class GemBulkUpdate(SQLModel):
+    model_config = ConfigDict(extra='forbid')  # Unknown keys (e.g. a typo in a field name) fail the item with 422
+    id: int
+    price: Optional[float] = None
+    available: Optional[bool] = None
+    gem_type: Optional[GemTypes] = None
@@ -0,0 +1,22 @@
+import datetime
+from typing import Optional
+from sqlalchemy import Column, Index, JSON
+from sqlmodel import SQLModel, Field
+
+# SQLModel for a background job; represents the job queue table (see jobs/jobs.py)
+class Job(SQLModel, table=True):
+    # Workers claim due jobs with a range scan on (status, run_at)
+    __table_args__ = (
+        Index('ix_job_status_run_at', 'status', 'run_at'),
+    )
+    id: Optional[int] = Field(default=None, primary_key=True)
+    name: str = Field(max_length=64)  # Registered job name, e.g. 'search.reindex'
+    # Keyword arguments for the job's handler
+    payload: dict = Field(default_factory=dict, sa_column=Column(JSON, nullable=False))
+    status: str = Field(default='queued', max_length=8)  # 'queued', 'running' or 'failed'; done jobs are deleted
+    attempts: int = 0  # Times the job was claimed
+    max_attempts: int = 5  # After this many failed attempts the job stays 'failed'
+    # When a queued job is due; for a running job, when its lease runs out and another worker may take it over
+    run_at: datetime.datetime = Field(default_factory=datetime.datetime.utcnow)
+    created_at: datetime.datetime = Field(default_factory=datetime.datetime.utcnow)
+    last_error: Optional[str] = Field(default=None, max_length=1000)
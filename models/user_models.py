@@ -7,7 +7,7 @@ from sqlmodel import SQLModel, Field, Relationship
 # SQLModel for User; represents the users table in the database
 class User(SQLModel, table=True):
     id: Optional[int] = Field(primary_key=True)  # Primary key column
-    username: str = Field(index=True)  # Indexed username field for faster lookups
+    username: str = Field(index=True, unique=True)  # Unique index: fast lookups and no duplicate usernames
     password: str = Field(max_length=256, min_length=6)  # Password field with constraints
     email: EmailStr  # Email field with built-in validation
     # Automatically set created_at to the current datetime when a user is created
@@ -1,43 +1,20 @@
+import argparse  # For the bulk loader command line
+import csv  # For reading gems from CSV files
+import itertools  # For cutting input streams into chunks
+import json  # For reading gems from NDJSON files
 import random  # For generating random values
-from sqlmodel import Session, select
-from db.db import engine  # Import the database engine
-from models.gem_models import Gem, GemProperties, GemTypes, GemColor  # Import gem models
-
-# A dictionary mapping gem colors to their price multipliers
-color_multiplier = {
-    'D': 1.8,
-    'E': 1.6,
-    'G': 1.4,
-    'F': 1.2,
-    'H': 1,
-    'I': 0.8
-}
-
-def calculate_gem_price(gem, gem_pr):
-    """
-    Calculate the price of a gem based on its type, clarity, and size.
-    Adjusts price using predefined multipliers.
-    """
-    price = 1000
-    if gem.gem_type == 'Ruby':
-        price = 400
-    elif gem.gem_type == 'Emerald':
-        price = 650
-
-    if gem_pr.clarity == 1:
-        price *= 0.75
-    elif gem_pr.clarity == 3:
-        price *= 1.25
-    elif gem_pr.clarity == 4:
-        price *= 1.5
+import time  # For reporting load throughput
 
-    price = price * (gem_pr.size ** 3)
-
-    if gem.gem_type == 'Diamond':
-        multiplier = color_multiplier[gem_pr.color]
-        price *= multiplier
-
-    return price
+import numpy as np  # For generating and pricing gems a chunk at a time
+from sqlalchemy import insert
+from sqlmodel import Session
+from db.db import engine  # Import the database engine
+from models.gem_models import Gem, GemProperties, GemTypes, GemColor, GemClarity  # Import gem models
+from pricing.pricing import calculate_gem_price, price_gems  # Gem pricing engine
+from stats.stats import refresh_gem_stats  # Summary table behind /gems/stats
+from search.search import rebuild_search_index  # Full-text index behind /gems/search
+from listing.listing import rebuild_listings  # Denormalized gem_listing table behind the catalogue reads
+from changes.changes import CREATE, log_gem_changes, values_snapshot  # Change log behind /gems/changes
 
 def create_gem_props():
     """
@@ -63,19 +40,133 @@ def create_gem(gem_p):
     gem.price = price
     return gem
 
-def create_gems_db():
+def create_gems_db(n=100):
     """
-    Populate the database with a set of gem properties and gems.
+    Populate the database with n random gem properties and gems.
     """
     # Generate a list of random gem properties
-    gem_ps = [create_gem_props() for x in range(100)]
-    print(gem_ps)
+    gem_ps = [create_gem_props() for x in range(n)]
     with Session(engine) as session:
         session.add_all(gem_ps)
         session.commit()
         # Create a list of gems based on the generated properties
-        gems = [create_gem(gem_ps[x]) for x in range(100)]
+        gems = [create_gem(gem_ps[x]) for x in range(n)]
         session.add_all(gems)
         session.commit()
 
+def generate_gem_chunks(count, chunk_size):
+    """
+    Yield random gems as column dictionaries of at most chunk_size rows.
+    """
+    rng = np.random.default_rng()
+    for start in range(0, count, chunk_size):
+        n = min(chunk_size, count - start)
+        yield {
+            'gem_type': rng.choice(GemTypes.list(), n),
+            'size': rng.integers(3, 71, n) / 10,
+            'clarity': rng.integers(1, 5, n),
+            'color': rng.choice(GemColor.list(), n),
+            'available': np.ones(n, dtype=bool),
+        }
+
+def read_gem_chunks(path, chunk_size):
+    """
+    Stream gems from a CSV (with header) or NDJSON file as column dictionaries of at most chunk_size rows.
+    Each record needs gem_type, size, clarity and color; available, price and seller_id are optional
+    (gems without a price are priced with price_gems).
+    """
+    with open(path, newline='') as f:
+        if path.endswith('.csv'):
+            records = csv.DictReader(f)
+        else:
+            records = (json.loads(line) for line in f if line.strip())
+        while True:
+            rows = list(itertools.islice(records, chunk_size))
+            if not rows:
+                return
+            chunk = {
+                'gem_type': np.array([GemTypes(r['gem_type']).value for r in rows]),
+                'size': np.array([float(r['size']) for r in rows]),
+                'clarity': np.array([GemClarity(int(r['clarity'])).value for r in rows]),
+                'color': np.array([GemColor(r['color']).value for r in rows]),
+                'available': np.array([str(r.get('available', True)).lower() in ('true', '1') for r in rows]),
+            }
+            if any(r.get('price') not in (None, '') for r in rows):
+                # NaN marks the rows without a price; bulk_load_gems prices only those
+                chunk['price'] = np.array([float(r['price']) if r.get('price') not in (None, '') else np.nan
+                                           for r in rows])
+            if any(r.get('seller_id') not in (None, '') for r in rows):
+                chunk['seller_id'] = [int(r['seller_id']) if r.get('seller_id') not in (None, '') else None
+                                      for r in rows]
+            yield chunk
+
+def bulk_load_gems(chunks, bind=engine):
+    """
+    Insert gems chunk by chunk with Core executemany, one transaction per chunk.
+    Properties are inserted first and their returned ids link each Gem to its GemProperties;
+    every gem gets a 'create' entry in the change log, so change feed consumers see the load.
+    Returns the number of gems inserted.
+    """
+    props_insert = insert(GemProperties).returning(GemProperties.id, sort_by_parameter_order=True)
+    gem_insert = insert(Gem).returning(Gem.id, sort_by_parameter_order=True)
+    total = 0
+    for chunk in chunks:
+        sizes, clarities, colors = chunk['size'].tolist(), chunk['clarity'].tolist(), chunk['color'].tolist()
+        prices = chunk.get('price')
+        if prices is None:
+            prices = price_gems(chunk['gem_type'], chunk['clarity'], chunk['color'], chunk['size'])
+        elif np.isnan(prices).any():
+            missing = np.isnan(prices)
+            prices = prices.copy()
+            prices[missing] = price_gems(chunk['gem_type'][missing], chunk['clarity'][missing],
+                                         chunk['color'][missing], chunk['size'][missing])
+        prices = np.round(prices, 2).tolist()
+        sellers = chunk.get('seller_id') or [None] * len(sizes)
+        with bind.begin() as conn:
+            props_ids = conn.execute(props_insert, [
+                {'size': size, 'clarity': clarity, 'color': color}
+                for size, clarity, color in zip(sizes, clarities, colors)
+            ]).scalars().all()
+            gems = [{'price': price, 'available': available, 'gem_type': gem_type,
+                     'gem_properties_id': props_id, 'seller_id': seller_id, 'version': 1}
+                    for price, available, gem_type, props_id, seller_id
+                    in zip(prices, chunk['available'].tolist(), chunk['gem_type'].tolist(), props_ids, sellers)]
+            gem_ids = conn.execute(gem_insert, gems).scalars().all()
+            with Session(conn) as session:  # Joins the chunk's transaction
+                log_gem_changes(session, [
+                    (CREATE, values_snapshot({**gem, 'id': gem_id},
+                                             {'id': props_id, 'size': size, 'clarity': clarity, 'color': color}))
+                    for gem, gem_id, props_id, size, clarity, color
+                    in zip(gems, gem_ids, props_ids, sizes, clarities, colors)])
+        total += len(props_ids)
+    return total
+
+def main():
+    """
+    Bulk loader entry point.
+    Generates --count random gems, or loads them from a CSV/NDJSON file, and reports rows/sec.
+    """
+    parser = argparse.ArgumentParser(description='Bulk-load gems into the database.')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--count', type=int, help='number of random gems to generate')
+    source.add_argument('--file', help='CSV or NDJSON file of gems to load')
+    parser.add_argument('--chunk-size', type=int, default=10000, help='rows per insert batch and transaction')
+    args = parser.parse_args()
+
+    engine.echo = False  # Logging every row would dominate the load time
+    if args.count is not None:
+        chunks = generate_gem_chunks(args.count, args.chunk_size)
+    else:
+        chunks = read_gem_chunks(args.file, args.chunk_size)
+    start = time.perf_counter()
+    total = bulk_load_gems(chunks)
+    elapsed = time.perf_counter() - start
+    print(f'loaded {total} gems in {elapsed:.1f}s ({total / elapsed if elapsed else 0:.0f} rows/sec)')
+    refresh_gem_stats()  # The bulk insert bypasses the incremental stats updates
+    rebuild_search_index()  # ...and the search index maintenance
+    rebuild_listings()  # ...and the gem_listing projection
+
 # create_gems_db()  # Uncomment this line to populate the database with gems
+
+if __name__ == '__main__':
+    main()
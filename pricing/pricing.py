@@ -0,0 +1,135 @@
+import argparse  # For the repricing command line
+import time  # For reporting repricing throughput
+
+import numpy as np  # Prices are computed on whole columns at once
+from sqlalchemy import bindparam, select
+from sqlmodel import Session
+
+from db.db import engine  # Import the database engine
+from changes.changes import UPDATE, log_gem_changes, values_snapshot  # Change log behind /gems/changes
+from models.gem_models import Gem, GemListing, GemProperties, GemTypes, GemClarity, GemColor  # Import gem models
+
+# Base price of a 1-carat gem per type
+BASE_PRICE = {
+    GemTypes.DIAMOND: 1000,
+    GemTypes.RUBY: 400,
+    GemTypes.EMERALD: 650,
+}
+
+# Price multiplier per clarity grade
+CLARITY_MULTIPLIER = {
+    GemClarity.SI: 0.75,
+    GemClarity.VS: 1,
+    GemClarity.VVS: 1.25,
+    GemClarity.FL: 1.5,
+}
+
+# A dictionary mapping gem colors to their price multipliers (applied to diamonds only)
+color_multiplier = {
+    'D': 1.8,
+    'E': 1.6,
+    'G': 1.4,
+    'F': 1.2,
+    'H': 1,
+    'I': 0.8
+}
+
+
+def _to_member(enum_cls, value):
+    """Normalise an enum member, value or name (as read from a request or the DB) to a member."""
+    if value is None or isinstance(value, enum_cls):
+        return value
+    try:
+        return enum_cls(value)
+    except ValueError:
+        return enum_cls[value]
+
+
+def _lookup(values, enum_cls, table, default=1.0):
+    """
+    Map a column of enum values to table entries.
+    Each distinct value is resolved once; the column is then mapped through the resolved dict in C.
+    """
+    values = list(values)
+    resolved = {v: table.get(_to_member(enum_cls, v), default) for v in set(values)}
+    return np.fromiter(map(resolved.__getitem__, values), dtype=float, count=len(values))
+
+
+def price_gems(types, clarities, colors, sizes):
+    """
+    Compute prices for columns of gems (equal-length sequences of type, clarity, color and size).
+    price = base price of the type * clarity multiplier * size^3, times the color multiplier for diamonds.
+    Missing clarity or color counts as a multiplier of 1. Returns a NumPy array rounded to cents.
+    """
+    base = _lookup(types, GemTypes, BASE_PRICE, default=BASE_PRICE[GemTypes.DIAMOND])
+    clarity = _lookup(clarities, GemClarity, CLARITY_MULTIPLIER)
+    color = _lookup(colors, GemColor, {GemColor(c): m for c, m in color_multiplier.items()})
+    is_diamond = _lookup(types, GemTypes, {GemTypes.DIAMOND: 1.0}, default=0.0).astype(bool)
+    price = base * clarity * np.asarray(sizes, dtype=float) ** 3
+    return np.round(np.where(is_diamond, price * color, price), 2)
+
+
+def calculate_gem_price(gem, gem_pr):
+    """
+    Calculate the price of a single gem based on its type, clarity, color and size.
+    """
+    return float(price_gems([gem.gem_type], [gem_pr.clarity], [gem_pr.color], [gem_pr.size])[0])
+
+
+def reprice_gems(chunk_size=10000, bind=engine):
+    """
+    Recompute the stored price of every gem, walking the table by id in chunks.
+    Each chunk is one SELECT and one vectorized pricing pass; the gems whose price changed are updated with
+    UPDATE ... WHERE id = ? AND version = <version read>, so a gem a seller edited after the chunk was read keeps
+    the edit (and is repriced by the next run) instead of getting a price for its old values.
+    Their gem_listing rows (which must stay in step) are then updated with one executemany, and the updates are
+    logged to the change log, all in the chunk's transaction. Gems keeping their price keep their version (ETags).
+    Returns the number of gems whose price changed.
+    """
+    gem_table, listing_table = Gem.__table__, GemListing.__table__
+    # Row by row: the drivers do not all report which rows of an executemany matched
+    update_gem = gem_table.update().where(gem_table.c.id == bindparam('gem_id'),
+                                          gem_table.c.version == bindparam('read_version')).values(
+        price=bindparam('new_price'), version=gem_table.c.version + 1)  # A new price is a new version (ETags)
+    update_listing = listing_table.update().where(listing_table.c.id == bindparam('gem_id')).values(
+        price=bindparam('new_price'), version=bindparam('read_version') + 1)
+    last_id, total = 0, 0
+    while True:
+        with bind.begin() as conn:
+            rows = conn.execute(
+                select(Gem.id, Gem.price, Gem.available, Gem.gem_type, Gem.gem_properties_id, Gem.seller_id,
+                       Gem.version, GemProperties.size, GemProperties.clarity, GemProperties.color)
+                .join(GemProperties).where(Gem.id > last_id).order_by(Gem.id).limit(chunk_size)
+            ).all()
+            if not rows:
+                return total
+            prices = price_gems([row.gem_type for row in rows], [row.clarity for row in rows],
+                                [row.color for row in rows], [row.size for row in rows]).tolist()
+            changed = []
+            for row, price in zip(rows, prices):
+                if price != row.price and conn.execute(update_gem, {
+                        'gem_id': row.id, 'read_version': row.version, 'new_price': price}).rowcount:
+                    changed.append((row, price))
+            if changed:
+                conn.execute(update_listing, [{'gem_id': row.id, 'read_version': row.version, 'new_price': price}
+                                              for row, price in changed])
+                with Session(conn) as session:  # Joins the chunk's transaction
+                    log_gem_changes(session, [
+                        (UPDATE, values_snapshot({**row._mapping, 'price': price, 'version': row.version + 1},
+                                                 {**row._mapping, 'id': row.gem_properties_id}))
+                        for row, price in changed])
+        last_id, total = rows[-1].id, total + len(changed)
+
+
+if __name__ == '__main__':
+    # Usage: python -m pricing.pricing --chunk-size 10000
+    parser = argparse.ArgumentParser(description='Reprice every gem with the current multipliers.')
+    parser.add_argument('--chunk-size', type=int, default=10000, help='gems per SELECT/UPDATE batch')
+    args = parser.parse_args()
+    engine.echo = False  # Logging every row would dominate the run time
+    start = time.perf_counter()
+    count = reprice_gems(args.chunk_size)
+    elapsed = time.perf_counter() - start
+    print(f'repriced {count} gems in {elapsed:.1f}s ({count / elapsed if elapsed else 0:.0f} rows/sec)')
+    from stats.stats import refresh_gem_stats  # Deferred: stats is not needed to import the pricing engine
+    refresh_gem_stats()  # Price ranges in the summary table are stale after repricing
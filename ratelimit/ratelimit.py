@@ -0,0 +1,206 @@
+import logging  # For reporting an unreachable shared backend
+import math  # For rounding Retry-After up to whole seconds
+import threading  # Lock so the buckets can be shared by threadpool workers
+import time  # Clocks for refilling the buckets
+from collections import OrderedDict  # Keeps buckets in least-recently-used order
+
+from fastapi import HTTPException  # Raised by decode_token for invalid tokens
+from starlette.responses import JSONResponse
+
+from auth.auth import AuthHandler  # Resolves the user behind a bearer token (cached)
+from config.config import RATE_LIMIT_ENABLED, RATE_LIMIT_BACKEND, RATE_LIMIT_REDIS_URL, RATE_LIMIT_IP_RATE, \
+    RATE_LIMIT_IP_BURST, RATE_LIMIT_USER_RATE, RATE_LIMIT_USER_BURST, RATE_LIMIT_IP_HEADER, \
+    ROUTE_CONCURRENCY_LIMIT, BULK_CONCURRENCY_LIMIT, CHANGE_STREAM_LIMIT
+from metrics.metrics import RATE_LIMITED  # Rejection counter for the metrics endpoint
+
+logger = logging.getLogger('ratelimit')
+
+# Expensive routes: (method, route template) -> (tokens taken per request, requests served at once per worker).
+# Every other route takes one token and has no concurrency cap
+ROUTE_POLICIES = {
+    ('POST', '/login'): (5, None),  # bcrypt; concurrency is already bounded by the password pool
+    ('POST', '/registration'): (5, None),
+    ('POST', '/registration/bulk'): (20, BULK_CONCURRENCY_LIMIT),
+    ('GET', '/gems'): (1, ROUTE_CONCURRENCY_LIMIT),
+    ('GET', '/gems/search'): (2, ROUTE_CONCURRENCY_LIMIT),
+    ('GET', '/gems/changes/stream'): (1, CHANGE_STREAM_LIMIT),  # Long-lived; the cap bounds open streams
+    ('POST', '/gems/price-quote'): (5, ROUTE_CONCURRENCY_LIMIT),
+    ('POST', '/gems/bulk'): (20, BULK_CONCURRENCY_LIMIT),
+    ('PATCH', '/gems/bulk'): (20, BULK_CONCURRENCY_LIMIT),
+    ('DELETE', '/gems/bulk'): (20, BULK_CONCURRENCY_LIMIT),
+}
+# Paths that are never limited (the Prometheus scraper polls /metrics)
+EXEMPT_PATHS = {'/metrics'}
+
+# Atomic token bucket for Redis-compatible servers: refill by elapsed time, take `cost` tokens if there are enough,
+# and return the seconds until there would be (0 when the request is allowed); idle buckets expire once full
+TOKEN_BUCKET_SCRIPT = """
+local rate, burst, cost, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1]) or burst
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if tokens >= cost then
+    tokens = tokens - cost
+else
+    wait = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000))
+return tostring(wait)
+"""
+
+
+class MemoryRateLimitBackend:
+    """
+    Token buckets kept in this process. Each gunicorn worker has its own buckets, so a client spread over
+    N workers gets up to N times the configured rate; use RedisRateLimitBackend for exact limits.
+    Beyond maxsize the least recently used bucket is dropped (it comes back full).
+    """
+
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()  # key -> (tokens, updated_at)
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst, cost=1):
+        """Take cost tokens from the bucket; returns 0 if allowed, otherwise the seconds to wait."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            if tokens >= cost:
+                tokens -= cost
+                wait = 0.0
+            else:
+                wait = (cost - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        return wait
+
+
+class RedisRateLimitBackend:
+    """
+    Token buckets shared by every worker through a Redis-compatible server (a local unix socket keeps the
+    round trip short). One atomic script call per check; the client only needs eval, e.g. redis.Redis
+    or fakeredis.FakeRedis in tests.
+    """
+
+    def __init__(self, client, prefix='ratelimit'):
+        self.client = client
+        self.prefix = prefix
+
+    def take(self, key, rate, burst, cost=1):
+        """Take cost tokens from the bucket; returns 0 if allowed, otherwise the seconds to wait."""
+        return float(self.client.eval(TOKEN_BUCKET_SCRIPT, 1, f'{self.prefix}:{key}', rate, burst, cost, time.time()))
+
+
+def make_backend():
+    """Create the backend selected by RATE_LIMIT_BACKEND."""
+    if RATE_LIMIT_BACKEND == 'redis':
+        import redis  # Optional dependency, only needed for the shared backend
+        return RedisRateLimitBackend(redis.Redis.from_url(RATE_LIMIT_REDIS_URL))
+    return MemoryRateLimitBackend()
+
+
+def too_many_requests(retry_after, detail='Too many requests, try again later'):
+    """429 response with a whole-second Retry-After."""
+    return JSONResponse({'detail': detail}, status_code=429,
+                        headers={'Retry-After': str(max(1, math.ceil(retry_after)))})
+
+
+class RateLimitMiddleware:
+    """
+    ASGI admission control in front of the routers.
+    - Every request takes tokens from its client IP's bucket and, with a valid bearer token, from its user's bucket.
+    - Requests on capped routes are rejected while the worker already serves the cap on that route.
+    Rejections are answered with 429 and Retry-After before any endpoint code, database or bcrypt work runs.
+    """
+
+    def __init__(self, app, backend=None, enabled=RATE_LIMIT_ENABLED, policies=ROUTE_POLICIES,
+                 ip_limit=(RATE_LIMIT_IP_RATE, RATE_LIMIT_IP_BURST),
+                 user_limit=(RATE_LIMIT_USER_RATE, RATE_LIMIT_USER_BURST), ip_header=RATE_LIMIT_IP_HEADER):
+        self.app = app
+        self.backend = backend if backend is not None else make_backend()
+        self.enabled = enabled
+        self.policies = policies
+        self.ip_limit = ip_limit
+        self.user_limit = user_limit
+        self.ip_header = ip_header.lower().encode() if ip_header else None
+        self.auth_handler = AuthHandler()
+        self.in_flight = {}  # route template -> requests being served by this worker
+        self._routes = None  # [(method, compiled path regex, template, cost, cap)] of the policy routes
+
+    def policy_routes(self, app):
+        """Resolve the policy routes against the app's routes once, keeping their compiled path regexes."""
+        if self._routes is None:
+            self._routes = [(method, route.path_regex, route.path, *self.policies[method, route.path])
+                            for route in app.router.routes for method in getattr(route, 'methods', None) or ()
+                            if (method, getattr(route, 'path', None)) in self.policies]
+        return self._routes
+
+    def route_policy(self, scope):
+        """(route template, cost, cap) for the request; unlisted routes cost one token and are not capped."""
+        for method, regex, template, cost, cap in self.policy_routes(scope['app']):
+            if method == scope['method'] and regex.match(scope['path']):
+                return template, cost, cap
+        return None, 1, None
+
+    def client_ip(self, scope):
+        """Client address: the configured proxy header if present, else the peer address."""
+        if self.ip_header:
+            for name, value in scope['headers']:
+                if name == self.ip_header:
+                    return value.decode('latin-1').split(',')[0].strip()
+        client = scope.get('client')
+        return client[0] if client else 'unknown'
+
+    def user(self, scope):
+        """Username of a valid bearer token (served from the verified-token cache), or None."""
+        for name, value in scope['headers']:
+            if name == b'authorization':
+                scheme, _, token = value.decode('latin-1').partition(' ')
+                if scheme.lower() != 'bearer' or not token:
+                    return None
+                try:
+                    return self.auth_handler.decode_token(token)
+                except HTTPException:
+                    return None  # The endpoint answers 401 itself
+        return None
+
+    def wait_time(self, scope, cost):
+        """Seconds until the request would be allowed (0 if it is) and the bucket that refused it."""
+        try:
+            wait = self.backend.take(f'ip:{self.client_ip(scope)}', *self.ip_limit, min(cost, self.ip_limit[1]))
+            if wait:
+                return wait, 'ip'
+            username = self.user(scope)
+            if username is not None:
+                wait = self.backend.take(f'user:{username}', *self.user_limit, min(cost, self.user_limit[1]))
+                if wait:
+                    return wait, 'user'
+        except Exception:
+            # A shared backend that is down must not take the API with it: let the request through
+            logger.exception('rate limit backend failed')
+        return 0, None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not self.enabled or scope['path'] in EXEMPT_PATHS:
+            return await self.app(scope, receive, send)
+        template, cost, cap = self.route_policy(scope)
+        wait, reason = self.wait_time(scope, cost)
+        if reason is None and cap is not None and self.in_flight.get(template, 0) >= cap:
+            wait, reason = 1, 'concurrency'
+        if reason is not None:
+            RATE_LIMITED.labels(template or 'other', reason).inc()
+            return await too_many_requests(wait)(scope, receive, send)
+        if cap is None:
+            return await self.app(scope, receive, send)
+        self.in_flight[template] = self.in_flight.get(template, 0) + 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.in_flight[template] -= 1
@@ -1,13 +1,67 @@
-from db.db import engine  # Import the database engine from the DB module
-from models.gem_models import Gem, GemProperties  # Import gem-related models
+import base64  # For encoding pagination cursors into URL-safe strings
+import json  # For serializing cursor keys
+
+import orjson  # Fast JSON serialization for streamed rows
+from sqlalchemy import delete, tuple_, update  # Row-value comparison for keyset pagination; conditional gem writes
+from sqlalchemy.orm import joinedload, selectinload  # Eager-loading strategies for Gem relationships
+
+from config.config import GEM_LISTING_READS  # Whether catalogue reads use the gem_listing projection
+from db.db import read_engine  # Read-only engine; these queries never write
+from models.gem_models import Gem, GemListing, GemProperties, GemTypes, GemInclude  # Import gem-related models
+from models.user_models import User  # Sellers, embedded on request
+from pricing.pricing import price_gems  # Vectorized pricing for bulk inserts
+from stats.stats import gem_snapshot, record_gem_change, record_gem_changes  # Summary table behind /gems/stats
+from search.search import matching_gem_ids  # Full-text index behind /gems/search
+from jobs.jobs import SEARCH_REINDEX, enqueue  # The index is brought up to date by a background job
+from listing.listing import sync_listings  # Denormalized gem_listing projection, updated in the same transaction
+from changes.changes import CREATE, UPDATE, DELETE, change_snapshot, log_gem_change, log_gem_changes  # Gem change log
 from sqlmodel import Session, select, or_  # SQLModel ORM functions
 
+# Page size used when a cursor is given without an explicit limit
+DEFAULT_PAGE_SIZE = 100
+# Number of rows fetched per round trip while streaming
+STREAM_CHUNK_SIZE = 1000
+
+# Columns of the gem list read model as (key, column) pairs, in output order
+GEM_FIELDS = (('id', Gem.id), ('price', Gem.price), ('available', Gem.available), ('gem_type', Gem.gem_type),
+              ('gem_properties_id', Gem.gem_properties_id), ('seller_id', Gem.seller_id), ('version', Gem.version))
+PROPS_FIELDS = (('id', GemProperties.id), ('size', GemProperties.size), ('clarity', GemProperties.clarity),
+                ('color', GemProperties.color))
+# Public seller columns embedded with include=seller (never the password hash)
+SELLER_FIELDS = (('id', User.id), ('username', User.username), ('email', User.email))
+# The same read model served from the gem_listing projection, which needs no joins
+LISTING_GEM_FIELDS = tuple((key, getattr(GemListing, key)) for key, _ in GEM_FIELDS)
+LISTING_PROPS_FIELDS = (('id', GemListing.gem_properties_id), ('size', GemListing.size),
+                        ('clarity', GemListing.clarity), ('color', GemListing.color))
+LISTING_SELLER_FIELDS = (('id', GemListing.seller_id), ('username', GemListing.seller_username),
+                         ('email', GemListing.seller_email))
+# Columns the catalogue queries select, filter and sort on, from the read model chosen by GEM_LISTING_READS;
+# READ_COLUMNS maps the gem keys and the property keys (but the property id) to their column
+if GEM_LISTING_READS:
+    READ_FIELDS = (LISTING_GEM_FIELDS, LISTING_PROPS_FIELDS, LISTING_SELLER_FIELDS)
+else:
+    READ_FIELDS = (GEM_FIELDS, PROPS_FIELDS, SELLER_FIELDS)
+READ_COLUMNS = {**dict(READ_FIELDS[1][1:]), **dict(READ_FIELDS[0])}
+
+# Attempts of an unconditional single-gem update that keeps losing the race against other writers
+UPDATE_ATTEMPTS = 3
+
+# Sort keys accepted by search (see READ_COLUMNS), with the side of the read-model dict pair holding their value;
+# prefix a key with '-' to sort descending
+SEARCH_SORTS = {'price': 0, 'size': 1, 'id': 0}
+
+# Eager-loading strategies: joinedload fetches related rows in the same query,
+# selectinload in one extra `IN (...)` query per relationship however many gems are loaded
+LOADERS = {'joined': joinedload, 'selectin': selectinload}
+# Gem relationship behind each include option
+INCLUDE_RELATIONSHIPS = {GemInclude.PROPERTIES: Gem.gem_properties, GemInclude.SELLER: Gem.seller}
+
 def select_all_gems():
     """
     Retrieve all gems along with their properties.
     Returns a list of dictionaries, each containing a gem and its properties.
     """
-    with Session(engine) as session:
+    with Session(read_engine) as session:
         # Build a query that joins Gem and GemProperties
         statement = select(Gem, GemProperties).join(GemProperties)
         # Execute the query and iterate over the results
@@ -17,16 +71,398 @@ def select_all_gems():
             res.append({'gem': gem, 'props': props})
         return res
 
+def search_gems(q=None, sort='price', limit=DEFAULT_PAGE_SIZE, **filters):
+    """
+    Search gems by free text (type, color, clarity, seller name) and the filters of search_gems_statement.
+    Returns the first `limit` matches as (gem, properties) dict pairs in `sort` order.
+    """
+    with Session(read_engine) as session:
+        statement = search_page(search_gems_statement(q, **filters), sort, limit=limit)
+        return rows_to_pairs(session.exec(statement))
+
 def select_gem(id):
     """
     Retrieve a specific gem by its ID along with its properties.
     Returns the first matching tuple (gem, gem_properties) or None.
     """
-    with Session(engine) as session:
+    with Session(read_engine) as session:
         # Build a query with a join and filter on Gem.id
         statement = select(Gem, GemProperties).join(GemProperties)
         statement = statement.where(Gem.id == id)
         result = session.exec(statement)
         return result.first()
 
+async def select_all_gems_async(session):
+    """
+    Async version of select_all_gems using the given AsyncSession.
+    """
+    statement = select(Gem, GemProperties).join(GemProperties)
+    result = await session.exec(statement)
+    return [{'gem': gem, 'props': props} for gem, props in result]
+
+async def select_gem_async(session, id):
+    """
+    Async version of select_gem using the given AsyncSession.
+    """
+    statement = select(Gem, GemProperties).join(GemProperties).where(Gem.id == id)
+    result = await session.exec(statement)
+    return result.first()
+
+def gem_load_options(include=(), strategy='joined'):
+    """
+    Loader options that eager-load the requested relationships (see INCLUDE_RELATIONSHIPS)
+    with the given strategy ('joined' or 'selectin'), so serializing them never lazy-loads per row.
+    """
+    loader = LOADERS[strategy]
+    return [loader(INCLUDE_RELATIONSHIPS[GemInclude(name)]) for name in include or ()]
+
+async def select_gems_async(session, statement=None, include=(), strategy='selectin'):
+    """
+    Load Gem objects for a statement (all gems by default) with the requested relationships eager-loaded.
+    """
+    statement = select(Gem) if statement is None else statement
+    result = await session.exec(statement.options(*gem_load_options(include, strategy)))
+    return result.unique().all()  # unique() is required when joinedload is used on a collection
+
+async def get_gem_async(session, id, include=(), strategy='joined'):
+    """
+    Load one gem by id with the requested relationships eager-loaded, in a single round trip by default.
+    """
+    return await session.get(Gem, id, options=gem_load_options(include, strategy))
+
+async def gem_detail_async(session, id, include=()):
+    """
+    The GET /gem/{id} representation of a gem (see gem_to_dict), or None if there is no such gem.
+    From the gem_listing projection (one row, no join) when GEM_LISTING_READS is on, else from the ORM.
+    """
+    if not GEM_LISTING_READS:
+        gem = await get_gem_async(session, id, include)
+        return gem_to_dict(gem, include) if gem else None
+    fields = LISTING_GEM_FIELDS + LISTING_PROPS_FIELDS + LISTING_SELLER_FIELDS
+    row = (await session.exec(select(*(column for _, column in fields)).where(GemListing.id == id))).first()
+    if row is None:
+        return None
+    [(data, props)] = rows_to_pairs([row], include_seller=True)
+    seller = data.pop('seller')
+    if GemInclude.PROPERTIES in include:
+        data['gem_properties'] = props if props['id'] is not None else None
+    if GemInclude.SELLER in include:
+        data['seller'] = seller
+    return data
+
+def gem_to_dict(gem, include=()):
+    """
+    Serialize a Gem and the included relationships into plain dicts.
+    """
+    data = gem.dict()
+    if GemInclude.PROPERTIES in include:
+        data['gem_properties'] = gem.gem_properties.dict() if gem.gem_properties else None
+    if GemInclude.SELLER in include:
+        seller = gem.seller
+        data['seller'] = {key: getattr(seller, key) for key, _ in SELLER_FIELDS} if seller else None
+    return data
+
+def gem_columns_statement(include_seller=False):
+    """
+    Select only the gem and property columns the list responses need; rows come back as plain tuples.
+    With include_seller the public seller columns are outer-joined into the same query.
+    With GEM_LISTING_READS all of them come from the gem_listing projection, without joins.
+    """
+    gem_fields, props_fields, seller_fields = READ_FIELDS
+    fields = gem_fields + props_fields + (seller_fields if include_seller else ())
+    statement = select(*(column for _, column in fields))
+    if GEM_LISTING_READS:
+        # Like the inner join with gemproperties, list only gems that have properties
+        return statement.select_from(GemListing).where(GemListing.gem_properties_id.is_not(None))
+    statement = statement.select_from(Gem).join(GemProperties)
+    if include_seller:
+        statement = statement.outerjoin(User, Gem.seller_id == User.id)
+    return statement
+
+def rows_to_pairs(rows, include_seller=False):
+    """
+    Split read-model rows into (gem, props) dicts without building ORM or Pydantic objects.
+    With include_seller the trailing seller columns are embedded in the gem dict as 'seller'.
+    """
+    rows = list(rows)
+    gem_keys = [key for key, _ in GEM_FIELDS]
+    props_keys = [key for key, _ in PROPS_FIELDS]
+    split, end = len(gem_keys), len(gem_keys) + len(props_keys)
+    pairs = [(dict(zip(gem_keys, row[:split])), dict(zip(props_keys, row[split:end]))) for row in rows]
+    if include_seller:
+        seller_keys = [key for key, _ in SELLER_FIELDS]
+        for (gem, _), row in zip(pairs, rows):
+            gem['seller'] = dict(zip(seller_keys, row[end:])) if row[end] is not None else None
+    return pairs
+
+def filter_gems_statement(lte=None, gte=None, types=None, include_seller=False):
+    """
+    Build the read-model query used by GET /gems with its optional price and type filters.
+    """
+    statement = gem_columns_statement(include_seller)
+    if lte:
+        statement = statement.where(READ_COLUMNS['price'] <= lte)
+    if gte:
+        statement = statement.where(READ_COLUMNS['price'] >= gte)
+    if types:
+        statement = statement.where(READ_COLUMNS['gem_type'].in_(types))
+    return statement
+
+def seller_gems_statement(seller_id, include_seller=False):
+    """
+    Build the read-model query used by GET /gems/seller/me for the gems of one seller.
+    """
+    return gem_columns_statement(include_seller).where(READ_COLUMNS['seller_id'] == seller_id)
+
+def _encode_key(key):
+    """Encode a sort key (a JSON-serializable list) into an opaque URL-safe cursor."""
+    raw = json.dumps(key, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def _decode_key(cursor):
+    """Decode a cursor produced by _encode_key; invalid base64 or JSON raises ValueError."""
+    padded = cursor + '=' * (-len(cursor) % 4)
+    return json.loads(base64.urlsafe_b64decode(padded))
+
+def encode_cursor(gem):
+    """
+    Encode the (gem_type, price, id) sort key of a read-model gem dict into an opaque cursor.
+    """
+    return _encode_key([gem['gem_type'], gem['price'], gem['id']])
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor produced by encode_cursor back into its sort key.
+    Raises ValueError if the cursor is malformed.
+    """
+    try:
+        gem_type, price, id = _decode_key(cursor)
+        return GemTypes(gem_type), float(price), int(id)
+    except (TypeError, ValueError) as e:
+        raise ValueError('Invalid cursor') from e
+
+def keyset_page(statement, cursor=None, limit=None):
+    """
+    Order a gem query by (gem_type, price, id), continue after the given cursor
+    and fetch at most `limit` rows.
+    """
+    key = (READ_COLUMNS['gem_type'], READ_COLUMNS['price'], READ_COLUMNS['id'])
+    statement = statement.order_by(None).order_by(*key)
+    if cursor:
+        statement = statement.where(tuple_(*key) > decode_cursor(cursor))
+    if limit is not None:
+        statement = statement.limit(limit)
+    return statement
+
+def search_gems_statement(q=None, types=None, colors=None, clarities=None, size_min=None, size_max=None,
+                          price_min=None, price_max=None, available=None, include_seller=False):
+    """
+    Build the read-model query used by GET /gems/search. Free text goes through the full-text index
+    (see search/search.py); the other filters are plain column conditions on the read model (READ_COLUMNS).
+    """
+    c = READ_COLUMNS
+    statement = gem_columns_statement(include_seller)
+    matches = matching_gem_ids(q, read_engine.dialect.name)
+    if matches is not None:
+        statement = statement.where(c['id'].in_(matches))
+    if types:
+        statement = statement.where(c['gem_type'].in_(types))
+    if colors:
+        statement = statement.where(c['color'].in_(colors))
+    if clarities:
+        statement = statement.where(c['clarity'].in_(clarities))
+    if size_min is not None:
+        statement = statement.where(c['size'] >= size_min)
+    if size_max is not None:
+        statement = statement.where(c['size'] <= size_max)
+    if price_min is not None:
+        statement = statement.where(c['price'] >= price_min)
+    if price_max is not None:
+        statement = statement.where(c['price'] <= price_max)
+    if available is not None:
+        statement = statement.where(c['available'] == available)
+    return statement
+
+def encode_search_cursor(pair, sort):
+    """
+    Encode the (sort value, id) key of a read-model (gem, props) pair into a cursor for the given sort.
+    """
+    name = sort.lstrip('-')
+    return _encode_key([sort, pair[SEARCH_SORTS[name]][name], pair[0]['id']])
+
+def search_page(statement, sort='price', cursor=None, limit=None):
+    """
+    Order a search query by the sort key and id, continue after the given cursor and fetch at most `limit` rows.
+    Raises ValueError for an unknown sort or a cursor that is malformed or belongs to another sort.
+    """
+    descending = sort.startswith('-')
+    if sort.lstrip('-') not in SEARCH_SORTS:
+        raise ValueError('Invalid sort')
+    column, id_column = READ_COLUMNS[sort.lstrip('-')], READ_COLUMNS['id']
+    order = (column.desc(), id_column.desc()) if descending else (column, id_column)
+    statement = statement.order_by(None).order_by(*order)
+    if cursor:
+        try:
+            cursor_sort, value, id = _decode_key(cursor)
+            key = (float(value), int(id))
+        except (TypeError, ValueError) as e:
+            raise ValueError('Invalid cursor') from e
+        if cursor_sort != sort:
+            raise ValueError('Invalid cursor')
+        position = tuple_(column, id_column)
+        statement = statement.where(position < key if descending else position > key)
+    if limit is not None:
+        statement = statement.limit(limit)
+    return statement
+
+def stream_gems(statement, include_seller=False):
+    """
+    Yield read-model rows as NDJSON lines without materialising the result.
+    Uses its own session so the server-side cursor outlives the request handler.
+    """
+    with Session(read_engine) as session:
+        result = session.exec(statement.execution_options(yield_per=STREAM_CHUNK_SIZE))
+        for rows in result.partitions():
+            pairs = rows_to_pairs(rows, include_seller)
+            yield b''.join(orjson.dumps({'gem': gem, 'props': props}) + b'\n' for gem, props in pairs)
+
+def insert_gems(session, items, seller_id):
+    """
+    Price and insert a batch of GemBulkCreate items for a seller in the caller's transaction:
+    one vectorized pricing pass and two flushes, whatever the batch size.
+    Returns the new gem ids, in order.
+    """
+    props = [GemProperties(size=item.size, clarity=item.clarity, color=item.color) for item in items]
+    prices = price_gems([i.gem_type for i in items], [i.clarity for i in items], [i.color for i in items],
+                        [i.size for i in items]).tolist()
+    session.add_all(props)
+    session.flush()
+    gems = [Gem(price=price, available=item.available, gem_type=item.gem_type, gem_properties_id=p.id,
+                seller_id=seller_id) for item, p, price in zip(items, props, prices)]
+    session.add_all(gems)
+    session.flush()
+    record_gem_changes(session, [(None, gem_snapshot(session, gem)) for gem in gems])
+    sync_listings(session, [gem.id for gem in gems])
+    enqueue(session, SEARCH_REINDEX, ids=[gem.id for gem in gems])
+    log_gem_changes(session, [(CREATE, change_snapshot(session, gem)) for gem in gems])
+    return [gem.id for gem in gems]
+
+def _owned_gems(session, ids, seller_id):
+    """
+    Load the gems with the given ids (and their properties, for the stats snapshots) in two queries.
+    Returns the gems by id and a {id: (status, detail)} map of the ids the seller cannot change.
+    """
+    # Fresh versions for the conditional writes, even for gems a previous batch left in the session
+    gems = {gem.id: gem for gem in session.exec(select(Gem).where(Gem.id.in_(ids))
+                                                .execution_options(populate_existing=True))}
+    props_ids = {gem.gem_properties_id for gem in gems.values() if gem.gem_properties_id}
+    if props_ids:
+        session.exec(select(GemProperties).where(GemProperties.id.in_(props_ids))).all()
+    errors = {}
+    for id in ids:
+        if id not in gems:
+            errors[id] = (404, 'Gem not found')
+        elif gems[id].seller_id != seller_id:
+            errors[id] = (401, 'Gem belongs to another seller')
+    return gems, errors
+
+def update_gems(session, items, seller_id):
+    """
+    Apply a batch of GemBulkUpdate items to the seller's gems in the caller's transaction, each with a conditional
+    UPDATE ... WHERE id = ? AND version = ? (as update_gem_values): an item whose gem another request changed since
+    it was read gets a 409 of its own instead of failing the batch.
+    Returns one (status, detail) per item, in order.
+    """
+    gems, errors = _owned_gems(session, {item.id for item in items}, seller_id)
+    before = {}
+    results = []
+    for item in items:
+        if item.id in errors:
+            results.append(errors[item.id])
+            continue
+        gem = gems[item.id]
+        values = item.dict(exclude_unset=True, exclude_none=True, exclude={'id'})
+        if not values:
+            results.append((200, None))
+            continue
+        snapshot = gem_snapshot(session, gem)
+        updated = session.execute(
+            update(Gem).where(Gem.id == gem.id, Gem.version == gem.version)
+            .values(**values, version=Gem.version + 1).returning(Gem),
+            execution_options={'synchronize_session': False, 'populate_existing': True}).scalars().first()
+        if updated is None:
+            results.append((409, 'Gem was modified by another request'))
+            continue
+        before.setdefault(gem.id, snapshot)
+        results.append((200, None))
+    record_gem_changes(session, [(snapshot, gem_snapshot(session, gems[id])) for id, snapshot in before.items()])
+    if before:
+        sync_listings(session, before)
+        enqueue(session, SEARCH_REINDEX, ids=list(before))
+    log_gem_changes(session, [(UPDATE, change_snapshot(session, gems[id])) for id in before])
+    return results
+
+def update_gem_values(session, id, seller_id, values, versions=None):
+    """
+    Update one of the seller's gems in the caller's transaction with a single conditional statement,
+    UPDATE gem SET ..., version = version + 1 WHERE id = ? AND version = ? RETURNING ..., and record the change
+    for stats, the gem listing, search and the change log. The gem and its properties are read first (one query)
+    for the ownership check and the stats delta; the version condition guarantees nothing changed in between.
+    `versions` are the versions the client allows overwriting (from If-Match); with None, a change that
+    slipped in between is read again and overwritten, up to UPDATE_ATTEMPTS times.
+    Returns (status, gem): (200, updated gem), (404, None), (401, None) or (409, current gem).
+    """
+    for _ in range(UPDATE_ATTEMPTS):
+        gem = session.exec(select(Gem).where(Gem.id == id).options(joinedload(Gem.gem_properties))
+                           .execution_options(populate_existing=True)).first()
+        if gem is None:
+            return 404, None
+        if gem.seller_id != seller_id:
+            return 401, None
+        if versions is not None and gem.version not in versions:
+            return 409, gem
+        before = gem_snapshot(session, gem)
+        updated = session.execute(
+            update(Gem).where(Gem.id == id, Gem.version == gem.version)
+            .values(**values, version=Gem.version + 1).returning(Gem),
+            execution_options={'synchronize_session': False, 'populate_existing': True}).scalars().first()
+        if updated is not None:
+            record_gem_change(session, before, gem_snapshot(session, updated))
+            sync_listings(session, [id])
+            enqueue(session, SEARCH_REINDEX, ids=[id])
+            log_gem_change(session, UPDATE, change_snapshot(session, updated))
+            return 200, updated
+    return 409, gem
+
+def delete_gems(session, ids, seller_id):
+    """
+    Delete a batch of the seller's gems by id in the caller's transaction, each with a conditional
+    DELETE ... WHERE id = ? AND version = ?: a gem another request changed since it was read gets a 409.
+    Returns one (status, detail) per id, in order.
+    """
+    gems, errors = _owned_gems(session, set(ids), seller_id)
+    before, deleted, snapshots = [], [], []
+    results = []
+    for id in ids:
+        if id in errors:
+            results.append(errors[id])
+        elif id not in gems:
+            results.append((404, 'Gem not found'))  # Repeated in the same request
+        else:
+            gem = gems.pop(id)
+            if session.execute(delete(Gem).where(Gem.id == id, Gem.version == gem.version)).rowcount == 0:
+                results.append((409, 'Gem was modified by another request'))
+                continue
+            before.append(gem_snapshot(session, gem))
+            snapshots.append((DELETE, change_snapshot(session, gem)))
+            deleted.append(id)
+            session.expunge(gem)  # Deleted by the statement, not by the unit of work
+            results.append((204, None))
+    record_gem_changes(session, [(snapshot, None) for snapshot in before])
+    if deleted:
+        sync_listings(session, deleted)
+        enqueue(session, SEARCH_REINDEX, ids=deleted)
+    log_gem_changes(session, snapshots)
+    return results
+
 # select_gems()  # This line is commented out; it may be used for debugging or testing.
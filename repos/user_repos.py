@@ -1,6 +1,6 @@
 from sqlmodel import Session, select
 
-from db.db import engine  # Import the database engine from the DB module
+from db.db import read_engine  # Read-only engine; these queries never write
 from models.user_models import User  # Import the User model
 
 def select_all_users():
@@ -8,7 +8,7 @@ def select_all_users():
     Retrieve all users from the database.
     Returns a list of User objects.
     """
-    with Session(engine) as session:
+    with Session(read_engine) as session:
         statement = select(User)
         res = session.exec(statement).all()
         return res
@@ -18,6 +18,27 @@ def find_user(name):
     Find a user by username.
     Returns the first matching User object or None if not found.
     """
-    with Session(engine) as session:
+    with Session(read_engine) as session:
         statement = select(User).where(User.username == name)
         return session.exec(statement).first()
+
+async def select_all_users_async(session):
+    """
+    Async version of select_all_users using the given AsyncSession.
+    """
+    result = await session.exec(select(User))
+    return result.all()
+
+async def find_user_async(session, name):
+    """
+    Async version of find_user using the given AsyncSession.
+    """
+    result = await session.exec(select(User).where(User.username == name))
+    return result.first()
+
+async def find_taken_usernames_async(session, names):
+    """
+    Return the subset of the given usernames that already exist, using the username index.
+    """
+    result = await session.exec(select(User.username).where(User.username.in_(names)))
+    return set(result.all())
@@ -0,0 +1,124 @@
+import argparse  # For the rebuild command line
+import re  # For splitting search text into terms
+import time  # For reporting the rebuild time
+
+from sqlalchemy import String, cast, column, delete, func, insert, literal, table, text
+from sqlmodel import select
+
+from db.db import engine  # Import the database engine
+from models.gem_models import Gem, GemProperties  # Import gem models
+from models.user_models import User  # Seller names are searchable
+
+# Name of the full-text index: an FTS5 virtual table keyed by rowid on SQLite,
+# a table with a generated tsvector column and a GIN index on PostgreSQL
+SEARCH_TABLE = 'gem_search'
+# Text search configuration used on PostgreSQL; 'simple' neither stems nor drops stop words, like FTS5's default
+PG_TEXT_CONFIG = 'simple'
+
+# DDL per dialect; IF NOT EXISTS so it can run on every start of a script or benchmark
+SEARCH_DDL = {
+    'sqlite': [f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5(document)"],
+    'postgresql': [
+        f"CREATE TABLE IF NOT EXISTS {SEARCH_TABLE} (gem_id INTEGER PRIMARY KEY, document TEXT NOT NULL, "
+        f"tsv TSVECTOR GENERATED ALWAYS AS (to_tsvector('{PG_TEXT_CONFIG}', document)) STORED)",
+        f"CREATE INDEX IF NOT EXISTS ix_{SEARCH_TABLE}_tsv ON {SEARCH_TABLE} USING GIN (tsv)",
+    ],
+}
+
+
+def _dialect(bind):
+    """Dialect name of an engine, connection or session."""
+    bind = bind.get_bind() if hasattr(bind, 'get_bind') else bind
+    return bind.dialect.name
+
+
+def _search_table(dialect):
+    """Lightweight table construct for the index; the gem id column is rowid on SQLite."""
+    return table(SEARCH_TABLE, column('rowid' if dialect == 'sqlite' else 'gem_id'), column('document'))
+
+
+def create_search_index(bind=engine):
+    """Create the search index if it does not exist (migrations do this for deployed databases)."""
+    with bind.begin() as conn:
+        for statement in SEARCH_DDL[_dialect(conn)]:
+            conn.execute(text(statement))
+
+
+def search_terms(q):
+    """Split free text into word terms; anything that is not a word character is dropped."""
+    return re.findall(r'\w+', q or '')
+
+
+def matching_gem_ids(q, dialect):
+    """
+    Select the ids of gems whose document matches every term of q (as a prefix, so 'ali' finds 'alice').
+    Returns None when q has no terms.
+    """
+    terms = search_terms(q)
+    if not terms:
+        return None
+    if dialect == 'sqlite':
+        query = ' '.join(f'"{term}"*' for term in terms)
+        return text(f'SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH :query').bindparams(
+            query=query).columns(rowid=Gem.id.type)
+    query = ' & '.join(f'{term}:*' for term in terms)
+    return text(f"SELECT gem_id FROM {SEARCH_TABLE} WHERE tsv @@ to_tsquery('{PG_TEXT_CONFIG}', :query)").bindparams(
+        query=query).columns(gem_id=Gem.id.type)
+
+
+def _documents(ids=None):
+    """Select (gem id, document) for the given gems (all gems by default); the document is built in SQL."""
+    def part(col):
+        return func.coalesce(cast(col, String), literal(''))
+
+    document = (part(Gem.gem_type) + literal(' ') + part(GemProperties.color) + literal(' ') +
+                part(GemProperties.clarity) + literal(' ') + part(User.username))
+    statement = (select(Gem.id, document).select_from(Gem).outerjoin(GemProperties)
+                 .outerjoin(User, Gem.seller_id == User.id))
+    if ids is not None:
+        statement = statement.where(Gem.id.in_(ids))
+    return statement
+
+
+def unindex_gems(session, ids):
+    """Remove gems from the index in the caller's transaction."""
+    if not ids:
+        return
+    search_table = _search_table(_dialect(session))
+    key = list(search_table.c)[0]
+    session.execute(delete(search_table).where(key.in_(list(ids))))
+
+
+def index_gems(session, ids):
+    """
+    (Re)index gems in the caller's transaction: two statements for any number of gems.
+    The gem changes must already be flushed.
+    """
+    if not ids:
+        return
+    unindex_gems(session, ids)
+    search_table = _search_table(_dialect(session))
+    session.execute(insert(search_table).from_select(list(search_table.c), _documents(list(ids))))
+
+
+def rebuild_search_index(bind=engine):
+    """
+    Rebuild the whole index from the gem table in one transaction.
+    Use it after writes that bypass the endpoints (bulk loads) or seller renames. Returns the number of gems.
+    """
+    create_search_index(bind)
+    with bind.begin() as conn:
+        search_table = _search_table(_dialect(conn))
+        conn.execute(delete(search_table))
+        conn.execute(insert(search_table).from_select(list(search_table.c), _documents()))
+        return conn.execute(select(func.count()).select_from(search_table)).scalar()
+
+
+if __name__ == '__main__':
+    # Usage: python -m search.search
+    parser = argparse.ArgumentParser(description='Rebuild the gem full-text search index.')
+    parser.parse_args()
+    engine.echo = False
+    start = time.perf_counter()
+    count = rebuild_search_index()
+    print(f'indexed {count} gems in {time.perf_counter() - start:.1f}s')
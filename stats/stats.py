@@ -0,0 +1,196 @@
+import argparse  # For the refresh command line
+import bisect  # For finding a size bucket
+import time  # For reporting the refresh time
+
+from sqlalchemy import and_, case, delete, func, insert, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlmodel import select
+
+from db.db import engine  # Import the database engine
+from models.gem_models import Gem, GemProperties, GemStats, GemTypes, GemColor, GemClarity  # Import gem models
+
+# Lower edges (in carats) of the size histogram buckets; the last bucket is open-ended
+SIZE_BUCKETS = (0, 0.5, 1, 1.5, 2, 3, 4, 5)
+# Columns identifying a summary cell
+CELL_COLUMNS = ('gem_type', 'color', 'clarity', 'size_bucket', 'available')
+# Facets reported by /gems/stats, with the conversion from the stored cell value to the response value
+FACETS = {
+    'gem_type': lambda v: GemTypes(v).value,
+    'color': lambda v: v or None,
+    'clarity': lambda v: v or None,
+}
+
+stats_table = GemStats.__table__
+
+
+def size_bucket(size):
+    """Index of the SIZE_BUCKETS bucket a size falls into."""
+    return max(bisect.bisect_right(SIZE_BUCKETS, size or 0) - 1, 0)
+
+
+def size_bucket_expression(size):
+    """SQL equivalent of size_bucket() for a size column."""
+    return case(*((size < edge, i) for i, edge in enumerate(SIZE_BUCKETS[1:])), else_=len(SIZE_BUCKETS) - 1)
+
+
+def gem_snapshot(session, gem):
+    """
+    Return the summary cell and price a gem currently counts towards, as a (cell, price) pair.
+    Call it before and after changing a gem and pass both to record_gem_change.
+    """
+    props = session.get(GemProperties, gem.gem_properties_id) if gem.gem_properties_id else None
+    cell = {
+        'gem_type': GemTypes(gem.gem_type),
+        'color': GemColor(props.color).value if props and props.color else '',
+        'clarity': int(props.clarity) if props and props.clarity else 0,
+        'size_bucket': size_bucket(props.size if props else None),
+        'available': bool(gem.available),
+    }
+    return cell, float(gem.price)
+
+
+def _add(session, cell, count, total, low, high):
+    """Count gems into a cell, creating the cell if needed (one upsert)."""
+    if session.get_bind().dialect.name == 'sqlite':
+        upsert = sqlite_insert
+    else:
+        from sqlalchemy.dialects.postgresql import insert as upsert  # Only loaded when running on PostgreSQL
+    c = stats_table.c
+    statement = upsert(stats_table).values(**cell, gem_count=count, price_sum=total, price_min=low, price_max=high)
+    session.execute(statement.on_conflict_do_update(index_elements=list(CELL_COLUMNS), set_={
+        'gem_count': c.gem_count + count,
+        'price_sum': c.price_sum + total,
+        'price_min': case((c.price_min < low, c.price_min), else_=low),
+        'price_max': case((c.price_max > high, c.price_max), else_=high),
+    }))
+
+
+def _remove(session, cell, count, total, low, high):
+    """
+    Count gems out of a cell. min/max are only recomputed (from the gems in that cell)
+    when a removed price was one of them; empty cells are deleted.
+    """
+    c = stats_table.c
+    where = and_(*(c[name] == value for name, value in cell.items()))
+    session.execute(update(stats_table).where(where).values(gem_count=c.gem_count - count,
+                                                            price_sum=c.price_sum - total))
+    row = session.execute(select(c.gem_count, c.price_min, c.price_max).where(where)).first()
+    if row is None:
+        return
+    if row.gem_count <= 0:
+        session.execute(delete(stats_table).where(where))
+    elif low <= row.price_min or high >= row.price_max:
+        size = GemProperties.size
+        bucket = cell['size_bucket']
+        gems = (select(func.min(Gem.price), func.max(Gem.price)).select_from(Gem).outerjoin(GemProperties)
+                .where(Gem.gem_type == cell['gem_type'], Gem.available == cell['available'],
+                       size_bucket_expression(func.coalesce(size, 0)) == bucket,
+                       GemProperties.color == GemColor(cell['color']) if cell['color'] else
+                       GemProperties.color.is_(None),
+                       GemProperties.clarity == GemClarity(cell['clarity']) if cell['clarity'] else
+                       GemProperties.clarity.is_(None)))
+        price_min, price_max = session.execute(gems).one()
+        session.execute(update(stats_table).where(where).values(price_min=price_min, price_max=price_max))
+
+
+def _group(snapshots):
+    """Merge (cell, price) snapshots into (cell, count, sum, min, max) per distinct cell."""
+    groups = {}
+    for cell, price in snapshots:
+        key = tuple(cell[name] for name in CELL_COLUMNS)
+        if key in groups:
+            _, count, total, low, high = groups[key]
+            groups[key] = (cell, count + 1, total + price, min(low, price), max(high, price))
+        else:
+            groups[key] = (cell, 1, price, price, price)
+    return groups.values()
+
+
+def record_gem_changes(session, changes):
+    """
+    Apply a batch of (before, after) gem snapshots to the summary table, in the caller's transaction.
+    before is None for inserts and after is None for deletes; the changes must already be flushed.
+    Issues one statement (or a few, for removals) per affected cell, not per gem.
+    """
+    changes = [(before, after) for before, after in changes if before != after]
+    for group in _group(before for before, _ in changes if before is not None):
+        _remove(session, *group)
+    for group in _group(after for _, after in changes if after is not None):
+        _add(session, *group)
+
+
+def record_gem_change(session, before=None, after=None):
+    """
+    Apply a gem insert (before=None), delete (after=None) or update to the summary table,
+    in the caller's transaction. The change must already be flushed.
+    """
+    record_gem_changes(session, [(before, after)])
+
+
+def refresh_gem_stats(bind=engine):
+    """
+    Rebuild the summary table from the gem table in one transaction.
+    Use it after writes that bypass the endpoints (bulk loads, repricing). Returns the number of cells.
+    """
+    size = func.coalesce(GemProperties.size, 0)
+    bucket = size_bucket_expression(size).label('size_bucket')
+    aggregate = (select(Gem.gem_type, GemProperties.color, GemProperties.clarity, bucket, Gem.available,
+                        func.count(Gem.id), func.sum(Gem.price), func.min(Gem.price), func.max(Gem.price))
+                 .select_from(Gem).outerjoin(GemProperties)
+                 .group_by(Gem.gem_type, GemProperties.color, GemProperties.clarity, bucket, Gem.available))
+    with bind.begin() as conn:
+        rows = [{
+            'gem_type': gem_type, 'color': GemColor(color).value if color else '',
+            'clarity': int(clarity) if clarity else 0, 'size_bucket': bucket, 'available': available,
+            'gem_count': count, 'price_sum': price_sum, 'price_min': price_min, 'price_max': price_max,
+        } for gem_type, color, clarity, bucket, available, count, price_sum, price_min, price_max
+            in conn.execute(aggregate)]
+        conn.execute(delete(stats_table))
+        if rows:
+            conn.execute(insert(stats_table), rows)
+    return len(rows)
+
+
+def _summary(cells):
+    """count/min/max/avg price and size histogram over a list of cells."""
+    count = sum(cell.gem_count for cell in cells)
+    histogram = [0] * len(SIZE_BUCKETS)
+    for cell in cells:
+        histogram[cell.size_bucket] += cell.gem_count
+    return {
+        'count': count,
+        'min_price': min((cell.price_min for cell in cells), default=None),
+        'max_price': max((cell.price_max for cell in cells), default=None),
+        'avg_price': round(sum(cell.price_sum for cell in cells) / count, 2) if count else None,
+        'size_histogram': histogram,
+    }
+
+
+async def gem_stats_async(session, available=None):
+    """
+    Facet counts, price ranges and size histograms for all gems (or only available/unavailable ones),
+    aggregated from the summary table, so the cost depends on the number of cells, not gems.
+    """
+    statement = select(GemStats)
+    if available is not None:
+        statement = statement.where(GemStats.available == available)
+    cells = (await session.exec(statement)).all()
+    stats = _summary(cells)
+    stats['size_buckets'] = list(SIZE_BUCKETS)
+    for facet, value_of in FACETS.items():
+        groups = {}
+        for cell in cells:
+            groups.setdefault(value_of(getattr(cell, facet)), []).append(cell)
+        stats[facet] = [{'value': value, **_summary(group)}
+                        for value, group in sorted(groups.items(), key=lambda item: str(item[0]))]
+    return stats
+
+
+if __name__ == '__main__':
+    # Usage: python -m stats.stats
+    parser = argparse.ArgumentParser(description='Rebuild the gem statistics summary table.')
+    parser.parse_args()
+    engine.echo = False
+    start = time.perf_counter()
+    cells = refresh_gem_stats()
+    print(f'rebuilt {cells} stats cells in {time.perf_counter() - start:.1f}s')